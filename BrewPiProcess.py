@@ -18,26 +18,16 @@
 import pprint
 import os
 import sys
-from time import sleep
-from distutils.version import LooseVersion
-
-try:
-    import psutil
-    if LooseVersion(psutil.__version__) < LooseVersion("2.0"):
-        print >> sys.stderr, "Your version of pstuil is %s \n" \
-        "BrewPi requires psutil 2.0 or higher, please upgrade your version of psutil.\n" \
-        "This can best be done via pip, please run:\n" \
-        "  sudo apt-get install build-essential python-dev python-pip\n" \
-        "  sudo pip install psutil --upgrade\n" % psutil.__version__
-        sys.exit(1)
-
-
-except ImportError:
-    print "BrewPi requires psutil to run, please install it via pip: 'sudo pip install psutil --upgrade"
-    sys.exit(1)
+import glob
+import errno
+import signal
+import time
+import threading
+import simplejson as json
 
 import BrewPiSocket
 import BrewPiUtil as util
+import instanceLock
 
 
 class BrewPiProcess:
@@ -45,22 +35,81 @@ class BrewPiProcess:
     This class represents a running BrewPi process.
     It allows other instances of BrewPi to see if there would be conflicts between them.
     It can also use the socket to send a quit signal or the pid to kill the other instance.
+
+    A running instance holds a lock for its config file, its serial port and its socket. The locks are released by the
+    operating system when the process exits, so a crashed instance never blocks a new one.
+    Next to the config file lock, the instance keeps a record with its pid, config file, port and socket.
     """
     def __init__(self):
         self.pid = None  # pid of process
         self.cfg = None  # config file of process, full path
         self.port = None  # serial port the process is connected to
         self.sock = None  # BrewPiSocket object which the process is connected to
+        self.supervisor = None  # pid of the supervisor that restarts the process, when started with --supervise
+        self.locks = []  # locks held by this process, when it is the process calling this function
 
     def as_dict(self):
         """
         Returns: member variables as a dictionary
         """
-        return self.__dict__
+        return dict(pid=self.pid, cfg=self.cfg, port=self.port, sock=self.sock)
 
-    def quit(self):
+    def lockNames(self):
+        """
+        Returns: list of (description, lock name) for the resources that cannot be shared with another instance
+        """
+        return [("config file", instanceLock.configLockName(self.cfg)),
+                ("serial port", instanceLock.portLockName(self.port)),
+                ("socket", instanceLock.socketLockName(self.sock.type, self.sock.file, self.sock.host, self.sock.port))]
+
+    def record(self):
+        """
+        Returns: the record other processes read to find this process, as a dict that can be written as JSON
+        """
+        return dict(pid=self.pid, cfg=self.cfg, port=self.port, supervisor=self.supervisor,
+                    socket=dict(type=self.sock.type, file=self.sock.file, host=self.sock.host, port=self.sock.port))
+
+    def conflicts(self):
+        """
+        Checks the locks of register without taking them, for a process that needs to know if it can start
+        Returns: list of descriptions of the resources that are used by another instance already
+        """
+        return [description for description, name in self.lockNames() if instanceLock.FileLock(name).isLocked()]
+
+    def register(self, heldLocks=(), timeout=0):
+        """
+        Takes the locks for the config file, serial port and socket of this process and writes its record.
+
+        Params:
+        heldLocks: locks that this process has taken already, for example the config file lock taken at startup
+        timeout: seconds to wait for another instance to release a lock
+
+        Returns:
+        bool: True when all locks are taken, False when another instance holds one of them
+        """
+        held = dict((lock.name, lock) for lock in heldLocks if lock is not None and lock.isHeld())
+        for description, name in self.lockNames():
+            lock = held.get(name) or instanceLock.FileLock(name)
+            if not lock.acquire(timeout):
+                print "Conflict: same %s as another BrewPi instance already running." % description
+                self.unregister()
+                return False
+            self.locks.append(lock)
+        writeRecord(recordPath(self.cfg), self.record())
+        return True
+
+    def unregister(self):
+        """
+        Releases the locks taken by register
+        """
+        for lock in self.locks:
+            lock.release()
+        self.locks = []
+
+    def sendQuit(self):
         """
-        Sends a friendly quit message to this BrewPi process over its socket to aks the process to exit.
+        Sends a friendly quit message to this BrewPi process over its socket to ask the process to exit.
+        Returns: True when the message was sent
         """
         if self.sock is not None:
             conn = self.sock.connect()
@@ -69,39 +118,194 @@ class BrewPiProcess:
                 conn.close()  # do not shutdown the socket, other processes are still connected to it.
                 print "Quit message sent to BrewPi instance with pid %s!" % self.pid
                 return True
-            else:
-                print "Could not connect to socket of BrewPi process, maybe it just started and is not listening yet."
-                print "Could not send quit message to BrewPi instance with pid %d!" % self.pid
-                print "Killing it instead!"
-                self.kill()
+        print "Could not send quit message to BrewPi instance with pid %s, " % self.pid + \
+              "maybe it just started and is not listening yet."
+        return False
+
+    def quit(self):
+        """
+        Asks this BrewPi process to exit and waits until it has exited. It is terminated when it does not quit in time.
+        Returns: True when the process has exited
+        """
+        return not QuitCoordinator([self]).run()
+
+    def isRunning(self):
+        """
+        Returns: True when the process has not exited yet. A process that has exited no longer holds its config file
+        lock, even when it was not reaped by its parent yet.
+        """
+        try:
+            os.kill(self.pid, 0)
+        except OSError, e:
+            if e.errno == errno.ESRCH:
+                return False
+        return instanceLock.FileLock(instanceLock.configLockName(self.cfg)).isLocked()
+
+    def signal(self, signum, pid=None):
+        """
+        Sends a signal to this process, or to another process related to it like its supervisor
+        Returns: False when the process has already exited
+        """
+        if pid is None:
+            pid = self.pid
+        try:
+            os.kill(pid, signum)
+        except OSError, e:
+            if e.errno == errno.ESRCH:
                 return False
+            print >> sys.stderr, "Cannot send signal to process %d, you need root permission to do that." % pid
+        return True
 
     def kill(self):
         """
         Kills this BrewPiProcess with force, use when quit fails.
         """
-        process = psutil.Process(self.pid)  # get psutil process my pid
         try:
-            process.kill()
+            os.kill(self.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))  # Windows has no SIGKILL
             print "SIGKILL sent to BrewPi instance with pid %d!" % self.pid
-        except psutil.AccessDenied:
-            print >> sys.stderr, "Cannot kill process %d, you need root permission to do that." % self.pid
-            print >> sys.stderr, "Is the process running under the same user?"
-
-    def conflict(self, otherProcess):
-        if self.pid == otherProcess.pid:
-            return 0  # this is me! I don't have a conflict with myself
-        if otherProcess.cfg == self.cfg:
-            print "Conflict: same config file as another BrewPi instance already running."
-            return 1
-        if otherProcess.port == self.port:
-            print "Conflict: same serial port as another BrewPi instance already running."
-            return 1
-        if [otherProcess.sock.type, otherProcess.sock.file, otherProcess.sock.host, otherProcess.sock.port] == \
-                [self.sock.type, self.sock.file, self.sock.host, self.sock.port]:
-            print "Conflict: same socket as another BrewPi instance already running."
-            return 1
-        return 0
+        except OSError, e:
+            if e.errno == errno.ESRCH:
+                print "BrewPi instance with pid %d has already exited" % self.pid
+            else:
+                print >> sys.stderr, "Cannot kill process %d, you need root permission to do that." % self.pid
+                print >> sys.stderr, "Is the process running under the same user?"
+
+
+def fromConfig(configFile, config=None):
+    """
+    Creates a BrewPiProcess object for the calling process from its config file
+    Params:
+    configFile: path to the config file
+    config: the config read from configFile, read again when not given
+    Returns: BrewPiProcess object
+    """
+    if config is None:
+        config = util.readCfgWithDefaults(configFile)
+    bp = BrewPiProcess()
+    bp.pid = os.getpid()
+    bp.cfg = os.path.abspath(configFile)
+    bp.port = config['port']
+    bp.sock = BrewPiSocket.BrewPiSocket(config)
+    if os.environ.get('BREWPI_SUPERVISOR_PID'):
+        bp.supervisor = int(os.environ['BREWPI_SUPERVISOR_PID'])  # set by the supervisor for its child
+    return bp
+
+
+def fromRecord(record):
+    """
+    Creates a BrewPiProcess object from the record written by another process
+    Returns: BrewPiProcess object
+    """
+    bp = BrewPiProcess()
+    bp.pid = record['pid']
+    bp.cfg = record['cfg']
+    bp.port = record['port']
+    bp.supervisor = record.get('supervisor')
+    bp.sock = BrewPiSocket.BrewPiSocket({'useInetSocket': False, 'scriptPath': ''})
+    bp.sock.type = record['socket']['type']
+    bp.sock.file = record['socket']['file']
+    bp.sock.host = record['socket']['host']
+    bp.sock.port = record['socket']['port']
+    return bp
+
+
+def recordPath(configFile):
+    return os.path.join(instanceLock.lockDir(), instanceLock.configLockName(configFile) + '.json')
+
+
+def writeRecord(path, record):
+    """
+    Writes the record atomically, so a process reading it never sees half a record
+    """
+    util.writeFileAtomically(path, lambda f: json.dump(record, f))
+
+
+class QuitCoordinator:
+    """
+    Stops BrewPi processes in parallel. All processes are asked to quit over their socket at the same time.
+    A process that has not exited after quitTimeout seconds gets SIGTERM, and SIGKILL when it has not exited
+    termTimeout seconds later. The coordinator returns as soon as all processes have exited.
+    For a process that runs under a supervisor, SIGTERM is sent to the supervisor, which stops its child and does not
+    restart it. SIGKILL is sent to both.
+    """
+    QUIT = 'quit'
+    TERM = 'term'
+    KILL = 'kill'
+
+    def __init__(self, processes, quitTimeout=5.0, termTimeout=2.0, pollInterval=0.05):
+        self.processes = list(processes)
+        self.quitTimeout = quitTimeout
+        self.termTimeout = termTimeout
+        self.pollInterval = pollInterval
+        self.escalated = []  # (pid, stage) for each signal that had to be sent
+
+    def sendQuitMessages(self):
+        """
+        Sends the quit messages in parallel, so one busy process does not delay the others
+        Returns: dict with for each pid whether the message was sent
+        """
+        sent = {}
+
+        def send(process):
+            sent[process.pid] = process.sendQuit()
+
+        threads = [threading.Thread(target=send, args=(p,)) for p in self.processes]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join(self.quitTimeout)
+        return sent
+
+    def escalate(self, process, stage):
+        if stage == QuitCoordinator.TERM:
+            if process.supervisor:
+                print "BrewPi instance with pid %s did not quit in time, " % process.pid + \
+                      "sending SIGTERM to its supervisor with pid %s" % process.supervisor
+                process.signal(signal.SIGTERM, process.supervisor)
+            else:
+                print "BrewPi instance with pid %s did not quit in time, sending SIGTERM" % process.pid
+                process.signal(signal.SIGTERM)
+        else:
+            print "BrewPi instance with pid %s did not exit after SIGTERM, sending SIGKILL" % process.pid
+            kill = getattr(signal, 'SIGKILL', signal.SIGTERM)  # Windows has no SIGKILL
+            if process.supervisor:
+                process.signal(kill, process.supervisor)  # first, so it cannot restart its child
+            process.signal(kill)
+        self.escalated.append((process.pid, stage))
+
+    def run(self):
+        """
+        Returns: list of processes that are still running, which is empty when all processes have exited
+        """
+        now = time.time()
+        sent = self.sendQuitMessages()
+        # stage and deadline of the processes that have not exited yet
+        waiting = {}
+        for p in self.processes:
+            waiting[p.pid] = (p, QuitCoordinator.QUIT, now + self.quitTimeout)
+            if not sent.get(p.pid):
+                self.escalate(p, QuitCoordinator.TERM)
+                waiting[p.pid] = (p, QuitCoordinator.TERM, now + self.termTimeout)
+
+        while waiting:
+            now = time.time()
+            for pid, (p, stage, deadline) in waiting.items():
+                if not p.isRunning():
+                    del waiting[pid]
+                elif now >= deadline:
+                    if stage == QuitCoordinator.QUIT:
+                        self.escalate(p, QuitCoordinator.TERM)
+                        waiting[pid] = (p, QuitCoordinator.TERM, now + self.termTimeout)
+                    elif stage == QuitCoordinator.TERM:
+                        self.escalate(p, QuitCoordinator.KILL)
+                        waiting[pid] = (p, QuitCoordinator.KILL, now + self.termTimeout)
+                    else:
+                        print >> sys.stderr, "BrewPi instance with pid %s could not be stopped" % p.pid
+                        del waiting[pid]
+            if waiting:
+                time.sleep(self.pollInterval)
+        return [p for p in self.processes if p.isRunning()]
 
 
 class BrewPiProcesses():
@@ -113,48 +317,23 @@ class BrewPiProcesses():
 
     def update(self):
         """
-        Update the list of BrewPi processes by receiving them from the system with psutil.
+        Update the list of BrewPi processes by reading the records of the instances that hold their config file lock.
+        A record of an instance that has exited is ignored, its lock is no longer held.
         Returns: list of BrewPiProcess objects
         """
         bpList = []
-        matching = []
-
-        # some OS's (OS X) do not allow processes to read info from other processes. 
-        try:
-            matching = [p for p in psutil.process_iter() if any('python' in p.name() and 'brewpi.py'in s for s in p.cmdline())]
-        except psutil.AccessDenied:
-            pass
-
-        for p in matching:
-            bp = self.parseProcess(p)
-            if bp:
-                bpList.append(bp)
+        for path in glob.glob(os.path.join(instanceLock.lockDir(), 'cfg-*.json')):
+            name = os.path.basename(path)[:-len('.json')]
+            if not instanceLock.FileLock(name).isLocked():
+                continue
+            try:
+                with open(path) as f:
+                    bpList.append(fromRecord(json.load(f)))
+            except (IOError, ValueError, KeyError, TypeError):
+                continue  # the instance has just started and not written its record yet
         self.list = bpList
         return self.list
 
-    def parseProcess(self, process):
-        """
-        Converts a psutil process into a BrewPiProcess object by parsing the config file it has been called with.
-        Params: a psutil.Process object
-        Returns: BrewPiProcess object
-        """
-        bp = BrewPiProcess()
-        try:
-            bp.pid = process._pid
-            cfg = [s for s in process.cmdline() if '.cfg' in s]  # get config file argument
-        except psutil.NoSuchProcess:
-            # process no longer exists
-            return None
-        if cfg:
-            cfg = cfg[0]  # add full path to config file
-        else:
-            # use default config file location
-            cfg = util.scriptPath() + "/settings/config.cfg"
-        bp.cfg = util.readCfgWithDefaults(cfg)
-        bp.port = bp.cfg['port']
-        bp.sock = BrewPiSocket.BrewPiSocket(bp.cfg)
-        return bp
-
     def get(self):
         """
         Returns a non-updated list of BrewPiProcess objects
@@ -163,47 +342,33 @@ class BrewPiProcesses():
 
     def me(self):
         """
-        Get a BrewPiProcess object of the process this function is called from
+        Get a BrewPiProcess object of the process this function is called from, None when it is not registered
         """
         myPid = os.getpid()
-        myProcess = psutil.Process(myPid)
-        return self.parseProcess(myProcess)
+        for p in self.update():
+            if p.pid == myPid:
+                return p
+        return None
 
-    def findConflicts(self, process):
+    def findConflicts(self, process, heldLocks=(), timeout=0):
         """
         Finds out if the process given as argument will conflict with other running instances of BrewPi
         Always returns a conflict if a firmware update is running
+        When there are no conflicts, the process is registered as a running instance.
 
         Params:
-        process: a BrewPiProcess object that will be compared with other running instances
+        process: a BrewPiProcess object for the calling process
+        heldLocks: locks the process has taken already
+        timeout: seconds to wait for conflicting instances to exit
 
         Returns:
         bool: True means there are conflicts, False means no conflict
         """
-
-                # some OS's (OS X) do not allow processes to read info from other processes.
-        matching = []
-        try:
-            matching = [p for p in psutil.process_iter() if any('python' in p.name() and 'flashDfu.py'in s for s in p.cmdline())]
-        except psutil.AccessDenied:
-            pass
-
-        if len(matching) > 0:
+        if instanceLock.firmwareUpdateRunning():
+            print "Conflict: a firmware update is running."
             return 1
-
-        try:
-            matching = [p for p in psutil.process_iter() if any('python' in p.name() and 'updateFirmware.py'in s for s in p.cmdline())]
-        except psutil.AccessDenied:
-            pass
-
-        if len(matching) > 0:
+        if not process.register(heldLocks, timeout):
             return 1
-
-        for p in self.list:
-            if process.pid == p.pid:  # skip the process itself
-                continue
-            elif process.conflict(p):
-                return 1
         return 0
 
     def as_dict(self):
@@ -225,17 +390,19 @@ class BrewPiProcesses():
         """
         return repr(self.as_dict())
 
-    def quitAll(self):
+    def others(self):
         """
-        Ask all running BrewPi processes to exit
+        Returns: updated list of BrewPiProcess objects, except for the process calling this function
         """
         myPid = os.getpid()
-        self.update()
-        for p in self.list:
-            if p.pid == myPid:  # do not send quit message to myself
-                continue
-            else:
-                p.quit()
+        return [p for p in self.update() if p.pid != myPid]
+
+    def quitAll(self, quitTimeout=5.0, termTimeout=2.0):
+        """
+        Ask all running BrewPi processes to exit and wait until they have exited, see QuitCoordinator
+        Returns: list of processes that could not be stopped
+        """
+        return QuitCoordinator(self.others(), quitTimeout, termTimeout).run()
 
     def stopAll(self, dontRunFilePath):
         """
@@ -247,13 +414,7 @@ class BrewPiProcesses():
             dontrunfile = open(dontRunFilePath, "w")
             dontrunfile.write("1")
             dontrunfile.close()
-        myPid = os.getpid()
-        self.update()
-        for p in self.list:
-            if p.pid == myPid:  # do not send quit message to myself
-                continue
-            else:
-                p.quit()
+        return self.quitAll()
 
     def killAll(self):
         """
@@ -291,7 +452,6 @@ def testQuitAll():
     print ("Running instances of BrewPi before asking them to quit:")
     pprint.pprint(allScripts)
     allScripts.quitAll()
-    sleep(2)
     allScripts.update()
     print ("Running instances of BrewPi after asking them to quit:")
     pprint.pprint(allScripts)
@@ -98,6 +98,28 @@ def scriptPath():
     return os.path.dirname(__file__)
 
 
+def writeFileAtomically(fileName, write, mode='w'):
+    """
+    Writes a file through a temporary file that is renamed when it is complete, so a crash or a process reading the
+    file at the same time never sees half a file.
+    write: function that writes the content to the open file object it is called with
+    Raises IOError or OSError when the file cannot be written, the temporary file is removed then
+    """
+    tempFileName = fileName + '.%d.tmp' % os.getpid()  # unique when processes write the same file
+    try:
+        with open(tempFileName, mode) as f:
+            write(f)
+        if sys.platform.startswith('win') and os.path.exists(fileName):
+            os.remove(fileName)  # rename does not replace an existing file on Windows
+        os.rename(tempFileName, fileName)
+    except (IOError, OSError):
+        try:
+            os.remove(tempFileName)
+        except OSError:
+            pass
+        raise
+
+
 def removeDontRunFile(path='/var/www/do_not_run_brewpi'):
     if os.path.isfile(path):
         os.remove(path)
@@ -110,9 +132,55 @@ def findSerialPort(bootLoader):
     (port, name) = autoSerial.detect_port(bootLoader)
     return port
 
+def openSerialPort(port, baud_rate, time_out):
+    """
+    Opens a serial port by name or URL. Next to the URL's supported by pyserial, replay://<trace file> can be used
+    to replay a trace recorded with serialTrace.py and sim://?<options> connects to a simulated controller
+    """
+    if port.startswith('replay://'):
+        import serialTrace
+        ser = serialTrace.SerialReplayer.fromUrl(port, timeout=time_out)
+        ser.open()
+        return ser
+    if port.startswith('sim://'):
+        import controllerSimulator
+        ser = controllerSimulator.SimulatedSerial.fromUrl(port, timeout=time_out)
+        ser.open()
+        return ser
+    return serial.serial_for_url(port, baudrate=baud_rate, timeout=time_out, write_timeout=0)
+
+def serialFileDescriptor(ser):
+    """
+    Returns: file descriptor of an open serial port that can be passed to another process,
+    None for ports opened with an URL handler or simulated ports
+    """
+    if os.name == 'posix' and isinstance(ser, serial.Serial) and ser.isOpen():
+        return ser.fd
+    return None
+
+def serialFromFileDescriptor(fd, port, baud_rate=57600, time_out=0.1):
+    """
+    Creates a serial object for a port that was opened by another process, which passed the file descriptor.
+    The port is not configured again, the port settings of the other process are kept.
+    Only for pyserial 3 on posix systems, it sets up what Serial.open() would do.
+    """
+    import fcntl
+    ser = serial.Serial(baudrate=baud_rate, timeout=time_out, write_timeout=0)
+    ser.port = port  # does not open the port, because the serial object is not open
+    ser.fd = fd
+    # pipes to cancel blocking reads and writes
+    ser.pipe_abort_read_r, ser.pipe_abort_read_w = os.pipe()
+    ser.pipe_abort_write_r, ser.pipe_abort_write_w = os.pipe()
+    fcntl.fcntl(ser.pipe_abort_read_r, fcntl.F_SETFL, os.O_NONBLOCK)
+    fcntl.fcntl(ser.pipe_abort_write_r, fcntl.F_SETFL, os.O_NONBLOCK)
+    ser.is_open = True
+    return ser
+
 def setupSerial(config, baud_rate=57600, time_out=0.1):
+    import portProbe
     ser = None
     dumpSerial = config.get('dumpSerial', False)
+    traceSerial = config.get('traceSerial', None)
 
     error1 = None
     error2 = None
@@ -120,24 +188,9 @@ def setupSerial(config, baud_rate=57600, time_out=0.1):
     tries = 0
     logMessage("Opening serial port")
     while tries < 10:
-        error = ""
-        for portSetting in [config['port'], config['altport']]:
-            if portSetting == None or portSetting == 'None' or portSetting == "none":
-                continue  # skip None setting
-            if portSetting == "auto":
-                port = findSerialPort(bootLoader=False)
-                if not port:
-                    error = "Could not find compatible serial devices \n"
-                    continue # continue with altport
-            else:
-                port = portSetting
-            try:
-                ser = serial.serial_for_url(port, baudrate=baud_rate, timeout=time_out, write_timeout=0)
-                if ser:
-                    break
-            except (IOError, OSError, serial.SerialException) as e:
-                # error += '0}.\n({1})'.format(portSetting, str(e))
-                error += str(e) + '\n'
+        # when port and altport, or port = auto, give more than one port, they are probed at the same time
+        ser, error = portProbe.openPort([config['port'], config['altport']], baud_rate, time_out,
+                                        probeTimeout=float(config.get('portProbeTimeout', 5.0)))
         if ser:
             break
         tries += 1
@@ -147,9 +200,20 @@ def setupSerial(config, baud_rate=57600, time_out=0.1):
         # discard everything in serial buffers
         ser.flushInput()
         ser.flushOutput()
+        wrapSerial(ser, dumpSerial, traceSerial)
     else:
          logMessage("Errors while opening serial port: \n" + error)
 
+    return ser
+
+
+def wrapSerial(ser, dumpSerial=False, traceSerial=None, traceWriter=None):
+    """
+    Adds the debug wrappers to the read and write methods of serial port ser
+    dumpSerial: print all serial traffic
+    traceSerial: file name to record all serial traffic in
+    traceWriter: SerialTraceWriter to continue, instead of starting a new trace file
+    """
     # yes this is monkey patching, but I don't see how to replace the methods on a dynamically instantiated type any other way
     if dumpSerial:
         ser.readOriginal = ser.read
@@ -161,13 +225,29 @@ def setupSerial(config, baud_rate=57600, time_out=0.1):
             return r
 
         def writeAndDump(data):
-            ser.writeOriginal(data)
+            written = ser.writeOriginal(data)
             sys.stderr.write(data)
+            return written  # checked by BackGroundSerial to detect a lost port
 
         ser.read = readAndDump
         ser.write = writeAndDump
 
-    return ser
+    # record all serial traffic with timestamps, to be replayed later with serialTrace.py
+    if traceWriter is not None:
+        import serialTrace
+        serialTrace.recordSerial(ser, None, traceWriter)
+    elif traceSerial:
+        import serialTrace
+        logMessage("Recording serial traffic to " + traceSerial)
+        serialTrace.recordSerial(ser, traceSerial)
+
+
+def copySerialWrappers(ser, original):
+    """
+    Wraps serial port ser like original, when it replaces original after the port was lost. A trace continues in the
+    same file.
+    """
+    wrapSerial(ser, hasattr(original, 'readOriginal'), traceWriter=getattr(original, 'traceWriter', None))
 
 
 # remove extended ascii characters from string, because they can raise UnicodeDecodeError later
@@ -3,6 +3,7 @@ Automatically finds a compatible device (Photon, Core, Arduino), modified from M
 """
 
 from __future__ import absolute_import
+import os
 from serial.tools import list_ports
 
 known_devices = [
@@ -64,6 +65,33 @@ def detect_port(bootLoader = False):
         pass
     return port
 
+def device_identity(port):
+    """
+    :return: a string that identifies the device on the port: the USB vendor id, product id and serial number
+             when the port is a USB device with a serial number, otherwise the port name
+    :rtype: str
+    """
+    try:
+        path = os.path.realpath(port)
+        for p in find_all_serial_ports():
+            if p.device in (port, path):
+                return port_identity(p)
+    except (AttributeError, OSError, IOError):
+        pass  # older pyserial versions do not have the serial number
+    return "port:{0}".format(port)
+
+
+def port_identity(p):
+    """
+    :param p: serial port info, as returned by find_all_serial_ports
+    :return: the identity of the device on the port, like device_identity, without listing the ports again
+    :rtype: str
+    """
+    if getattr(p, 'serial_number', None):
+        return "usb:{0}:{1}:{2}".format(p.vid, p.pid, p.serial_number)
+    return "port:{0}".format(p.device)
+
+
 def configure_serial_for_device(s, d):
     """ configures the serial connection for the given device.
     :param s the Serial instance to configure
@@ -2,23 +2,130 @@ from __future__ import print_function
 
 import threading
 import Queue
+import collections
 import sys
 import time
 from BrewPiUtil import printStdErr
 from BrewPiUtil import logMessage
+import BrewPiUtil as util
+import serial
 from serial import SerialException
 from expandLogMessage import filterOutLogMessages
+import autoSerial
+
+class LineQueue():
+    """
+    Bounded queue for lines received from the controller, with an overflow policy per line type (first character).
+    - lines of a type in 'coalesce' replace an unread line of the same type, only the latest one is kept
+    - lines of a type in 'keep' are never dropped. When the queue is full, the oldest line that can be dropped is
+      removed to make room. If there is no such line, the queue grows beyond its maximum size.
+    - other lines are dropped when the queue is full
+    - when rate (lines per second) is set, lines are rate limited with a token bucket that holds up to 'burst' lines
+    It implements put and get_nowait like Queue.Queue and keeps statistics on its use.
+    """
+    def __init__(self, maxsize=0, coalesce='', keep='', rate=None, burst=1):
+        self.lines = collections.deque()
+        self.lock = threading.Lock()
+        self.maxsize = maxsize
+        self.coalesce = coalesce
+        self.keep = keep
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_token_update = time.time()
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.overflowing = False
+
+    def put(self, line):
+        with self.lock:
+            kind = line[:1]
+            if self.rate is not None and not self.__take_token():
+                self.rate_limited += 1
+                return
+            if kind in self.coalesce:
+                for i in range(len(self.lines)):
+                    if self.lines[i][:1] == kind:
+                        del self.lines[i]
+                        self.coalesced += 1
+                        break
+            if self.maxsize > 0 and len(self.lines) >= self.maxsize:
+                if not self.overflowing:
+                    self.overflowing = True
+                    logMessage("Warning: serial queue is full, dropping lines from controller")
+                if not self.__make_room(kind):
+                    self.dropped += 1
+                    return
+            else:
+                self.overflowing = False
+            self.lines.append(line)
+            self.high_water = max(self.high_water, len(self.lines))
+
+    def __make_room(self, kind):
+        """
+        Returns: True when the line can be added to the full queue
+        """
+        if kind not in self.keep:
+            return False
+        for i in range(len(self.lines)):
+            if self.lines[i][:1] not in self.keep:
+                del self.lines[i]
+                self.dropped += 1
+                break
+        return True
+
+    def __take_token(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_token_update) * self.rate)
+        self.last_token_update = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def get_nowait(self):
+        with self.lock:
+            if not self.lines:
+                raise Queue.Empty
+            return self.lines.popleft()
+
+    def qsize(self):
+        return len(self.lines)
+
+    def get_stats(self):
+        return {'size': len(self.lines),
+                'maxSize': self.maxsize,
+                'highWater': self.high_water,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'rateLimited': self.rate_limited}
+
 
 class BackGroundSerial():
-    def __init__(self, serial_port):
+    def __init__(self, serial_port, reconnect_timeout=None, max_lines=1000, max_messages=200, message_rate=20.0,
+                 message_burst=100):
         self.buffer = ''
         self.ser = serial_port
-        self.queue = Queue.Queue()
-        self.messages = Queue.Queue()
+        # Only the latest temperatures and control variables are relevant, settings, constants and device updates
+        # are always kept. Log messages are rate limited, to not flood the logs when the controller is misbehaving.
+        self.queue = LineQueue(maxsize=max_lines, coalesce='TV', keep='SCU')
+        self.messages = LineQueue(maxsize=max_messages, rate=message_rate, burst=message_burst)
         self.thread = None
         self.error = False
         self.fatal_error = None
         self.run = False
+        self.stopped = threading.Event()  # set by stop(), to not wait for the reconnect delay
+        # when the serial port is lost, reconnect in the background thread instead of exiting.
+        # reconnect_timeout (seconds) gives up and sets fatal_error, None keeps trying forever
+        self.reconnect_timeout = reconnect_timeout
+        self.reconnect_delay_min = 0.1
+        self.reconnect_delay_max = 10.0
+        self.reconnecting = False
+        self.reconnect_count = 0
+        self.last_recovery_time = None
+        self.total_recovery_time = 0.0
 
     # public interface only has 4 functions: start/stop/read_line/write
     def start(self):
@@ -27,6 +134,7 @@ class BackGroundSerial():
         self.ser.write_timeout = 2
         self.ser.inter_byte_timeout = 0.01 # necessary because of bug in in_waiting with sockets
         self.run = True
+        self.stopped.clear()
         if not self.thread:
             self.thread = threading.Thread(target=self.__listen_thread)
             self.thread.setDaemon(True)
@@ -34,6 +142,7 @@ class BackGroundSerial():
 
     def stop(self):
         self.run = False
+        self.stopped.set()
         if self.thread:
             self.thread.join() # wait for background thread to terminate
             self.thread = None
@@ -70,6 +179,18 @@ class BackGroundSerial():
                 self.error = True
         return written
 
+    def get_stats(self):
+        """
+        Returns: dict with statistics about the serial connection
+        """
+        return {'port': getattr(self.ser, 'port', None),
+                'reconnecting': self.reconnecting,
+                'reconnectCount': self.reconnect_count,
+                'lastRecoveryTime': self.last_recovery_time,
+                'totalRecoveryTime': self.total_recovery_time,
+                'lines': self.queue.get_stats(),
+                'messages': self.messages.get_stats()}
+
     def exit_on_fatal_error(self):
         if self.fatal_error is not None:
             self.stop()
@@ -102,26 +223,95 @@ class BackGroundSerial():
                         break
 
             if self.error:
-                try:
-                    # try to restore serial by closing and opening again
-                    self.ser.close()
-                    self.ser.open()
-                    # test serial to see if it is restored by writing an empty line (which is ignored by the controller)
-                    if self.writeln("") > 0:
-                        self.error = False
-                    else:
-                        self.fatal_error = 'Lost serial connection. Cannot write to serial'
-
-                except (ValueError, OSError, SerialException) as e:
-                    if self.ser.isOpen():
-                        self.ser.flushInput() # will help to close open handles
-                        self.ser.flushOutput() # will help to close open handles
-                    self.ser.close()
-                    self.fatal_error = 'Lost serial connection. Error: {0})'.format(str(e))
+                self.__reconnect()
 
             # max 10 ms delay. At baud 57600, max 576 characters are received while waiting
             time.sleep(0.01)
 
+    def __close_port(self):
+        try:
+            if self.ser.isOpen():
+                self.ser.flushInput() # will help to close open handles
+                self.ser.flushOutput() # will help to close open handles
+        except (IOError, OSError, ValueError, SerialException):
+            pass
+        try:
+            self.ser.close()
+        except (IOError, OSError, ValueError, SerialException):
+            pass
+
+    def __open_port(self):
+        """
+        Reopens the serial port. When the device re-enumerated under a different name (for example /dev/ttyACM1
+        instead of /dev/ttyACM0), the port is detected again and a new serial object is created with the same settings
+        and the same dump and trace wrappers.
+        Returns: True when the port is open
+        """
+        try:
+            self.ser.open()
+            return True
+        except (IOError, OSError, ValueError, SerialException):
+            pass
+
+        if '://' in str(self.ser.port):
+            return False  # URL handlers (sockets, loop://) cannot be detected again
+        (port, name) = autoSerial.detect_port()
+        if port is None:
+            return False
+        try:
+            new_ser = util.openSerialPort(port, self.ser.baudrate, self.ser.timeout)
+        except (IOError, OSError, ValueError, SerialException):
+            return False
+        if port != self.ser.port:
+            logMessage("Serial device re-detected on port {0}".format(port))
+        util.copySerialWrappers(new_ser, self.ser)
+        new_ser.write_timeout = 2
+        new_ser.inter_byte_timeout = 0.01
+        self.ser = new_ser
+        return True
+
+    def __reconnect(self):
+        """
+        Tries to restore the serial connection with an exponential backoff between attempts.
+        On success, the controller is asked for its version, settings and constants to re-sync.
+        """
+        self.reconnecting = True
+        start_time = time.time()
+        delay = self.reconnect_delay_min
+        logMessage("Lost serial connection, trying to reconnect")
+        while self.run:
+            self.__close_port()
+            if self.__open_port():
+                self.buffer = ''
+                self.error = False
+                # test serial to see if it is restored by writing an empty line (which is ignored by the controller)
+                if self.writeln("") > 0:
+                    break
+                self.error = True
+
+            if self.reconnect_timeout is not None and time.time() - start_time > self.reconnect_timeout:
+                self.__close_port()
+                self.fatal_error = 'Lost serial connection. Could not reconnect within {0} seconds'.format(
+                    self.reconnect_timeout)
+                self.reconnecting = False
+                return
+            self.stopped.wait(delay)  # returns early when stopped
+            delay = min(delay * 2, self.reconnect_delay_max)
+
+        self.reconnecting = False
+        if self.error:
+            return  # stopped while reconnecting
+
+        self.reconnect_count += 1
+        self.last_recovery_time = time.time() - start_time
+        self.total_recovery_time += self.last_recovery_time
+        logMessage("Serial connection restored on port {0} after {1:.1f} seconds".format(
+            self.ser.port, self.last_recovery_time))
+        # request version, settings and constants again to make sure the script is up to date
+        self.writeln('n')
+        self.writeln('s')
+        self.writeln('c')
+
     def __get_line_from_buffer(self):
         while '\n' in self.buffer:
             stripped_buffer, messages = filterOutLogMessages(self.buffer)
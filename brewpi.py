@@ -17,6 +17,23 @@
 
 from __future__ import print_function
 import sys
+import os
+import time
+
+startupTime = time.time()
+
+# When started by cron, exit as fast as possible when the script should not run, before loading anything else
+import instanceLock
+configLock = None  # held while this instance runs, so other instances with the same config file know
+if instanceLock.isCronStart(sys.argv[1:]):
+    configLock, exitReason = instanceLock.cronStartupCheck(sys.argv[1:], os.path.dirname(os.path.abspath(__file__)))
+    if configLock is None:
+        sys.exit(0)  # do not print anything, this will flood the logs
+
+# Run brewpi.py as a child process that is restarted when it exits with an error
+if '--supervise' in sys.argv[1:]:
+    import brewpiSupervisor
+    sys.exit(brewpiSupervisor.main(sys.argv[1:], configLock))
 
 from BrewPiUtil import printStdErr
 from BrewPiUtil import logMessage
@@ -27,14 +44,14 @@ if sys.version_info < (2, 7):
     sys.exit(1)
 
 # standard libraries
-import time
 import socket
-import os
 import getopt
 from pprint import pprint
 import shutil
 import traceback
 import urllib
+import atexit
+import signal
 from distutils.version import LooseVersion
 from serial import SerialException
 
@@ -68,14 +85,25 @@ except ImportError:
 
 #local imports
 import temperatureProfile
-import programController as programmer
+from profileLibrary import ProfileLibrary
 import brewpiJson
 import BrewPiUtil as util
 import brewpiVersion
-import pinList
+import autoSerial
 import expandLogMessage
+from controllerLog import ControllerLog, LogRateLimiter, rateOverrides
+from controllerState import StateLine
 import BrewPiProcess
+import BrewPiSocket
+import stateHandoff
+from stateStore import StateStore
+from configStore import ConfigStore, WwwSettings
 from backgroundserial import BackGroundSerial
+from startupProfile import StartupProfile
+# programController and pinList are imported when they are used, they are only needed for rare commands
+
+startupProfile = StartupProfile(startupTime)
+startupProfile.phase('imports')
 
 
 # Settings will be read from controller, initialize with same defaults as controller
@@ -84,10 +112,10 @@ from backgroundserial import BackGroundSerial
 compatibleHwVersion = "0.5.0"
 
 # Control Settings
-cs = dict(mode='b', beerSet=20.0, fridgeSet=20.0)
+cs = StateLine('control settings', dict(mode='b', beerSet=20.0, fridgeSet=20.0))
 
 # Control Constants
-cc = dict()
+cc = StateLine('control constants')
 
 # Control variables (json string, sent directly to browser without decoding)
 cv = "{}"
@@ -98,22 +126,30 @@ temperatures = {}
 # listState = "", "d", "h", "dh" to reflect whether the list is up to date for installed (d) and available (h)
 deviceList = dict(listState="", installed=[], available=[])
 
+# parts of the state that were restored from the snapshot file and not received from the controller yet
+staleState = set()
+
 # lastSerialTraffic times how long ago data was succesfully received from the controller. If it has been over 60 seconds ago, we quit.
 lastSerialTraffic = time.time
 
 # Read in command line arguments
 try:
     opts, args = getopt.getopt(sys.argv[1:], "hc:sqkfld",
-                               ['help', 'config=', 'status', 'quit', 'kill', 'force', 'log', 'dontrunfile', 'checkstartuponly'])
+                               ['help', 'config=', 'status', 'quit', 'kill', 'force', 'log', 'dontrunfile', 'checkstartuponly',
+                                'socketfd=', 'handoff', 'profile-startup'])
 except getopt.GetoptError:
     printStdErr("Unknown parameter, available Options: --help, --config <path to config file>, " +
-          "--status, --quit, --kill, --force, --log, --dontrunfile")
+          "--status, --quit, --kill, --force, --log, --dontrunfile, --supervise, --handoff, --profile-startup")
     sys.exit()
 
 configFile = None
+forceQuit = False
 checkDontRunFile = False
 checkStartupOnly = False
 logToFiles = False
+socketFd = None
+handoff = False
+profileStartup = False
 
 for o, a in opts:
     # print help message for command line options
@@ -128,6 +164,9 @@ for o, a in opts:
         printStdErr("--log: redirect stderr and stdout to log files")
         printStdErr("--dontrunfile: check dontrunfile in www directory and quit if it exists")
         printStdErr("--checkstartuponly: exit after startup checks, return 1 if startup is allowed")
+        printStdErr("--supervise: run the script as a child process and restart it within seconds when it fails")
+        printStdErr("--handoff: take over the socket, serial port and state of the running instance and replace it")
+        printStdErr("--profile-startup: print how long each phase of the startup took")
         exit()
     # supply a config file
     if o in ('-c', '--config'):
@@ -148,8 +187,7 @@ for o, a in opts:
     if o in ('-q', '--quit'):
         logMessage("Asking all BrewPi Processes to quit on their socket")
         allProcesses = BrewPiProcess.BrewPiProcesses()
-        allProcesses.quitAll()
-        time.sleep(2)
+        allProcesses.quitAll()  # returns when they have exited
         exit()
     # send SIGKILL to all running instances of BrewPi
     if o in ('-k', '--kill'):
@@ -160,12 +198,11 @@ for o, a in opts:
     # close all existing instances of BrewPi by quit/kill and keep this one
     if o in ('-f', '--force'):
         logMessage("Closing all existing processes of BrewPi and keeping this one")
+        forceQuit = True
         allProcesses = BrewPiProcess.BrewPiProcesses()
-        if len(allProcesses.update()) > 1:  # if I am not the only one running
-            allProcesses.quitAll()
-            time.sleep(2)
-            if len(allProcesses.update()) > 1:
-                printStdErr("Asking the other processes to quit nicely did not work. Killing them with force!")
+        # other instances are asked to quit and killed when they do not exit in time
+        if allProcesses.quitAll():
+            printStdErr("Not all other processes of BrewPi could be stopped")
     # redirect output of stderr and stdout to files in log directory
     if o in ('-l', '--log'):
         logToFiles = True
@@ -174,11 +211,26 @@ for o, a in opts:
         checkDontRunFile = True
     if o in ('--checkstartuponly'):
         checkStartupOnly = True
+    # listening socket created by the supervisor
+    if o in ('--socketfd',):
+        socketFd = int(a)
+    # replace the running instance without closing its socket and serial port
+    if o in ('--handoff',):
+        handoff = True
+    # print a timing breakdown of the startup
+    if o in ('--profile-startup',):
+        profileStartup = True
+
+# waiting for other instances to quit does not count for the startup budget
+startupProfile.phase('command line', counted=not forceQuit)
 
 if not configFile:
     configFile = util.addSlash(sys.path[0]) + 'settings/config.cfg'
 
-config = util.readCfgWithDefaults(configFile)
+# settings are kept in memory and written behind, so socket commands do not have to read or write config files
+config = ConfigStore(configFile)
+startupProfile.budget = config.getFloat('startupBudget', 3.0)
+startupProfile.phase('config')
 
 dontRunFilePath = os.path.join(config['wwwPath'], 'do_not_run_brewpi')
 # check dont run file when it exists and exit it it does
@@ -187,15 +239,42 @@ if checkDontRunFile:
         # do not print anything, this will flood the logs
         exit(0)
 
+# take over the socket, serial port and state of the running instance, which exits when it has handed them off
+# a firmware update would make this instance exit after the running instance handed off, so it is not asked then
+handoffState, handoffFds = None, {}
+if handoff and not instanceLock.firmwareUpdateRunning():
+    handoffState, handoffFds = stateHandoff.requestHandoff(BrewPiSocket.BrewPiSocket(config))
+    if handoffState is None:
+        logMessage("The running instance did not hand off its socket and serial port, starting without them")
+    startupProfile.phase('handoff')
+
+# the last known state of the controller, shown until the controller sends fresh data
+stateStore = StateStore(config.get('stateFile', util.addSlash(util.scriptPath()) + 'settings/controllerState.json'),
+                        writeDelay=float(config.get('stateWriteDelay', 2.0)))
+previousState = handoffState
+if previousState is None:
+    previousState = stateStore.load()
+    if previousState is not None:
+        staleState.update(['cs', 'cc', 'cv', 'temperatures', 'deviceList'])
+startupProfile.phase('state snapshot')
+
 # check for other running instances of BrewPi that will cause conflicts with this instance
+# the config file lock was taken already when started with --dontrunfile
+# an instance that was asked to quit with --force can take a few seconds to exit
 allProcesses = BrewPiProcess.BrewPiProcesses()
-allProcesses.update()
-myProcess = allProcesses.me()
-if allProcesses.findConflicts(myProcess):
+myProcess = BrewPiProcess.fromConfig(configFile, config)
+if allProcesses.findConflicts(myProcess, heldLocks=[configLock], timeout=5 if forceQuit or handoffState else 0):
+    if handoffState is not None:
+        # the previous instance has exited already, exit with an error so the supervisor or cron starts it again
+        logMessage("Error: took over from the running instance, but this instance cannot start because of a " +
+                   "conflict. Exiting with an error, BrewPi is not running anymore")
+        exit(1)
     if not checkDontRunFile:
         logMessage("Another instance of BrewPi is already running, which will conflict with this instance. " +
                    "This instance will exit")
     exit(0)
+startupCheckTime = time.time() - startupTime
+startupProfile.phase('process check')
 
 if checkStartupOnly:
     exit(1)
@@ -210,30 +289,36 @@ day = ""
 if logToFiles:
     logPath = util.addSlash(util.scriptPath()) + 'logs/'
     logMessage("Redirecting output to log files in %s, output will not be shown in console" % logPath)
-    sys.stderr = open(logPath + 'stderr.txt', 'a', 0)  # append to stderr file, unbuffered
+    sys.stderr = open(logPath + 'stderr.txt', 'a', 1)  # append to stderr file, line buffered
     sys.stdout = open(logPath + 'stdout.txt', 'w', 0)  # overwrite stdout file on script start, unbuffered
 
+logMessage("Startup checks took %.0f ms" % (startupCheckTime * 1000))
+
 
 # userSettings.json is a copy of some of the settings that are needed by the web server.
 # This allows the web server to load properly, even when the script is not running.
+wwwSettings = WwwSettings(util.addSlash(config['wwwPath']) + 'userSettings.json')
+
+
 def changeWwwSetting(settingName, value):
-    wwwSettingsFileName = util.addSlash(config['wwwPath']) + 'userSettings.json'
-    if os.path.exists(wwwSettingsFileName):
-        wwwSettingsFile = open(wwwSettingsFileName, 'r+b')
-        try:
-            wwwSettings = json.load(wwwSettingsFile)  # read existing settings
-        except json.JSONDecodeError:
-            logMessage("Error in decoding userSettings.json, creating new empty json file")
-            wwwSettings = {}  # start with a fresh file when the json is corrupt.
-    else:
-        wwwSettingsFile = open(wwwSettingsFileName, 'w+b')  # create new file
-        wwwSettings = {}
+    wwwSettings.set(settingName, value)
 
-    wwwSettings[settingName] = str(value)
-    wwwSettingsFile.seek(0)
-    wwwSettingsFile.write(json.dumps(wwwSettings))
-    wwwSettingsFile.truncate()
-    wwwSettingsFile.close()
+
+def saveSettings():
+    """
+    Writes changed settings to the config file and userSettings.json
+    """
+    config.save()
+    wwwSettings.save()
+
+
+def stopOnTerm(signum, frame):
+    sys.exit(0)  # a deliberate stop, like the quit message. Exiting this way runs the atexit handlers
+
+
+# changed settings are also written when the script exits on an error or is terminated
+atexit.register(saveSettings)
+signal.signal(signal.SIGTERM, stopOnTerm)
 
 def setFiles():
     global config
@@ -290,10 +375,9 @@ def startBeer(beerName):
 
 
 def startNewBrew(newName):
-    global config
     if len(newName) > 1:     # shorter names are probably invalid
-        config = util.configSet(configFile, 'beerName', newName)
-        config = util.configSet(configFile, 'dataLogging', 'active')
+        config.set('beerName', newName)
+        config.set('dataLogging', 'active')
         startBeer(newName)
         logMessage("Notification: Restarted logging for beer '%s'." % newName)
         return {'status': 0, 'statusMessage': "Successfully switched to new brew '%s'. " % urllib.unquote(newName) +
@@ -304,31 +388,28 @@ def startNewBrew(newName):
 
 
 def stopLogging():
-    global config
     logMessage("Stopped data logging, as requested in web interface. " +
                "BrewPi will continue to control temperatures, but will not log any data.")
-    config = util.configSet(configFile, 'beerName', None)
-    config = util.configSet(configFile, 'dataLogging', 'stopped')
+    config.set('beerName', None)
+    config.set('dataLogging', 'stopped')
     changeWwwSetting('beerName', None)
     return {'status': 0, 'statusMessage': "Successfully stopped logging"}
 
 
 def pauseLogging():
-    global config
     logMessage("Paused logging data, as requested in web interface. " +
                "BrewPi will continue to control temperatures, but will not log any data until resumed.")
     if config['dataLogging'] == 'active':
-        config = util.configSet(configFile, 'dataLogging', 'paused')
+        config.set('dataLogging', 'paused')
         return {'status': 0, 'statusMessage': "Successfully paused logging."}
     else:
         return {'status': 1, 'statusMessage': "Logging already paused or stopped."}
 
 
 def resumeLogging():
-    global config
     logMessage("Continued logging data, as requested in web interface.")
     if config['dataLogging'] == 'paused':
-        config = util.configSet(configFile, 'dataLogging', 'active')
+        config.set('dataLogging', 'active')
         return {'status': 0, 'statusMessage': "Successfully continued logging."}
     else:
         return {'status': 1, 'statusMessage': "Logging was not paused."}
@@ -337,17 +418,36 @@ logMessage("Notification: Script started for beer '" + urllib.unquote(config['be
 
 logMessage("Connecting to controller...") 
 # bytes are read from nonblocking serial into this buffer and processed when the buffer contains a full line.
-ser = util.setupSerial(config, time_out=0)
+if 'serial' in handoffFds:
+    logMessage("Using serial port %s of the previous instance" % handoffState['port'])
+    ser = util.serialFromFileDescriptor(handoffFds['serial'], handoffState['port'], time_out=0)
+else:
+    ser = util.setupSerial(config, time_out=0)
 
 if not ser:
     exit(1)
+startupProfile.phase('serial open')
 
-# wait an optional startup delay after serial connect. Could be needed to skip a bootloader, default is no delay
-time.sleep(float(config.get('startupDelay', 0)))
-
-
-logMessage("Checking software version on controller... ")
-hwVersion = brewpiVersion.getVersionFromSerial(ser)
+controllerIdentity = autoSerial.device_identity(ser.port)
+versionCheck = None  # VersionHandshake that checks the cached version in the background
+if 'serial' in handoffFds and handoffState.get('hwVersion'):
+    # the controller is still running the same firmware
+    hwVersion = brewpiVersion.AvrInfo.fromDict(handoffState['hwVersion'])
+else:
+    # wait an optional startup delay after serial connect. Could be needed to skip a bootloader, default is no delay
+    time.sleep(float(config.get('startupDelay', 0)))
+    startupProfile.phase('startup delay', counted=False)
+
+    # a controller that was seen before is expected to run the same version, which is checked in the background
+    hwVersion = brewpiVersion.loadCachedVersion(controllerIdentity)
+    if hwVersion is not None:
+        versionCheck = brewpiVersion.VersionHandshake()
+        logMessage("Using last known software version of controller, it will be checked in the background")
+    else:
+        logMessage("Checking software version on controller... ")
+        hwVersion = brewpiVersion.getVersionFromSerial(ser)
+        if hwVersion is not None:
+            brewpiVersion.saveCachedVersion(controllerIdentity, hwVersion)
 if hwVersion is None:
     logMessage("Warning: Cannot receive version number from controller. " +
                "This could be because your controller is not programmed or running a very old version of BrewPi." +
@@ -360,30 +460,71 @@ else:
         logMessage("Warning: minimum BrewPi version compatible with this script is " +
                    compatibleHwVersion +
                    " but version number received is " + hwVersion.toString())
-    if int(hwVersion.log) != int(expandLogMessage.getVersion()):
+    logCatalog = expandLogMessage.selectCatalog(int(hwVersion.log))
+    if logCatalog.version != int(hwVersion.log):
         logMessage("Warning: version number of local copy of logMessages.h " +
                    "does not match log version number received from controller." +
                    "controller version = " + str(hwVersion.log) +
                    ", local copy version = " + str(expandLogMessage.getVersion()))
+    elif logCatalog.version != expandLogMessage.getVersion():
+        logDiff = expandLogMessage.diffCatalogs(expandLogMessage.getLocalCatalog(), logCatalog)
+        logMessage("Using log messages version %d of the controller instead of local version %d. "
+                   "Compared to the local version, %d messages were added, %d removed and %d changed" %
+                   (logCatalog.version, expandLogMessage.getVersion(),
+                    len(logDiff['added']), len(logDiff['removed']), len(logDiff['changed'])))
     if hwVersion.family == 'Arduino':
         exit("\n ERROR: the newest version of BrewPi is not compatible with Arduino. \n" +
             "You can use our legacy branch with your Arduino, in which we only include the backwards compatible changes. \n" +
             "To change to the legacy branch, run: sudo ~/brewpi-tools/updater.py --ask , and choose the legacy branch.")
+startupProfile.phase('version handshake')
 
 
+if previousState is not None:
+    cs.update(previousState['cs'])
+    cv = previousState['cv']
+    temperatures = previousState['temperatures']
+    if previousState.get('hwVersion') == hwVersion.toDict():
+        cc.update(previousState['cc'])
+        deviceList = previousState['deviceList']
+    else:
+        # control constants and devices depend on the firmware
+        logMessage("Controller firmware has changed, not using control constants and devices of previous version")
+        staleState.difference_update(['cc', 'deviceList'])
+    if staleState:
+        logMessage("Using last known state from %s until the controller sends an update" %
+                   time.strftime("%b %d %Y %H:%M:%S", time.localtime(stateStore.savedTime)))
+# write the snapshot when the state changes
+cs.subscribe(stateStore.changed)
+cc.subscribe(stateStore.changed)
+
 bg_ser = None
 
 if ser is not None:
     ser.flush()
 
     # set up background serial processing, which will continuously read data from serial and put whole lines in a queue
-    bg_ser = BackGroundSerial(ser)
+    bg_ser = BackGroundSerial(ser,
+                              max_lines=int(config.get('serialQueueSize', 1000)),
+                              max_messages=int(config.get('serialMessageQueueSize', 200)),
+                              message_rate=float(config.get('serialMessageRate', 20.0)),
+                              message_burst=int(config.get('serialMessageBurst', 100)))
     bg_ser.start()
+    atexit.register(bg_ser.stop)  # stop reading before the interpreter shuts down
+startupProfile.phase('serial thread')
     
 # create a listening socket to communicate with PHP
 is_windows = sys.platform.startswith('win')
 useInetSocket = bool(config.get('useInetSocket', is_windows))
-if useInetSocket:
+if 'socket' in handoffFds:
+    s = socket.fromfd(handoffFds['socket'], socket.AF_INET if useInetSocket else socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(handoffFds['socket'])  # fromfd made a copy
+    logMessage('Using socket of the previous instance')
+elif socketFd is not None:
+    # the socket stays open while the supervisor restarts the script. The file descriptor is not closed,
+    # so it is still valid when the script restarts itself with the same arguments after programming.
+    s = socket.fromfd(socketFd, socket.AF_INET if useInetSocket else socket.AF_UNIX, socket.SOCK_STREAM)
+    logMessage('Using socket created by the supervisor')
+elif useInetSocket:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     socketPort = config.get('socketPort', 6332)
@@ -405,6 +546,7 @@ s.setblocking(1)  # set socket functions to be blocking
 s.listen(10)  # Create a backlog queue for up to 10 connections
 # blocking socket functions wait 'serialCheckInterval' seconds
 s.settimeout(serialCheckInterval)
+startupProfile.phase('socket bind')
 
 # set all times to zero to force updating them
 prevDataTime = 0.0
@@ -413,11 +555,100 @@ prevTimeOut = 0.0
 prevSettingsUpdate = 0.0
 # except timeout for serial not responding
 prevSerialReceive = time.time()
+# time when the set point of the temperature profile is expected to change
+nextProfileUpdate = 0.0
+profileResolution = float(config.get('profileResolution', 0.01))
+profileMaxSleep = 300
+
+# recent log messages from the controller, for the web interface
+controllerLog = ControllerLog(int(config.get('controllerLogSize', 500)))
+if previousState is not None:
+    # continue numbering, so clients that ask for the messages since the last one they have seen get the new ones
+    controllerLog.seq = previousState.get('logSeq', 0)
+# limit how often the same controller log message is written to stderr
+controllerLogLimiter = LogRateLimiter(rate=float(config.get('controllerLogRate', 1 / 60.0)),
+                                      burst=int(config.get('controllerLogBurst', 5)),
+                                      overrides=rateOverrides(config.get('controllerLogRates', {})),
+                                      summaryInterval=float(config.get('controllerLogSummaryInterval', 60)))
+
+# temperature profiles saved in the web interface
+profileLibrary = ProfileLibrary(util.addSlash(config['wwwPath']) + 'data/profiles/',
+                                int(config.get('profileCacheSize', 8)))
+
+
+def profileMaxGap():
+    """
+    Returns: seconds between two set points of a profile after which a warning is given
+    """
+    return config.getFloat('profileMaxGap', 7.0) * 86400
+
+
+if config.get('profileName'):
+    profileErrors = profileLibrary.setActive(config['profileName'], profileMaxGap())
+    if profileErrors:
+        logMessage("Profile '%s' cannot be used, using the copy in the settings directory: %s" %
+                   (config['profileName'], "; ".join(profileErrors)))
+
+
+def activeProfile():
+    """
+    Returns: the active temperature profile. Profiles activated by older versions of the script are only
+    available as a copy in the settings directory.
+    """
+    profile = profileLibrary.getActive()
+    if profile is None:
+        profile = temperatureProfile.getProfile(temperatureProfile.profileFileName(util.scriptPath()))
+    return profile
+
+
+def activeProfileName():
+    if profileLibrary.activeName is not None:
+        return profileLibrary.activeName
+    # older versions of the script store the profile name in the header row of the copy
+    with file(temperatureProfile.profileFileName(util.scriptPath()), 'r') as prof:
+        return prof.readline().split(",")[-1].rstrip("\n")
+
+def stateSnapshot():
+    """
+    Returns: the state received from the controller, as a dict that can be written as JSON
+    """
+    return dict(cs=cs.json(), cc=cc.json(), cv=cv, temperatures=temperatures, deviceList=deviceList,
+                hwVersion=hwVersion.toDict() if hwVersion else None, port=getattr(ser, 'port', None),
+                logSeq=controllerLog.seq)
+
+
+def restartArguments(argv, listenSocket):
+    """
+    Returns: command line arguments to restart the script with exec, passing the listening socket to the new script
+    """
+    args = []
+    skipNext = False
+    for arg in argv:
+        if skipNext:
+            skipNext = False
+        elif arg == '--socketfd':
+            skipNext = True
+        elif arg != '--handoff' and not arg.startswith('--socketfd='):
+            args.append(arg)
+    if os.name == 'posix':
+        args += ['--socketfd', str(listenSocket.fileno())]
+    return args
+
 
 run = 1
 
 startBeer(config['beerName'])
 outputTemperature = True
+startupProfile.phase('initialization')
+
+if profileStartup:
+    logMessage("Startup profile:")
+    for line in startupProfile.report():
+        logMessage("    " + line)
+if startupProfile.overBudget():
+    logMessage("Warning: startup took %.0f ms, which is more than the startup budget of %.0f ms" %
+               (startupProfile.total() * 1000, startupProfile.budget * 1000))
+startupProfile.record(util.addSlash(util.scriptPath()) + 'logs/startupProfile.json')
 
 prevTempJson = {
     "BeerTemp": 0,
@@ -431,21 +662,6 @@ prevTempJson = {
     "BeerSet": 0,
     "FridgeSet": 0}
 
-def renameTempKey(key):
-    rename = {
-        "bt": "BeerTemp",
-        "bs": "BeerSet",
-        "ba": "BeerAnn",
-        "ft": "FridgeTemp",
-        "fs": "FridgeSet",
-        "fa": "FridgeAnn",
-        "lt1": "Log1Temp",
-        "lt2": "Log2Temp",
-        "lt3": "Log3Temp",
-        "s": "State",
-        "t": "Time"}
-    return rename.get(key, key)
-
 while run:
     if config['dataLogging'] == 'active':
         # Check whether it is a new day
@@ -480,16 +696,18 @@ while run:
         elif messageType == "getTemperatures":
             conn.send(json.dumps(temperatures))
         elif messageType == "getControlConstants":
-            conn.send(json.dumps(cc))
+            conn.send(cc.json())
         elif messageType == "getControlSettings":
-            if cs['mode'] == "p":
-                profileFile = util.addSlash(util.scriptPath()) + 'settings/tempProfile.csv'
-                with file(profileFile, 'r') as prof:
-                    cs['profile'] = prof.readline().split(",")[-1].rstrip("\n")
-            cs['dataLogging'] = config['dataLogging']
-            conn.send(json.dumps(cs))
+            response = cs.copy()
+            if response['mode'] == "p":
+                response['profile'] = activeProfileName()
+            response['dataLogging'] = config['dataLogging']
+            conn.send(json.dumps(response))
         elif messageType == "getControlVariables":
             conn.send(cv)
+        elif messageType == "getStateInfo":
+            # which values are the last known state from before the script was restarted
+            conn.send(json.dumps(dict(stale=sorted(staleState), savedTime=stateStore.savedTime)))
         elif messageType == "refreshControlConstants":
             bg_ser.writeln("c")
             raise socket.timeout
@@ -567,6 +785,27 @@ while run:
             # Leave dontrunfile alone.
             # This instruction is meant to restart the script or replace it with another instance.
             continue
+        elif messageType == stateHandoff.HANDOFF_MESSAGE:  # a new instance of the script replaces this one
+            if not stateHandoff.canHandOff(conn):
+                logMessage("Cannot hand off socket and serial port over this connection")
+                continue
+            logMessage("Handing off socket, serial port and state to new instance.")
+            if bg_ser is not None:
+                bg_ser.stop()  # stop reading from serial, the new instance reads the data that is still buffered
+            handoffFds = {'socket': s.fileno()}
+            if util.serialFileDescriptor(ser) is not None:
+                handoffFds['serial'] = util.serialFileDescriptor(ser)
+            try:
+                conn.settimeout(10)
+                stateHandoff.sendHandoff(conn, stateSnapshot(), handoffFds)
+            except (socket.error, OSError) as e:
+                logMessage("Handoff to new instance failed: %s. This instance keeps running" % str(e))
+                if bg_ser is not None:
+                    bg_ser.start()
+                continue
+            logMessage("New instance took over. Stopping script.")
+            run = 0
+            continue
         elif messageType == "eraseLogs":
             # erase the log files for stderr and stdout
             open(util.scriptPath() + '/logs/stderr.txt', 'wb').close()
@@ -576,11 +815,7 @@ while run:
         elif messageType == "interval":  # new interval received
             newInterval = int(value)
             if 5 < newInterval < 5000:
-                try:
-                    config = util.configSet(configFile, 'interval', float(newInterval))
-                except ValueError:
-                    logMessage("Cannot convert interval '" + value + "' to float")
-                    continue
+                config.set('interval', float(newInterval))
                 logMessage("Notification: Interval changed to " +
                            str(newInterval) + " seconds")
         elif messageType == "startNewBrew":  # new beer name
@@ -597,40 +832,50 @@ while run:
             result = resumeLogging()
             conn.send(json.dumps(result))
         elif messageType == "dateTimeFormatDisplay":
-            config = util.configSet(configFile, 'dateTimeFormatDisplay', value)
+            config.set('dateTimeFormatDisplay', value)
             changeWwwSetting('dateTimeFormatDisplay', value)
             logMessage("Changing date format config setting: " + value)
+        elif messageType == "previewProfile":
+            # evaluate a profile on a time grid, so the web interface does not have to interpolate it
+            try:
+                request = json.loads(value) if value else {}
+                if not isinstance(request, dict):
+                    raise TypeError("the request must be a JSON object")
+                if request.get('name'):
+                    profile = profileLibrary.get(request['name'])
+                else:
+                    profile = activeProfile()
+                conn.send(json.dumps(profile.preview(request.get('times'), request.get('points', 200),
+                                                     profileMaxGap())))
+            except json.JSONDecodeError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+                conn.send(json.dumps({'errors': ["Invalid preview request"]}))
+            except (ValueError, TypeError, AttributeError) as e:
+                logMessage("Error: invalid preview request %s: %s" % (value, str(e)))
+                conn.send(json.dumps({'errors': ["Invalid preview request: %s" % str(e)]}))
+            except (IOError, OSError) as e:
+                conn.send(json.dumps({'errors': ["Cannot read profile: %s" % e.strerror]}))
+        elif messageType == "getProfiles":
+            # metadata of the saved profiles, only changed profiles are read again
+            conn.send(json.dumps({'active': profileLibrary.activeName, 'profiles': profileLibrary.getIndex()}))
         elif messageType == "setActiveProfile":
-            # copy the profile CSV file to the working directory
+            # the profile is checked before it is activated and used from the profiles directory, it is not copied
+            profileErrors = profileLibrary.setActive(value, profileMaxGap())
+            if profileErrors:
+                error = "Profile '%s' rejected: %s" % (value, "; ".join(profileErrors))
+                logMessage(error)
+                conn.send(error)
+                continue
             logMessage("Setting profile '%s' as active profile" % value)
-            config = util.configSet(configFile, 'profileName', value)
+            config.set('profileName', value)
             changeWwwSetting('profileName', value)
-            profileSrcFile = util.addSlash(config['wwwPath']) + "data/profiles/" + value + ".csv"
-            profileDestFile = util.addSlash(util.scriptPath()) + 'settings/tempProfile.csv'
-            profileDestFileOld = profileDestFile + '.old'
-            try:
-                if os.path.isfile(profileDestFile):
-                    if os.path.isfile(profileDestFileOld):
-                        os.remove(profileDestFileOld)
-                    os.rename(profileDestFile, profileDestFileOld)
-                shutil.copy(profileSrcFile, profileDestFile)
-                # for now, store profile name in header row (in an additional column)
-                with file(profileDestFile, 'r') as original:
-                    line1 = original.readline().rstrip("\n")
-                    rest = original.read()
-                with file(profileDestFile, 'w') as modified:
-                    modified.write(line1 + "," + value + "\n" + rest)
-            except IOError as e:  # catch all exceptions and report back an error
-                error = "I/O Error(%d) updating profile: %s " % (e.errno, e.strerror)
-                conn.send(error)
-                printStdErr(error)
-            else:
-                conn.send("Profile successfully updated")
-                if cs['mode'] is not 'p':
-                    cs['mode'] = 'p'
-                    bg_ser.writeln("j{mode:p}")
-                    logMessage("Notification: Profile mode enabled")
-                    raise socket.timeout  # go to serial communication to update controller
+            nextProfileUpdate = 0
+            conn.send("Profile successfully updated")
+            if cs['mode'] is not 'p':
+                cs['mode'] = 'p'
+                bg_ser.writeln("j{mode:p}")
+                logMessage("Notification: Profile mode enabled")
+                raise socket.timeout  # go to serial communication to update controller
         elif messageType == "programController" or messageType == "programArduino":
             if bg_ser is not None:
                 bg_ser.stop()
@@ -638,6 +883,7 @@ while run:
                 if ser.isOpen():
                     ser.close()  # close serial port before programming
                 ser = None
+            import programController as programmer
             try:
                 programParameters = json.loads(value)
                 hexFile = programParameters['fileName']
@@ -651,10 +897,11 @@ while run:
                 logMessage("Error: cannot decode programming parameters: " + value)
                 logMessage("Restarting script without programming.")
 
-            # restart the script when done. This replaces this process with the new one
+            # restart the script when done. This replaces this process with the new one, which keeps the socket open
             time.sleep(5)  # give the controller time to reboot
+            saveSettings()
             python = sys.executable
-            os.execl(python, python, *sys.argv)
+            os.execl(python, python, *restartArguments(sys.argv, s))
         elif messageType == "refreshDeviceList":
             deviceList['listState'] = ""  # invalidate local copy
             if value.find("readValues") != -1:
@@ -665,6 +912,7 @@ while run:
                 bg_ser.writeln("h{u:-1}")  # request available, but not installed devices
         elif messageType == "getDeviceList":
             if deviceList['listState'] in ["dh", "hd"]:
+                import pinList
                 response = dict(board=hwVersion.board,
                                 shield=hwVersion.shield,
                                 deviceList=deviceList,
@@ -696,6 +944,24 @@ while run:
                 response = {}
             response_str = json.dumps(response)
             conn.send(response_str)
+        elif messageType == "getSerialStats":
+            conn.send(json.dumps(bg_ser.get_stats() if bg_ser else {}))
+        elif messageType == "getControllerLog":
+            # value is optional, for example {"since": 120, "types": ["E", "W"]}
+            try:
+                request = json.loads(value) if value else {}
+                if not isinstance(request, dict):
+                    raise TypeError("the request must be a JSON object")
+                response = controllerLog.query(request.get('since'), request.get('types'))
+            except json.JSONDecodeError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+                response = controllerLog.query()
+            except TypeError as e:
+                logMessage("Error: invalid controller log request %s: %s" % (value, str(e)))
+                conn.send(json.dumps({'errors': ["Invalid controller log request: %s" % str(e)]}))
+                continue
+            response['suppressed'] = controllerLogLimiter.suppressed
+            conn.send(json.dumps(response))
         elif messageType == "resetController":
             logMessage("Resetting controller to factory defaults")
             bg_ser.writeln("E")
@@ -725,10 +991,11 @@ while run:
                 try:
                     if line[0] == 'T':
                         # process temperature line
-                        newData = json.loads(line[2:])
+                        newData = brewpiJson.loads(line[2:])
                         temperatures = newData # temperatures is sent to the web UI on request
+                        staleState.discard('temperatures')
 
-                        if (time.time() - prevLogTime) > float(config['interval']):
+                        if (time.time() - prevLogTime) > config.getFloat('interval'):
                             # store time of last new data for interval check
                             prevLogTime = time.time()
 
@@ -740,8 +1007,7 @@ while run:
                                 continue  # skip if logging is paused or stopped
 
                             # copy/rename keys
-                            for key in newData:
-                                prevTempJson[renameTempKey(key)] = newData[key]
+                            prevTempJson.update(brewpiJson.renameKeys(newData, brewpiJson.TEMP_KEY_NAMES))
 
                             newRow = prevTempJson
                             # add to JSON file
@@ -775,26 +1041,45 @@ while run:
                         logMessage("Line received was: {0}".format(line))
                     elif line[0] == 'C':
                         # Control constants received
-                        cc = json.loads(line[2:])
+                        cc.update(line[2:])
+                        staleState.discard('cc')
                     elif line[0] == 'S':
                         # Control settings received
                         prevSettingsUpdate = time.time()
-                        cs = json.loads(line[2:])
+                        staleState.discard('cs')
+                        if cs.update(line[2:]):
+                            nextProfileUpdate = 0  # check whether the controller has the right set point
                     # do not print this to the log file. This is requested continuously.
                     elif line[0] == 'V':
                         # Control settings received
                         cv = line[2:] # keep as string, do not decode
+                        staleState.discard('cv')
                     elif line[0] == 'N':
-                        pass  # version number received. Do nothing, just ignore
+                        # version number received, requested again after a serial reconnect or to check the cached version
+                        newVersion = brewpiVersion.AvrInfo(line[2:])
+                        if newVersion.version != "0.0.0":
+                            if hwVersion is None or newVersion.log != hwVersion.log:
+                                expandLogMessage.selectCatalog(int(newVersion.log))
+                            if hwVersion is None or newVersion.toDict() != hwVersion.toDict():
+                                logMessage("Controller version changed to " + newVersion.toExtendedString())
+                                brewpiVersion.saveCachedVersion(controllerIdentity, newVersion)
+                                stateStore.changed()
+                            hwVersion = newVersion
+                        if versionCheck is not None and versionCheck.feed(line):
+                            versionCheck = None
                     elif line[0] == 'h':
-                        deviceList['available'] = json.loads(line[2:])
+                        deviceList['available'] = brewpiJson.loads(line[2:])
                         oldListState = deviceList['listState']
                         deviceList['listState'] = oldListState.strip('h') + "h"
+                        staleState.discard('deviceList')
+                        stateStore.changed()
                         logMessage("Available devices received: "+ json.dumps(deviceList['available']))
                     elif line[0] == 'd':
-                        deviceList['installed'] = json.loads(line[2:])
+                        deviceList['installed'] = brewpiJson.loads(line[2:])
                         oldListState = deviceList['listState']
                         deviceList['listState'] = oldListState.strip('d') + "d"
+                        staleState.discard('deviceList')
+                        stateStore.changed()
                         logMessage("Installed devices received: " + json.dumps(deviceList['installed']).encode('utf-8'))
                     elif line[0] == 'U':
                         logMessage("Device updated to: " + line[2:])
@@ -807,11 +1092,36 @@ while run:
 
             if message is not None:
                 try:
-                    expandedMessage = expandLogMessage.expandLogMessage(message)
-                    logMessage("Controller debug message: " + expandedMessage)
+                    logType, logId, key, values, text = expandLogMessage.decodeLogMessage(message)
+                    controllerLog.add(logType, logId, key, values, text)
+                    if controllerLogLimiter.allow(logType, logId, values, text):
+                        logMessage("Controller debug message: " + text)
                 except Exception, e:  # catch all exceptions, because out of date file could cause errors
                     logMessage("Error while expanding log message '" + message + "'" + str(e))
 
+        if versionCheck is not None:
+            if bg_ser.reconnecting:
+                versionCheck = brewpiVersion.VersionHandshake()  # start again when the port is back
+            elif versionCheck.poll():
+                bg_ser.writeln('n')  # the answer is handled like a version received after a reconnect
+            elif versionCheck.state == brewpiVersion.VersionHandshake.FAILED:
+                brewpiVersion.forgetCachedVersion(controllerIdentity)
+                logMessage("Warning: Cannot receive version number from controller. " +
+                           "This could be because your controller is not programmed or running a very old version " +
+                           "of BrewPi. This script will now exit.")
+                sys.exit(1)
+
+        if stateStore.isDue():
+            stateStore.save(stateSnapshot())
+
+        if config.isDue() or wwwSettings.isDue():
+            saveSettings()
+        config.reloadIfChanged()
+        wwwSettings.reloadIfChanged()
+
+        for text, count in controllerLogLimiter.summaries():
+            logMessage("Controller debug message repeated %d more times: %s" % (count, text))
+
         if(time.time() - prevSettingsUpdate) > 60:
             # Request Settings from controller to stay up to date
             # Controller should send updates on changes, this is a periodical update to ensure it is up to date
@@ -823,18 +1133,31 @@ while run:
             bg_ser.writeln("t")  # request new temperatures from controller
             prevDataTime = time.time()
             
-        if (time.time() - prevSerialReceive > 60):
+        if bg_ser.reconnecting:
+            prevSerialReceive = time.time()  # do not time out while the serial port is being restored
+        elif (time.time() - prevSerialReceive > 60):
             #something is wrong: controller is not responding to data requests
             logMessage("Error: controller is not responding anymore. Exiting script.")
-            sys.exit()
+            sys.exit(1)  # an error exit code, so the supervisor restarts the script
         
-        # Check for update from temperature profile
-        if cs['mode'] == 'p':
-            newTemp = temperatureProfile.getNewTemp(util.scriptPath())
-            if newTemp != cs['beerSet']:
-                cs['beerSet'] = newTemp
-                # if temperature has to be updated send settings to controller
-                bg_ser.writeln("j{beerSet:" + json.dumps(cs['beerSet']) + "}")
+        # Check for update from temperature profile, only when the set point is expected to change
+        if cs['mode'] == 'p' and time.time() >= nextProfileUpdate:
+            try:
+                profile = activeProfile()
+            except (IOError, OSError) as e:
+                logMessage("Cannot read active profile: %s" % e.strerror)
+                profile = None
+                nextProfileUpdate = None  # try again later
+            if profile is not None:
+                newTemp = profile.getTemp()
+                if newTemp != cs['beerSet']:
+                    cs['beerSet'] = newTemp
+                    # if temperature has to be updated send settings to controller
+                    bg_ser.writeln("j{beerSet:" + json.dumps(cs['beerSet']) + "}")
+                nextProfileUpdate = profile.nextChange(resolution=profileResolution)
+            # check at least every few minutes, in case the profile file was edited or the clock was changed
+            if nextProfileUpdate is None or nextProfileUpdate - time.time() > profileMaxSleep:
+                nextProfileUpdate = time.time() + profileMaxSleep
 
     except socket.error as e:
         logMessage("Socket error(%d): %s" % (e.errno, e.strerror))
@@ -843,6 +1166,9 @@ while run:
 if bg_ser:
     bg_ser.stop()
 
+stateStore.save(stateSnapshot())
+saveSettings()
+
 if ser:
     if ser.isOpen():
         ser.close()  # close port
@@ -18,6 +18,7 @@ from datetime import datetime
 import time
 import os
 import re
+import simplejson as json
 
 jsonCols = ("\"cols\":[" +
             "{\"type\":\"datetime\",\"id\":\"Time\",\"label\":\"Time\"}," +
@@ -34,6 +35,140 @@ jsonCols = ("\"cols\":[" +
             "]")
 
 
+# keys in the temperature lines of the controller and the names used for them in the data files
+TEMP_KEY_NAMES = {
+	"bt": "BeerTemp",
+	"bs": "BeerSet",
+	"ba": "BeerAnn",
+	"ft": "FridgeTemp",
+	"fs": "FridgeSet",
+	"fa": "FridgeAnn",
+	"lt1": "Log1Temp",
+	"lt2": "Log2Temp",
+	"lt3": "Log3Temp",
+	"s": "State",
+	"t": "Time"}
+
+# one token of relaxed JSON: punctuation, quoted string, number or a bare word (unquoted key or value)
+relaxedToken = re.compile(r'\s*(?:([{}\[\]:,])|"((?:[^"\\]|\\.)*)"|(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)(?![\w.&;])|'
+						  r'([^\s{}\[\]:,"]+))')
+bareWords = {'true': True, 'false': False, 'null': None}
+
+
+def loads(s, keyNames=None):
+	"""
+	Decodes a JSON line from the controller with simplejson. The controller sends strict JSON, so anything else is
+	rejected: a relaxed parser would turn corrupted values like 19.5XYZ into strings.
+	keyNames: optional dict to rename the keys of the top level object, like TEMP_KEY_NAMES
+	Raises simplejson.JSONDecodeError when the line cannot be decoded
+	"""
+	decoded = json.loads(s)
+	if keyNames:
+		decoded = renameKeys(decoded, keyNames)
+	return decoded
+
+
+def renameKeys(decoded, keyNames):
+	"""
+	Returns: a copy of dict decoded with the keys in keyNames renamed
+	"""
+	if not isinstance(decoded, dict):
+		return decoded
+	return dict((keyNames.get(k, k), v) for k, v in decoded.iteritems())
+
+
+def parseRelaxedJson(s, keyNames=None):
+	"""
+	Parses the relaxed JSON dialect of the controller in a single pass.
+	Keys and string values do not need quotes, like {mode:b, beerSet:20.5}. Unquoted values that are not numbers,
+	true, false or null are strings, which includes values with &deg in them.
+	keyNames: optional dict to rename the keys of the top level object while decoding
+	Raises simplejson.JSONDecodeError, with 'Truncated input' as message when the input ends too soon
+	"""
+	value, pos = _parseValue(s, 0, keyNames)
+	if s[pos:].strip():
+		raise json.JSONDecodeError("Extra data", s, pos)
+	return value
+
+
+def _nextToken(s, pos):
+	m = relaxedToken.match(s, pos)
+	if m is None:
+		rest = s[pos:].lstrip()
+		if not rest or rest[0] == '"':
+			raise json.JSONDecodeError("Truncated input", s, len(s))
+		raise json.JSONDecodeError("Unexpected character", s, len(s) - len(rest))
+	return m
+
+
+def _parseValue(s, pos, keyNames):
+	m = _nextToken(s, pos)
+	punctuation, string, number, word = m.groups()
+	pos = m.end()
+	if punctuation == '{':
+		return _parseObject(s, pos, keyNames)
+	if punctuation == '[':
+		return _parseArray(s, pos)
+	if punctuation is not None:
+		raise json.JSONDecodeError("Expected value", s, m.start(1))
+	if string is not None:
+		return _unescape(string, s, m.start(2)), pos
+	if number is not None:
+		if '.' in number or 'e' in number or 'E' in number:
+			return float(number), pos
+		return int(number), pos
+	return bareWords.get(word, word), pos
+
+
+def _parseObject(s, pos, keyNames):
+	obj = {}
+	m = _nextToken(s, pos)
+	if m.group(1) == '}':
+		return obj, m.end()
+	while True:
+		if m.group(2) is not None:
+			key = _unescape(m.group(2), s, m.start(2))
+		elif m.group(1) is None:
+			key = m.group(3) or m.group(4)
+		else:
+			raise json.JSONDecodeError("Expected key", s, m.start(1))
+		m = _nextToken(s, m.end())
+		if m.group(1) != ':':
+			raise json.JSONDecodeError("Expected ':'", s, m.start())
+		value, pos = _parseValue(s, m.end(), None)
+		if keyNames:
+			key = keyNames.get(key, key)
+		obj[key] = value
+		m = _nextToken(s, pos)
+		if m.group(1) == '}':
+			return obj, m.end()
+		if m.group(1) != ',':
+			raise json.JSONDecodeError("Expected ',' or '}'", s, m.start())
+		m = _nextToken(s, m.end())
+
+
+def _parseArray(s, pos):
+	array = []
+	m = _nextToken(s, pos)
+	if m.group(1) == ']':
+		return array, m.end()
+	while True:
+		value, pos = _parseValue(s, pos, None)
+		array.append(value)
+		m = _nextToken(s, pos)
+		if m.group(1) == ']':
+			return array, m.end()
+		if m.group(1) != ',':
+			raise json.JSONDecodeError("Expected ',' or ']'", s, m.start())
+		pos = m.end()
+
+
+def _unescape(string, s, pos):
+	if '\\' not in string:
+		return string
+	return json.loads('"' + string + '"')
+
+
 def fixJson(j):
 	j = re.sub(r"'{\s*?(|\w)", r'{"\1', j)
 	j = re.sub(r"',\s*?(|\w)", r',"\1', j)
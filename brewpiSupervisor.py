@@ -0,0 +1,240 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs brewpi.py as a child process and restarts it when it exits with an error. Started with brewpi.py --supervise.
+
+A child that exits with exit code 0 was stopped on purpose, by a quit or stopScript message, and is not restarted.
+Neither is a child that was terminated with SIGTERM by another process, for example by brewpi.py --quit.
+On posix systems the supervisor creates the listening socket and passes it to each child with --socketfd, so web
+clients can connect while the child restarts. Their requests are handled when the new child is running.
+"""
+
+import os
+import sys
+import time
+import signal
+import subprocess
+import simplejson as json
+
+import BrewPiUtil as util
+from BrewPiUtil import logMessage
+import BrewPiSocket
+import BrewPiProcess
+import instanceLock
+
+
+def childArguments(args):
+    """
+    Returns: the command line arguments for the child, without the options handled by the supervisor
+    """
+    return [arg for arg in args if arg not in ('--supervise', '--dontrunfile', '-d', '--force', '-f')]
+
+
+class Supervisor:
+    """
+    Starts the child command, waits for it to exit and restarts it, waiting longer after each crash
+    """
+    def __init__(self, command, dontRunFilePath, statusFile=None, listenSocket=None,
+                 minRestartDelay=1.0, maxRestartDelay=60.0, stableTime=300.0, pollInterval=1.0):
+        """
+        Params:
+        command: list of arguments to start the child
+        dontRunFilePath: the child is not started while this file exists
+        statusFile: file to write the status to as JSON after each start and exit of the child
+        listenSocket: listening socket passed to the child as --socketfd
+        minRestartDelay: seconds to wait before restarting a child after its first crash
+        maxRestartDelay: maximum seconds to wait before a restart, the delay doubles after each crash
+        stableTime: a child that ran this many seconds before crashing is restarted after minRestartDelay again
+        pollInterval: seconds between checks of the dontrunfile
+        """
+        self.command = command
+        self.dontRunFilePath = dontRunFilePath
+        self.statusFile = statusFile
+        self.listenSocket = listenSocket
+        self.minRestartDelay = minRestartDelay
+        self.maxRestartDelay = maxRestartDelay
+        self.stableTime = stableTime
+        self.pollInterval = pollInterval
+
+        self.running = True
+        self.child = None
+        self.startTime = time.time()
+        self.childStartTime = None
+        self.starts = 0
+        self.crashes = 0
+        self.consecutiveCrashes = 0
+        self.lastExitCode = None
+        self.lastExitTime = None
+        self.lastUptime = None
+
+    def restartDelay(self):
+        """
+        Returns: seconds to wait before starting the child again
+        """
+        if self.consecutiveCrashes == 0:
+            return 0
+        return min(self.maxRestartDelay, self.minRestartDelay * 2 ** (self.consecutiveCrashes - 1))
+
+    def startChild(self):
+        command = list(self.command)
+        if self.listenSocket is not None:
+            command += ['--socketfd', str(self.listenSocket.fileno())]
+        # the child inherits the listening socket. It puts the pid of the supervisor in its process record, so other
+        # instances that stop it stop the supervisor too
+        env = dict(os.environ, BREWPI_SUPERVISOR_PID=str(os.getpid()))
+        self.child = subprocess.Popen(command, close_fds=False, env=env)
+        self.childStartTime = time.time()
+        self.starts += 1
+        logMessage("Supervisor started BrewPi with pid %d" % self.child.pid)
+        self.writeStatus()
+
+    def childExited(self, exitCode, now=None):
+        """
+        Records the exit of the child
+        Returns: True when the child should be restarted
+        """
+        if now is None:
+            now = time.time()
+        self.lastUptime = now - self.childStartTime
+        self.lastExitCode = exitCode
+        self.lastExitTime = now
+        self.child = None
+        if exitCode in (0, -signal.SIGTERM):
+            return False  # stopped on purpose
+        self.crashes += 1
+        if self.lastUptime >= self.stableTime:
+            self.consecutiveCrashes = 1
+        else:
+            self.consecutiveCrashes += 1
+        return True
+
+    def status(self, now=None):
+        if now is None:
+            now = time.time()
+        return dict(pid=os.getpid(),
+                    childPid=self.child.pid if self.child else None,
+                    started=self.startTime,
+                    childStarted=self.childStartTime if self.child else None,
+                    uptime=now - self.childStartTime if self.child else 0,
+                    starts=self.starts,
+                    crashes=self.crashes,
+                    lastExitCode=self.lastExitCode,
+                    lastExitTime=self.lastExitTime,
+                    lastUptime=self.lastUptime,
+                    restartDelay=self.restartDelay())
+
+    def writeStatus(self):
+        if self.statusFile is None:
+            return
+        status = self.status()
+        try:
+            util.writeFileAtomically(self.statusFile, lambda f: json.dump(status, f))
+        except (IOError, OSError), e:
+            logMessage("Supervisor cannot write status file: %s" % e)
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stops the child and the supervisor, used as signal handler
+        """
+        self.running = False
+        if self.child is not None:
+            try:
+                self.child.terminate()
+            except OSError:
+                pass  # already exited
+
+    def run(self):
+        """
+        Starts the child and restarts it until it exits with exit code 0 or the supervisor is stopped
+        Returns: exit code of the last child
+        """
+        restartTime = 0
+        waitingForDontRunFile = False
+        while self.running:
+            if os.path.exists(self.dontRunFilePath):
+                if not waitingForDontRunFile:
+                    logMessage("Supervisor waits until %s is removed to start BrewPi" % self.dontRunFilePath)
+                    waitingForDontRunFile = True
+                time.sleep(self.pollInterval)
+                continue
+            waitingForDontRunFile = False
+            delay = restartTime - time.time()
+            if delay > 0:
+                time.sleep(min(delay, self.pollInterval))
+                continue
+
+            self.startChild()
+            exitCode = self.child.wait()  # returns when the child exits, also after a signal stopped the supervisor
+            if not self.childExited(exitCode) or not self.running:
+                logMessage("BrewPi exited with exit code %d after %.0f seconds, supervisor stops" %
+                           (exitCode, self.lastUptime))
+                break
+            restartTime = time.time() + self.restartDelay()
+            logMessage("BrewPi exited with exit code %d after %.0f seconds, restarting in %.0f seconds (crash %d)" %
+                       (exitCode, self.lastUptime, self.restartDelay(), self.crashes))
+            self.writeStatus()
+        self.writeStatus()
+        return self.lastExitCode or 0
+
+
+def main(args, lock=None):
+    """
+    Runs the supervisor for brewpi.py with the command line arguments args
+    Params:
+    args: command line arguments of brewpi.py
+    lock: the supervisor lock for the config file, when it was taken already
+    Returns: exit code for the supervisor
+    """
+    scriptDir = util.scriptPath()
+    configFile = instanceLock.configFileFromArgs(args, scriptDir)
+    config = util.readCfgWithDefaults(configFile)
+
+    if lock is None:
+        lock = instanceLock.FileLock(instanceLock.supervisorLockName(configFile))
+        if not lock.acquire():
+            logMessage("Another BrewPi supervisor is already running with config file %s. " % configFile +
+                       "This supervisor will exit")
+            return 0
+
+    # creating the socket replaces the socket file, which would cut off an instance that was started without supervisor
+    conflicts = BrewPiProcess.fromConfig(configFile, config).conflicts()
+    if conflicts:
+        logMessage("Another BrewPi instance is already running with the same %s. " % ", ".join(conflicts) +
+                   "This supervisor will exit")
+        lock.release()
+        return 0
+
+    if '--log' in args or '-l' in args:
+        sys.stderr = open(os.path.join(scriptDir, 'logs', 'stderr.txt'), 'a', 1)  # shared with the child
+
+    listenSocket = None
+    if os.name == 'posix':
+        sock = BrewPiSocket.BrewPiSocket(config)
+        sock.create()
+        sock.sock.listen(10)
+        listenSocket = sock.sock
+
+    supervisor = Supervisor([sys.executable, os.path.join(scriptDir, 'brewpi.py')] + childArguments(args),
+                            os.path.join(config['wwwPath'], 'do_not_run_brewpi'),
+                            os.path.join(scriptDir, 'logs', 'supervisor.json'),
+                            listenSocket,
+                            minRestartDelay=float(config.get('supervisorMinRestartDelay', 1.0)),
+                            maxRestartDelay=float(config.get('supervisorMaxRestartDelay', 60.0)),
+                            stableTime=float(config.get('supervisorStableTime', 300.0)))
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    return supervisor.run()
@@ -15,58 +15,157 @@
 # along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
 
 import simplejson as json
+import os
 import sys
 import time
 from distutils.version import LooseVersion
-from BrewPiUtil import asciiToUnicode
+from BrewPiUtil import asciiToUnicode, writeFileAtomically
 from serial import SerialException
 import re
 
-def getVersionFromSerial(ser):
-    version = None
-    retries = 0
-    oldTimeOut = ser.timeout
-    startTime = time.time()
+
+class VersionHandshake:
+    """
+    Requests the version from the controller until a valid version line is received.
+    It is finished as soon as the first valid version arrives. The request is repeated every retryInterval seconds,
+    in case the controller was not listening yet, and it gives up after timeout seconds.
+    """
+    REQUEST = 'request'  # the version should be requested
+    WAITING = 'waiting'  # the version was requested, waiting for the answer
+    DONE = 'done'  # a valid version was received
+    FAILED = 'failed'  # no valid version was received before the timeout
+
+    def __init__(self, timeout=10.0, retryInterval=1.0, now=None):
+        if now is None:
+            now = time.time()
+        self.state = VersionHandshake.REQUEST
+        self.deadline = now + timeout
+        self.retryInterval = retryInterval
+        self.nextRequest = now
+        self.requests = 0
+        self.version = None
+
+    def poll(self, now=None):
+        """
+        Returns: True when the version should be requested now
+        """
+        if self.isFinished():
+            return False
+        if now is None:
+            now = time.time()
+        if now >= self.deadline:
+            self.state = VersionHandshake.FAILED
+            return False
+        if now >= self.nextRequest:
+            self.state = VersionHandshake.WAITING
+            self.nextRequest = now + self.retryInterval
+            self.requests += 1
+            return True
+        return False
+
+    def feed(self, line):
+        """
+        Processes a line received from the controller
+        Returns: True when the handshake is finished
+        """
+        if not self.isFinished() and line.startswith('N:'):
+            version = AvrInfo(line[2:].strip())
+            if version.version != "0.0.0":
+                self.version = version
+                self.state = VersionHandshake.DONE
+        return self.isFinished()
+
+    def isFinished(self):
+        return self.state in (VersionHandshake.DONE, VersionHandshake.FAILED)
+
+
+def getVersionFromSerial(ser, timeout=10.0, abort=None):
+    """
+    Requests the version from the controller
+    abort: optional threading.Event to stop waiting for the version, when it is set by another thread
+    Returns: AvrInfo object, None when no valid version was received within timeout seconds
+    """
     if not ser.isOpen():
         print "Cannot get version from serial port that is not open."
 
-    ser.timeout = 2
+    oldTimeOut = ser.timeout
+    ser.timeout = 0.1  # return quickly when no data is received, to repeat the request in time
     ser.flushInput()
     ser.flushOutput()
-    ser.write('n')  # request version info
-    while retries < 10:
-        retry = True
-        while 1: # read all lines from serial
-            if time.time() - startTime >= 10:
-                # try max 10 seconds
-                retry = False
-                break
-            line = None
-            read_time = time.time()
-            try:
-                line = ser.readline()
-            except SerialException:
-                continue
-            if line:
-                line = asciiToUnicode(line)
-                if line[0] == 'N':
-                    data = line.strip('\n')[2:]
-                    version_parsed = AvrInfo(data)
-                    if version_parsed and version_parsed.version != "0.0.0":
-                        retry = False
-                        version = version_parsed
-                        break
-            if time.time() - read_time >= ser.timeout:
-                # have read entire buffer, now just reading data as it comes in. Break to prevent an endless loop.
-                break
-        if retry:
+    handshake = VersionHandshake(timeout)
+    received = ''  # readline returns a partial line when it times out
+    while not handshake.isFinished() and not (abort is not None and abort.is_set()):
+        if handshake.poll():
             ser.write('n')  # request version info
-            # time.sleep(1) delay not needed because of blocking (timeout) readline
-            retries += 1
-        else:
-            break
+        try:
+            received += ser.readline()
+        except SerialException:
+            time.sleep(0.1)
+            continue
+        if received.endswith('\n'):
+            handshake.feed(asciiToUnicode(received))
+            received = ''
     ser.timeout = oldTimeOut # restore previous serial timeout value
-    return version
+    return handshake.version
+
+
+def versionCacheFileName():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings', 'versionCache.json')
+
+
+def isCacheableIdentity(identity):
+    """
+    Only devices that can be recognized by their USB serial number are cached. A port name alone does not identify
+    the controller: another device can be connected to the same port.
+    """
+    return not identity.startswith('port:')
+
+
+def loadCachedVersion(identity, cacheFileName=None):
+    """
+    Returns: the version last received from the controller with this identity, None when it is not known
+    """
+    if not isCacheableIdentity(identity):
+        return None
+    try:
+        with open(cacheFileName or versionCacheFileName()) as f:
+            cache = json.load(f)
+        return AvrInfo.fromDict(cache[identity])
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def saveCachedVersion(identity, version, cacheFileName=None):
+    """
+    Stores the version received from the controller with this identity, to be used by loadCachedVersion
+    """
+    if isCacheableIdentity(identity):
+        updateVersionCache(identity, version.toDict(), cacheFileName)
+
+
+def forgetCachedVersion(identity, cacheFileName=None):
+    """
+    Removes the version of the controller with this identity, when the cached version could not be confirmed
+    """
+    if loadCachedVersion(identity, cacheFileName) is not None:
+        updateVersionCache(identity, None, cacheFileName)
+
+
+def updateVersionCache(identity, values, cacheFileName=None):
+    cacheFileName = cacheFileName or versionCacheFileName()
+    try:
+        with open(cacheFileName) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+    if values is None:
+        cache.pop(identity, None)
+    else:
+        cache[identity] = values
+    try:
+        writeFileAtomically(cacheFileName, lambda f: json.dump(cache, f))
+    except (IOError, OSError), e:
+        print >> sys.stderr, "Cannot write version cache: %s" % str(e)
 
 
 class AvrInfo:
@@ -173,6 +272,22 @@ class AvrInfo:
         if pattern.match(s): # check for valid string
             self.version = LooseVersion(s)
 
+    def toDict(self):
+        """
+        Returns: the version info as a dict that can be written as JSON, to be restored with fromDict
+        """
+        return dict(version=self.toString(), build=self.build, commit=self.commit, simulator=self.simulator,
+                    board=self.board, shield=self.shield, log=self.log,
+                    family=getattr(self, 'family', None), board_name=getattr(self, 'board_name', None))
+
+    @staticmethod
+    def fromDict(values):
+        info = AvrInfo()
+        info.parseStringVersion(values['version'])
+        for key in ['build', 'commit', 'simulator', 'board', 'shield', 'log', 'family', 'board_name']:
+            setattr(info, key, values.get(key))
+        return info
+
     def toString(self):
         if self.version:
             return str(self.version)
@@ -0,0 +1,215 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keeps the settings of the script in memory, so socket commands can read and change them without parsing files.
+Changed settings are written a short time after the first change, so a burst of changes results in a single write.
+The files are written to a temporary file first and then renamed, so a crash never leaves half a file.
+When a file is changed by another process, it is read again at the next check.
+"""
+
+import os
+import time
+import configobj
+import simplejson as json
+from BrewPiUtil import logMessage, scriptPath, writeFileAtomically
+
+
+class SettingsFile:
+    """
+    Base class for a settings file that is kept in memory and written behind.
+    Subclasses implement read() and write(f).
+    """
+    def __init__(self, fileName, writeDelay=1.0, checkInterval=1.0):
+        self.fileName = fileName
+        self.writeDelay = writeDelay
+        self.checkInterval = checkInterval  # seconds between checks for changes by other processes
+        self.changedTime = None  # time of the first change that has not been written yet
+        self.pending = {}  # settings changed since the last write, applied again when the file is read again
+        self.lastCheck = 0
+        self.signature = None
+
+    def watchedFiles(self):
+        return [self.fileName]
+
+    def fileSignature(self):
+        signature = []
+        for fileName in self.watchedFiles():
+            try:
+                info = os.stat(fileName)
+                signature.append((info.st_mtime, info.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def load(self):
+        self.signature = self.fileSignature()
+        self.read()
+        for name, value in self.pending.items():
+            self.apply(name, value)
+
+    def set(self, name, value):
+        """
+        Changes a setting in memory and schedules a write
+        """
+        self.pending[name] = value
+        self.apply(name, value)
+        if self.changedTime is None:
+            self.changedTime = time.time()
+
+    def isDue(self, now=None):
+        """
+        Returns: True when settings have changed and the write delay has passed
+        """
+        if self.changedTime is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self.changedTime >= self.writeDelay
+
+    def save(self):
+        """
+        Writes the settings to the file, when they have changed
+        """
+        if self.changedTime is None:
+            return
+        self.changedTime = None
+        self.pending = {}
+        try:
+            writeFileAtomically(self.fileName, self.write, 'wb')
+        except (IOError, OSError) as e:
+            logMessage("I/O error while updating %s: %s" % (self.fileName, str(e)))
+            logMessage("Probably your permissions are not set correctly. " +
+                       "To fix this, run 'sudo sh /home/brewpi/fixPermissions.sh'")
+        self.signature = self.fileSignature()
+
+    def reloadIfChanged(self, now=None):
+        """
+        Reads the file again when it was changed by another process, at most once per checkInterval
+        Returns: True when the file was read again
+        """
+        if now is None:
+            now = time.time()
+        if now - self.lastCheck < self.checkInterval:
+            return False
+        self.lastCheck = now
+        if self.fileSignature() == self.signature:
+            return False
+        self.load()
+        return True
+
+
+class ConfigStore(SettingsFile):
+    """
+    The user config file merged with the defaults. It can be used like the ConfigObj returned by
+    util.readCfgWithDefaults. Changed settings are written to the user config file only.
+    """
+    def __init__(self, configFile, defaultsFile=None, writeDelay=1.0, checkInterval=1.0):
+        SettingsFile.__init__(self, configFile, writeDelay, checkInterval)
+        self.defaultsFile = defaultsFile or os.path.join(scriptPath(), 'settings', 'defaults.cfg')
+        self.config = None
+        self.userConfig = None
+        self.load()
+
+    def watchedFiles(self):
+        return [self.fileName, self.defaultsFile]
+
+    def read(self):
+        self.config = configobj.ConfigObj(self.defaultsFile)
+        try:
+            self.userConfig = configobj.ConfigObj(self.fileName)
+            self.config.merge(self.userConfig)
+        except configobj.ConfigObjError:
+            logMessage("ERROR: Could not parse user config file %s" % self.fileName)
+            self.userConfig = None  # do not overwrite the file, the user has to fix it
+        except IOError:
+            logMessage("Could not open user config file %s. Using only default config file" % self.fileName)
+            self.userConfig = None
+
+    def apply(self, name, value):
+        if self.userConfig is not None:
+            self.userConfig[name] = value
+        # store the value like it is read back from the file
+        self.config[name] = value if isinstance(value, basestring) else str(value)
+
+    def save(self):
+        if self.userConfig is None and self.changedTime is not None:
+            logMessage("Changed settings are not saved, because user config file %s could not be read" % self.fileName)
+            self.changedTime = None
+            return
+        SettingsFile.save(self)
+
+    def write(self, f):
+        if not os.path.isfile(self.fileName):
+            logMessage("User config file %s does not exist yet, creating it..." % self.fileName)
+        self.userConfig.write(f)
+
+    def __getitem__(self, name):
+        return self.config[name]
+
+    def __contains__(self, name):
+        return name in self.config
+
+    def get(self, name, default=None):
+        return self.config.get(name, default)
+
+    def getFloat(self, name, default=None):
+        try:
+            return float(self.config[name])
+        except (KeyError, ValueError):
+            return default
+
+    def getInt(self, name, default=None):
+        try:
+            return int(self.config[name])
+        except (KeyError, ValueError):
+            return default
+
+    def getBool(self, name, default=False):
+        try:
+            return self.config.as_bool(name)
+        except (KeyError, ValueError):
+            return default
+
+
+class WwwSettings(SettingsFile):
+    """
+    userSettings.json in the www directory, a copy of the settings that the web server needs when the script is not
+    running. All values are stored as strings.
+    """
+    def __init__(self, fileName, writeDelay=1.0, checkInterval=1.0):
+        SettingsFile.__init__(self, fileName, writeDelay, checkInterval)
+        self.settings = {}
+        self.load()
+
+    def read(self):
+        try:
+            with open(self.fileName) as f:
+                self.settings = json.load(f)
+        except IOError:
+            self.settings = {}
+        except json.JSONDecodeError:
+            logMessage("Error in decoding %s, creating new empty json file" % os.path.basename(self.fileName))
+            self.settings = {}  # start with a fresh file when the json is corrupt.
+
+    def apply(self, name, value):
+        self.settings[name] = str(value)
+
+    def write(self, f):
+        f.write(json.dumps(self.settings))
+
+    def get(self, name, default=None):
+        return self.settings.get(name, default)
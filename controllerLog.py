@@ -0,0 +1,154 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import time
+from BrewPiUtil import logMessage
+
+
+class ControllerLog:
+    """
+    Keeps the most recent log messages received from the controller as structured records.
+    A message that is received again directly after itself does not get a new record, the repeat count of the
+    existing record is increased instead.
+    Each record has a sequence number that is increased when the record changes, so clients can ask for the records
+    that changed since the last sequence number they have seen.
+    """
+    def __init__(self, size=500):
+        self.records = collections.deque(maxlen=size)
+        self.counts = {}  # total number of messages received by id, like 'W2'
+        self.seq = 0
+
+    def add(self, logType, logId, key, values, text, now=None):
+        """
+        Adds a message to the log.
+        Returns: the new or updated record
+        """
+        if now is None:
+            now = time.time()
+        self.seq += 1
+        messageId = logType + str(logId)
+        self.counts[messageId] = self.counts.get(messageId, 0) + 1
+        last = self.records[-1] if self.records else None
+        if last is not None and (last['type'], last['id'], last['values']) == (logType, logId, values):
+            last['repeated'] += 1
+            last['lastTime'] = now
+            last['seq'] = self.seq  # records stay ordered by seq, because only the last record can be repeated
+            return last
+        record = {'seq': self.seq, 'time': now, 'lastTime': now, 'type': logType, 'id': logId, 'key': key,
+                  'values': values, 'text': text, 'repeated': 1}
+        self.records.append(record)
+        return record
+
+    def query(self, since=None, types=None):
+        """
+        Returns: dict with the last sequence number, the records changed after sequence number since,
+        optionally only of the given log types, and the number of messages received by id
+        Raises TypeError when since is not a number or types is not a list of log types
+        """
+        if since is not None and (isinstance(since, bool) or not isinstance(since, (int, long, float))):
+            raise TypeError("since must be a sequence number")
+        if types is not None and (not isinstance(types, list) or
+                                  not all(isinstance(t, basestring) for t in types)):
+            raise TypeError("types must be a list of log types")
+        messages = [r for r in self.records
+                    if (since is None or r['seq'] > since) and (types is None or r['type'] in types)]
+        return {'seq': self.seq, 'messages': messages, 'counts': self.counts}
+
+
+class LogRateLimiter:
+    """
+    Limits how often the same controller log message is written to the log file.
+    Each distinct message (type, id and values) has a token bucket: up to 'burst' messages are written directly,
+    after that 'rate' messages per second. Suppressed messages are reported in summaries.
+    Rate and burst can be set per message id, like 'W2'.
+    """
+    def __init__(self, rate=1 / 60.0, burst=5, overrides=None, summaryInterval=60):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}  # message id: (rate, burst)
+        self.summaryInterval = summaryInterval
+        self.buckets = {}  # (logType, logID, values): [tokens, last update time, suppressed since summary, text]
+        self.suppressed = {}  # total number of suppressed messages by message id
+        self.lastSummary = None
+
+    def limits(self, messageId):
+        return self.overrides.get(messageId, (self.rate, self.burst))
+
+    def allow(self, logType, logId, values, text, now=None):
+        """
+        Returns: True when the message should be written to the log
+        """
+        if now is None:
+            now = time.time()
+        messageId = logType + str(logId)
+        rate, burst = self.limits(messageId)
+        key = (logType, logId, repr(values))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now, 0, text]
+            self.buckets[key] = bucket
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        bucket[2] += 1
+        self.suppressed[messageId] = self.suppressed.get(messageId, 0) + 1
+        return False
+
+    def summaries(self, now=None):
+        """
+        Returns: list of (text, count) for the messages that were suppressed since the last summary.
+        Summaries are only made every summaryInterval seconds, in between the list is empty.
+        """
+        if now is None:
+            now = time.time()
+        if self.lastSummary is None:
+            self.lastSummary = now
+        if now - self.lastSummary < self.summaryInterval:
+            return []
+        self.lastSummary = now
+        result = []
+        for key, bucket in self.buckets.items():
+            if bucket[2] > 0:
+                result.append((bucket[3], bucket[2]))
+                bucket[2] = 0
+            else:
+                rate, burst = self.limits(key[0] + str(key[1]))
+                if bucket[0] + (now - bucket[1]) * rate >= burst:
+                    del self.buckets[key]  # bucket is full again, no need to remember the message
+        return result
+
+
+def rateOverrides(section):
+    """
+    Parses per message rate limits from a config section with lines like: W2 = 0.05, 3
+    Returns: dict of message id: (rate, burst)
+    """
+    overrides = {}
+    for messageId, value in section.items():
+        try:
+            # configobj returns a list for a value with a comma, a string like "12" would unpack as "1", "2"
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise ValueError("expected two values")
+            rate, burst = value
+            overrides[messageId] = (float(rate), int(burst))
+        except (ValueError, TypeError):
+            logMessage("Invalid rate limit for controller log message %s: %s, expected <rate>, <burst>" %
+                       (messageId, value))
+    return overrides
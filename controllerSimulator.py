@@ -0,0 +1,382 @@
+#!/usr/bin/python
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Simulates a BrewPi controller, so the script can be run and tested without hardware.
+
+The simulator can be used in two ways:
+- in process, by setting port = sim://?<options> in config.cfg. Options are given as URL query parameters.
+- over a pseudo terminal, by running 'python controllerSimulator.py [options]'. It prints the name of the
+  pseudo terminal, which can be used as port in config.cfg.
+
+Options:
+delay: seconds before the controller responds to a command
+baud: baud rate to limit the output to, 0 for unlimited
+log: probability that a log message is injected in the middle of a response line
+drop: probability that a response line is dropped
+garbage: probability that random characters are inserted in a response line
+disconnect: probability per command that the controller disconnects
+downtime: seconds the controller stays disconnected
+seed: seed for the random number generator, to make fault injection reproducible
+version: firmware version reported by the controller
+logVersion: version of the log messages reported by the controller
+"""
+
+from __future__ import print_function
+import collections
+import getopt
+import os
+import random
+import sys
+import time
+import simplejson as json
+import brewpiJson
+import urlparse
+from serial import SerialException
+from virtualSerial import VirtualSerial
+
+# type of each option of the simulator
+optionTypes = {'delay': float, 'baud': int, 'log': float, 'drop': float, 'garbage': float, 'disconnect': float,
+               'downtime': float, 'seed': int, 'version': str, 'logVersion': int}
+
+
+def parseOptions(options):
+    """
+    Converts options given as strings, in an URL or on the command line, to their type
+    Returns: dict with the options, to pass to SimulatedController
+    Raises ValueError for unknown options and invalid values
+    """
+    parsed = {}
+    for name, value in options.items():
+        if name not in optionTypes:
+            raise ValueError("Unknown simulator option '%s'" % name)
+        try:
+            parsed[name] = optionTypes[name](value)
+        except ValueError:
+            raise ValueError("Invalid value for simulator option '%s': %s" % (name, value))
+    return parsed
+
+
+class SimulatedController:
+    """
+    Implements the serial protocol of the BrewPi firmware. Commands are written with write(),
+    responses become available from read() after the configured delay and at the configured baud rate.
+    """
+    def __init__(self, delay=0.0, baud=0, log=0.0, drop=0.0, garbage=0.0, disconnect=0.0, downtime=1.0,
+                 seed=None, version="0.5.0", logVersion=3):
+        self.delay = delay
+        self.baud = baud
+        self.logProbability = log
+        self.dropProbability = drop
+        self.garbageProbability = garbage
+        self.disconnectProbability = disconnect
+        self.downtime = downtime
+        self.random = random.Random(seed)
+        self.versionInfo = {"v": version, "n": "sim", "c": "00000000", "s": 0, "y": 1, "b": "p", "l": logVersion}
+        self.input = ''
+        self.output = collections.deque()  # (time when ready, data)
+        self.pending = ''
+        self.lastRead = time.time()
+        self.disconnectedUntil = None
+        self.resetSettings()
+        self.resetConstants()
+        self.beerTemp = 18.0
+        self.fridgeTemp = 18.0
+        self.lastModelUpdate = time.time()
+        self.installed = [
+            {"i": 0, "t": 4, "c": 1, "b": 0, "f": 2, "h": 1, "d": 0, "p": 17, "v": 0, "x": 0},
+            {"i": 1, "t": 4, "c": 1, "b": 0, "f": 3, "h": 1, "d": 0, "p": 16, "v": 0, "x": 0},
+            {"i": 2, "t": 5, "c": 1, "b": 0, "f": 5, "h": 2, "d": 0, "p": 0, "v": 0, "j": 0.0,
+             "a": "28FF93D770160371"},
+            {"i": 3, "t": 5, "c": 1, "b": 1, "f": 9, "h": 2, "d": 0, "p": 0, "v": 0, "j": 0.0,
+             "a": "28FF0E3E71160374"}]
+        self.available = [
+            {"c": 1, "b": 0, "f": 0, "h": 1, "p": 11, "x": 0, "d": 0, "t": 0},
+            {"c": 1, "b": 0, "f": 0, "h": 2, "p": 0, "x": 0, "d": 0, "t": 0, "a": "28FF1A2B71160301", "j": 0.0}]
+
+    def resetSettings(self):
+        self.settings = collections.OrderedDict([("mode", "b"), ("beerSet", 20.0), ("fridgeSet", 20.0),
+                                                 ("heatEst", 0.199), ("coolEst", 5.0)])
+
+    def resetConstants(self):
+        self.constants = collections.OrderedDict([
+            ("tempFormat", "C"), ("tempSetMin", 1.0), ("tempSetMax", 30.0), ("pidMax", 10.0), ("Kp", 5.0),
+            ("Ki", 0.25), ("Kd", -1.5), ("iMaxErr", 0.5), ("idleRangeH", 1.0), ("idleRangeL", -1.0),
+            ("heatTargetH", 0.299), ("heatTargetL", -0.199), ("coolTargetH", 0.199), ("coolTargetL", -0.299),
+            ("maxHeatTimeForEst", 600), ("maxCoolTimeForEst", 1200), ("fridgeFastFilt", 1), ("fridgeSlowFilt", 4),
+            ("fridgeSlopeFilt", 3), ("beerFastFilt", 3), ("beerSlowFilt", 4), ("beerSlopeFilt", 4), ("lah", 0),
+            ("hs", 0)])
+
+    def isDisconnected(self):
+        if self.disconnectedUntil is None:
+            return False
+        if time.time() >= self.disconnectedUntil:
+            self.disconnectedUntil = None
+            return False
+        return True
+
+    # serial side of the simulator
+
+    def write(self, data):
+        self.input += data
+        for (command, argument) in self.parseCommands():
+            if self.random.random() < self.disconnectProbability:
+                self.disconnectedUntil = time.time() + self.downtime
+                self.input = ''
+                self.output.clear()
+                self.pending = ''
+                return
+            for line in self.handleCommand(command, argument):
+                self.respond(line)
+
+    def read(self):
+        """
+        Returns: all response data that is ready to be sent, limited by the baud rate
+        """
+        now = time.time()
+        while self.output and self.output[0][0] <= now:
+            self.pending += self.output.popleft()[1]
+        if self.baud > 0:
+            budget = int((now - self.lastRead) * self.baud / 10)  # 10 bits per byte
+            if budget == 0:
+                return ''
+            data = self.pending[:budget]
+        else:
+            data = self.pending
+        self.pending = self.pending[len(data):]
+        self.lastRead = now
+        return data
+
+    def respond(self, line):
+        if self.random.random() < self.dropProbability:
+            return
+        if self.random.random() < self.garbageProbability:
+            position = self.random.randint(0, len(line))
+            garbage = ''.join(chr(self.random.randint(33, 126)) for i in range(self.random.randint(1, 8)))
+            line = line[:position] + garbage + line[position:]
+        if self.random.random() < self.logProbability:
+            # the controller can print log messages in the middle of a line
+            position = self.random.randint(0, len(line))
+            line = line[:position] + self.logMessage('W', 2, [self.random.randint(0, 20), "28FF93D770160371"]) + \
+                line[position:]
+        self.output.append((time.time() + self.delay, line + "\n"))
+
+    def parseCommands(self):
+        """
+        Commands are single characters, some followed by a JSON object. Whitespace between commands is ignored.
+        Returns: list of (command, argument) tuples. Incomplete commands stay in the input buffer.
+        """
+        commands = []
+        while self.input:
+            command = self.input[0]
+            if command in ' \r\n':
+                self.input = self.input[1:]
+                continue
+            rest = self.input[1:]
+            if command in 'jdhU':
+                if not rest:
+                    break  # wait for argument
+                if rest[0] == '{':
+                    end = rest.find('}')
+                    if end < 0:
+                        break  # wait for the end of the argument
+                    commands.append((command, rest[:end + 1]))
+                    self.input = rest[end + 1:]
+                    continue
+            commands.append((command, None))
+            self.input = rest
+        return commands
+
+    # protocol side of the simulator
+
+    def logMessage(self, logType, logId, values):
+        return "D:" + json.dumps({"logType": logType, "logID": logId, "V": values}) + "\r\n"
+
+    def updateModel(self):
+        """
+        Moves the temperatures towards their set points, with some noise
+        """
+        now = time.time()
+        dt = now - self.lastModelUpdate
+        self.lastModelUpdate = now
+        mode = self.settings['mode']
+        if mode == 'o':
+            return
+        beerSet = self.settings['beerSet']
+        fridgeSet = self.settings['fridgeSet']
+        if mode in 'bp' and beerSet is not None:
+            fridgeSet = beerSet + (beerSet - self.beerTemp) * 2
+            self.settings['fridgeSet'] = round(fridgeSet, 2)
+        if fridgeSet is not None:
+            self.fridgeTemp += (fridgeSet - self.fridgeTemp) * min(1.0, dt / 600.0)
+        self.beerTemp += (self.fridgeTemp - self.beerTemp) * min(1.0, dt / 3600.0)
+
+    def noise(self):
+        return self.random.uniform(-0.05, 0.05)
+
+    def handleCommand(self, command, argument):
+        """
+        Returns: list of lines to send in response to the command
+        """
+        if command == 'n':
+            return ["N:" + json.dumps(self.versionInfo)]
+        if command == 't':
+            self.updateModel()
+            return ["T:" + json.dumps(collections.OrderedDict([
+                ("bt", round(self.beerTemp + self.noise(), 2)), ("bs", self.settings['beerSet']),
+                ("ft", round(self.fridgeTemp + self.noise(), 2)), ("fs", self.settings['fridgeSet']),
+                ("s", 0)]))]
+        if command == 's':
+            return ["S:" + json.dumps(self.settings)]
+        if command == 'c':
+            return ["C:" + json.dumps(self.constants)]
+        if command == 'v':
+            return ["V:" + json.dumps(collections.OrderedDict([
+                ("beerDiff", round((self.settings['beerSet'] or self.beerTemp) - self.beerTemp, 2)), ("diffIntegral", 0.0),
+                ("beerSlope", 0.0), ("p", 0.0), ("i", 0.0), ("d", 0.0), ("estPeak", round(self.fridgeTemp, 2)),
+                ("negPeakEst", 0.0), ("posPeakEst", 0.0), ("negPeak", 0.0), ("posPeak", 0.0)]))]
+        if command == 'd':
+            return ["d:" + json.dumps(self.installed)]
+        if command == 'h':
+            return ["h:" + json.dumps(self.available)]
+        if command == 'j':
+            return self.applySettings(argument)
+        if command == 'U':
+            return ["U:" + (argument or "{}")]
+        if command == 'S':
+            self.resetSettings()
+            return [self.logMessage('I', 14, []).rstrip("\r\n"), "S:" + json.dumps(self.settings)]
+        if command == 'C':
+            self.resetConstants()
+            return [self.logMessage('I', 13, []).rstrip("\r\n"), "C:" + json.dumps(self.constants)]
+        if command == 'E':
+            self.resetSettings()
+            self.resetConstants()
+            return [self.logMessage('I', 16, []).rstrip("\r\n")]
+        return [self.logMessage('W', 1, [ord(command)]).rstrip("\r\n")]
+
+    def applySettings(self, argument):
+        """
+        Applies settings like {mode:b, beerSet:20.5}. Keys and string values do not have to be quoted.
+        """
+        lines = []
+        try:
+            newSettings = brewpiJson.parseRelaxedJson(argument)
+        except json.JSONDecodeError:
+            newSettings = None
+        if not isinstance(newSettings, dict):
+            return [self.logMessage('W', 0, []).rstrip("\r\n")]
+        for key, value in newSettings.iteritems():
+            if isinstance(value, int) and not isinstance(value, bool):
+                value = float(value)  # like the settings sent by the controller
+            if key in self.settings:
+                self.settings[key] = value
+            elif key in self.constants:
+                self.constants[key] = value
+            else:
+                lines.append(self.logMessage('W', 0, []).rstrip("\r\n"))
+                continue
+            lines.append(self.logMessage('I', 12, [key, str(value)]).rstrip("\r\n"))
+        lines.append("S:" + json.dumps(self.settings))
+        return lines
+
+
+class SimulatedSerial(VirtualSerial):
+    """
+    A serial port with a simulated controller behind it, used for URL's like sim://?delay=0.01&baud=57600
+    """
+    def __init__(self, controller, port='sim://', timeout=None):
+        VirtualSerial.__init__(self, port, timeout=timeout)
+        self.controller = controller
+
+    @staticmethod
+    def fromUrl(url, timeout=None):
+        options = dict((key, values[0]) for (key, values) in urlparse.parse_qs(urlparse.urlsplit(url).query).items())
+        try:
+            options = parseOptions(options)
+        except ValueError as e:
+            raise SerialException("%s in %s" % (e, url))
+        return SimulatedSerial(SimulatedController(**options), port=url, timeout=timeout)
+
+    def open(self):
+        if self.controller.isDisconnected():
+            raise SerialException("Simulated controller is disconnected")
+        VirtualSerial.open(self)
+
+    def poll(self):
+        if self.controller.isDisconnected():
+            self.disconnected = True
+            return
+        data = self.controller.read()
+        if data:
+            self.feed(data)
+
+    def handle_write(self, data):
+        self.controller.write(data)
+
+    def flushInput(self):
+        with self._data_available:
+            self._rx = ''
+
+
+def runOnPty(controller):
+    """
+    Runs the simulated controller on a pseudo terminal until interrupted
+    """
+    import select
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print("Simulated BrewPi controller running on {0}".format(os.ttyname(slave)))
+    sys.stdout.flush()
+    try:
+        while True:
+            readable, writable, exceptional = select.select([master], [], [], 0.01)
+            if master in readable:
+                data = os.read(master, 1024)
+                if not controller.isDisconnected():
+                    controller.write(data)
+            if not controller.isDisconnected():
+                data = controller.read()
+                if data:
+                    os.write(master, data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+if __name__ == '__main__':
+    options = [name + '=' for name in sorted(optionTypes)]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ['help'] + options)
+    except getopt.GetoptError:
+        print("Unknown parameter, available options: --" + ", --".join(options), file=sys.stderr)
+        sys.exit(1)
+    settings = {}
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        settings[o.lstrip('-')] = a
+    try:
+        settings = parseOptions(settings)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    runOnPty(SimulatedController(**settings))
@@ -0,0 +1,109 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import simplejson as json
+import brewpiJson
+from BrewPiUtil import logMessage
+
+
+class StateLine:
+    """
+    Holds the latest JSON object received from the controller for a type of line, like control settings ('S') or
+    control constants ('C'). The line is kept as received. An identical line is ignored, a changed line is decoded
+    once, when a value is needed or when the next changed line is received.
+    Values can be changed locally, for example when a new setting is sent to the controller. These changes are kept
+    until the next line is received from the controller.
+    """
+    def __init__(self, name, defaults=None):
+        self.name = name
+        self.raw = None
+        self.hash = None
+        self.values = dict(defaults or {})
+        self.decoded = True  # values are up to date with raw
+        self.valid = True  # raw could be decoded
+        self.modified = False  # values have been changed locally
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Calls callback(stateLine) each time the state changes
+        """
+        self.subscribers.append(callback)
+
+    def update(self, payload):
+        """
+        Stores a line received from the controller.
+        Returns: True when it differs from the current state
+        """
+        payloadHash = hash(payload)
+        if payloadHash == self.hash and payload == self.raw and not self.modified:
+            return False
+        self.__decode()  # a line that was never used is decoded now, so its values are kept if this one is invalid
+        self.raw = payload
+        self.hash = payloadHash
+        self.decoded = False
+        self.modified = False
+        for callback in self.subscribers:
+            callback(self)
+        return True
+
+    def __decode(self):
+        if self.decoded:
+            return
+        self.decoded = True
+        try:
+            self.values = self.__parse(self.raw)
+            self.valid = True
+        except json.JSONDecodeError, e:
+            logMessage("JSON decode error in %s: %s" % (self.name, str(e)))
+            logMessage("Line received was: " + self.raw)
+            self.valid = False  # keep the last values that could be decoded
+
+    def __parse(self, payload):
+        values = brewpiJson.loads(payload)
+        if not isinstance(values, dict):
+            raise json.JSONDecodeError("Expected an object", payload, 0)
+        return values
+
+    def __getitem__(self, key):
+        self.__decode()
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        self.__decode()
+        self.values[key] = value
+        self.modified = True
+
+    def __contains__(self, key):
+        self.__decode()
+        return key in self.values
+
+    def get(self, key, default=None):
+        self.__decode()
+        return self.values.get(key, default)
+
+    def copy(self):
+        self.__decode()
+        return dict(self.values)
+
+    def json(self):
+        """
+        Returns: the state as JSON, the line as received when it has not been changed locally
+        """
+        self.__decode()
+        if self.raw is not None and self.valid and not self.modified:
+            return self.raw
+        return json.dumps(self.values)
@@ -17,14 +17,22 @@
 import brewpiJson
 import simplejson as json
 import parseEnum
+from BrewPiUtil import writeFileAtomically
 import os
 import re
+import cPickle as pickle
 
-logMessagesFile = os.path.dirname(__file__) + '/LogMessages.h'
+logMessagesFile = os.path.dirname(os.path.abspath(__file__)) + '/LogMessages.h'
+# copies of LogMessages.h of other controller firmware versions, named LogMessages-<log messages version>.h
+otherVersionsDir = os.path.dirname(os.path.abspath(__file__)) + '/logMessages/'
+# compiled catalogs are cached here, so the header file only has to be parsed again when it changes
+cacheDir = os.path.dirname(os.path.abspath(__file__)) + '/settings/'
+CACHE_FORMAT = 2
 
-errorDict = parseEnum.parseEnumInFile(logMessagesFile, 'errorMessages')
-infoDict = parseEnum.parseEnumInFile(logMessagesFile, 'infoMessages')
-warningDict = parseEnum.parseEnumInFile(logMessagesFile, 'warningMessages')
+# log type: (enum name in the header file, description)
+logTypes = {'E': ('errorMessages', "ERROR"),
+            'W': ('warningMessages', "WARNING"),
+            'I': ('infoMessages', "INFO MESSAGE")}
 
 
 def valToFunction(val):
@@ -50,63 +58,178 @@ def valToFunction(val):
         return 'Unknown Device Function'
 
 
-def getVersion():
-    hFile = open(logMessagesFile)
-    for line in hFile:
+def valToCharacter(val):
+    if val == -1:
+        # No character received
+        return 'END OF INPUT'
+    else:
+        return chr(val)
+
+
+# parameters that are not printed as received, by parameter name in the header file
+paramFormatters = {'config.deviceFunction': valToFunction,
+                   'character': valToCharacter}
+
+
+class LogMessageCatalog:
+    """
+    The log messages of one version of LogMessages.h, with the strings already converted to python format strings
+    """
+    def __init__(self, version, messages):
+        self.version = version
+        # (logType, logID): (prefix, format string, number of parameters, parameter formatters, key in header file)
+        self.messages = {}
+        for key, (prefix, printString, numVars, paramNames, logKey) in messages.iteritems():
+            formatters = tuple(paramFormatters.get(name) for name in paramNames)
+            self.messages[key] = (prefix, printString, numVars, formatters, logKey)
+
+    def key(self, logType, logId):
+        """
+        Returns: the name of the message in the header file, like WARNING_TEMP_SENSOR_DISCONNECTED
+        """
+        entry = self.messages.get((logType, logId))
+        return entry[4] if entry else None
+
+    def expand(self, logType, logId, values):
+        entry = self.messages.get((logType, logId))
+        if entry is None:
+            logTypeString = logTypes[logType][1] if logType in logTypes else "**UNKNOWN MESSAGE TYPE**"
+            return logTypeString + " with unknown ID " + str(logId)
+        prefix, printString, numVars, formatters = entry[:4]
+        for i, formatter in enumerate(formatters[:len(values)]):
+            if formatter is not None:
+                values[i] = formatter(values[i])
+        if numVars == len(values):
+            return prefix + printString % tuple(values)
+        else:
+            return prefix + printString + "  | Number of arguments mismatch!, expected " + str(
+                numVars) + "arguments, received " + str(values)
+
+
+def compileCatalog(hFilePath):
+    """
+    Parses a log messages header file
+    Returns: (version, messages) for LogMessageCatalog
+    """
+    with open(hFilePath) as hFile:
+        lines = hFile.readlines()
+    version = 0
+    for line in lines:
         if 'BREWPI_LOG_MESSAGES_VERSION ' in line:
-            splitLine = line.split('BREWPI_LOG_MESSAGES_VERSION')
-            return int(splitLine[1])  # return version number
-    print "ERROR: could not find version number in log messages header file"
-    return 0
+            version = int(line.split('BREWPI_LOG_MESSAGES_VERSION')[1])
+            break
+    else:
+        print "ERROR: could not find version number in log messages header file"
+    messages = {}
+    for logType, (enumName, logTypeString) in logTypes.iteritems():
+        for logId, message in parseEnum.parseEnumInLines(lines, enumName).iteritems():
+            printString = message['logString'].replace("%d", "%s").replace("%c", "%s")
+            messages[(logType, logId)] = (logTypeString + " " + str(logId) + ": ", printString,
+                                          printString.count("%s"), tuple(message['paramNames']),
+                                          message['logKey'])
+    return version, messages
+
+
+def loadCatalog(hFilePath):
+    """
+    Loads the catalog for a header file from the cache, or compiles it and updates the cache when the header has
+    changed. A cache that cannot be read or written is not an error, the header is parsed instead.
+    """
+    stat = os.stat(hFilePath)
+    key = (CACHE_FORMAT, stat.st_mtime, stat.st_size)
+    cacheFile = cacheDir + os.path.basename(hFilePath) + '.cache'
+    try:
+        with open(cacheFile, 'rb') as f:
+            cachedKey, version, messages = pickle.load(f)
+        if cachedKey == key:
+            return LogMessageCatalog(version, messages)
+    except Exception:  # missing, corrupt or written by another version of the script
+        pass
+    version, messages = compileCatalog(hFilePath)
+    try:
+        writeFileAtomically(cacheFile, lambda f: pickle.dump((key, version, messages), f, pickle.HIGHEST_PROTOCOL),
+                            'wb')
+    except (IOError, OSError):
+        pass
+    return LogMessageCatalog(version, messages)
+
+
+catalogs = {}  # log messages version: LogMessageCatalog, catalogs are loaded on first use
+localCatalog = None  # catalog of the local copy of LogMessages.h
+selectedCatalog = None  # catalog used to expand messages, see selectCatalog
+
+
+def getLocalCatalog():
+    global localCatalog
+    if localCatalog is None:
+        localCatalog = loadCatalog(logMessagesFile)
+        catalogs.setdefault(localCatalog.version, localCatalog)
+    return localCatalog
+
+
+def findCatalog(version):
+    """
+    Returns: the catalog for a log messages version, or None when there is no header file for that version
+    """
+    getLocalCatalog()
+    if version not in catalogs:
+        hFilePath = otherVersionsDir + 'LogMessages-%d.h' % version
+        if not os.path.isfile(hFilePath):
+            return None
+        catalogs[version] = loadCatalog(hFilePath)
+    return catalogs[version]
+
+
+def selectCatalog(version):
+    """
+    Selects the catalog used to expand log messages, by the log messages version the controller reports.
+    The local catalog is used when there is no catalog for the version.
+    Returns: the selected catalog
+    """
+    global selectedCatalog
+    selectedCatalog = findCatalog(version) or getLocalCatalog()
+    return selectedCatalog
+
+
+def getCatalog():
+    """
+    Returns: the catalog selected for the controller, or the local catalog when none has been selected
+    """
+    return selectedCatalog or getLocalCatalog()
+
+
+def getVersion():
+    return getLocalCatalog().version
+
+
+def diffCatalogs(old, new):
+    """
+    Returns: dict with lists of message ids, like 'W2', that were added, removed or changed in catalog new
+    """
+    def ids(keys):
+        return sorted(logType + str(logId) for logType, logId in keys)
+    oldKeys = set(old.messages)
+    newKeys = set(new.messages)
+    return {'added': ids(newKeys - oldKeys),
+            'removed': ids(oldKeys - newKeys),
+            'changed': ids(k for k in oldKeys & newKeys if old.messages[k] != new.messages[k])}
 
 
 def expandLogMessage(logMessageJsonString):
-    expanded = ""
     logMessageJson = json.loads(logMessageJsonString)
-    logId = int(logMessageJson['logID'])
+    return getCatalog().expand(logMessageJson['logType'], int(logMessageJson['logID']), logMessageJson['V'])
+
+
+def decodeLogMessage(logMessageJsonString):
+    """
+    Returns: (logType, logID, key, values, expanded message) for a log message received from the controller
+    """
+    logMessageJson = json.loads(logMessageJsonString)
     logType = logMessageJson['logType']
+    logId = int(logMessageJson['logID'])
     values = logMessageJson['V']
-    dict = 0
-    logTypeString = "**UNKNOWN MESSAGE TYPE**"
-    if logType == "E":
-        dict = errorDict
-        logTypeString = "ERROR"
-    elif logType == "W":
-        dict = warningDict
-        logTypeString = "WARNING"
-    elif logType == "I":
-        dict = infoDict
-        logTypeString = "INFO MESSAGE"
-
-    if logId in dict:
-        expanded += logTypeString + " "
-        expanded += str(logId) + ": "
-        count = 0
-        for v in values:
-            try:
-                if dict[logId]['paramNames'][count] == "config.deviceFunction":
-                    values[count] = valToFunction(v)
-                elif dict[logId]['paramNames'][count] == "character":
-                    if values[count] == -1:
-                        # No character received
-                        values[count] = 'END OF INPUT'
-                    else:
-                        values[count] = chr(values[count])
-            except IndexError:
-                pass
-            count += 1
-        printString = dict[logId]['logString'].replace("%d", "%s").replace("%c", "%s")
-        numVars = printString.count("%s")
-        numReceived = len(values)
-        if numVars == numReceived:
-            expanded += printString % tuple(values)
-        else:
-            expanded += printString + "  | Number of arguments mismatch!, expected " + str(
-                numVars) + "arguments, received " + str(values)
-    else:
-        expanded += logTypeString + " with unknown ID " + str(logId)
-
-    return expanded
+    catalog = getCatalog()
+    return logType, logId, catalog.key(logType, logId), values, catalog.expand(logType, logId, list(values))
 
 
 def filterOutLogMessages(input_string):
@@ -126,5 +249,3 @@ if __name__ == '__main__':
     stripped, messages = filterOutLogMessages(test_string)
     print('Stripped line: {0}'.format(stripped))
     print('messages: {0}'.format(messages))
-
-getVersion()
@@ -0,0 +1,314 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Lock files that are held by a running BrewPi instance for as long as it runs. The operating system releases the lock
+when the process exits, also when it crashes or is killed, so a lock file left behind is never stale.
+
+This module is imported by brewpi.py before any other module, to exit quickly when the script is started by cron
+and it should not run. Only import standard libraries that load fast here.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
+
+def lockDir():
+    """
+    Returns: directory with the lock files, shared by all users and installations of BrewPi on this system
+    """
+    path = os.environ.get('BREWPI_LOCK_DIR') or os.path.join(tempfile.gettempdir(), 'brewpi-locks')
+    if not os.path.isdir(path):
+        try:
+            os.mkdir(path)
+            os.chmod(path, 0o1777)  # the web server and the brewpi user both need to create locks
+        except OSError:
+            pass  # created by another process at the same time, or no permission to change the mode
+    return path
+
+
+class FileLock:
+    """
+    An exclusive lock on a file in the lock directory, which can only be held by one process at a time
+    """
+    def __init__(self, name, removeOnRelease=False):
+        """
+        Params:
+        name: name of the lock, the file is name.lock in the lock directory
+        removeOnRelease: remove the lock file when the lock is released, for locks with a name that is used only once
+        """
+        self.name = name
+        self.path = os.path.join(lockDir(), name + '.lock')
+        self.removeOnRelease = removeOnRelease
+        self.fd = None
+
+    def open(self):
+        """
+        Returns: file descriptor of the lock file, None when it cannot be opened
+        """
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o666)
+        except (IOError, OSError):
+            # created by another user without write permission for us. A read only file can still be locked.
+            try:
+                return os.open(self.path, os.O_RDONLY)
+            except (IOError, OSError):
+                return None
+        if fcntl:
+            try:
+                os.fchmod(fd, 0o666)  # the web server and the brewpi user both use the locks, ignore the umask
+            except OSError:
+                pass  # the file is owned by another user
+        return fd
+
+    def acquire(self, timeout=0):
+        """
+        Tries to acquire the lock, waiting at most timeout seconds
+        Returns: True when the lock is held by this process, False when it is held by another process or the lock
+        file cannot be opened
+        """
+        if self.fd is not None:
+            return True
+        deadline = time.time() + timeout
+        fd = self.open()
+        if fd is None:
+            return False
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # do not pass the lock on to child processes or to the script itself when it restarts with exec
+                    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self.fd = fd
+                return True
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(0.05)
+
+    def release(self):
+        if self.fd is not None:
+            if self.removeOnRelease:
+                try:
+                    os.remove(self.path)  # removed while it is still locked, so nobody else holds it
+                except OSError:
+                    pass
+            os.close(self.fd)  # closing the file releases the lock
+            self.fd = None
+
+    def isHeld(self):
+        return self.fd is not None
+
+    def isLocked(self):
+        """
+        Returns: True when the lock is held by any process, including this one. A lock file that cannot be opened
+        counts as locked.
+        """
+        if self.fd is not None:
+            return True
+        if self.acquire():
+            self.release()
+            return False
+        return True
+
+
+def _hashName(prefix, key):
+    return prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def configLockName(configFile):
+    """
+    Returns: name of the lock for a config file, the same for all paths to the file
+    """
+    return _hashName('cfg-', os.path.realpath(configFile))
+
+
+def supervisorLockName(configFile):
+    """
+    Returns: name of the lock held by the supervisor of the instance with this config file
+    """
+    return _hashName('supervisor-', os.path.realpath(configFile))
+
+
+def portLockName(port):
+    """
+    Returns: name of the lock for a serial port setting. Ports that are detected automatically all share one lock.
+    """
+    if os.path.isabs(port):
+        port = os.path.realpath(port)  # /dev/serial/by-id/... links to /dev/ttyACM0
+    return _hashName('port-', port)
+
+
+def socketLockName(socketType, socketFile, host, port):
+    """
+    Returns: name of the lock for the socket a BrewPi instance listens on
+    """
+    if socketType == 'i':
+        key = 'i:%s:%s' % (host, port)
+    else:
+        key = 'f:' + os.path.realpath(socketFile)
+    return _hashName('socket-', key)
+
+
+def firmwareLock():
+    """
+    Returns: the lock to hold while this process updates the firmware of a controller. BrewPi does not start while
+    a firmware lock is held. Each process has its own lock, so a flashing tool can start another one.
+    """
+    return FileLock('firmware-%d' % os.getpid(), removeOnRelease=True)
+
+
+def firmwareUpdateRunning():
+    """
+    Returns: True when a process holds a firmware lock. Lock files that cannot be opened at all are ignored,
+    they cannot be locked by anyone either.
+    """
+    running = False
+    for path in glob.glob(os.path.join(lockDir(), 'firmware-*.lock')):
+        lock = FileLock(os.path.basename(path)[:-len('.lock')], removeOnRelease=True)
+        fd = lock.open()
+        if fd is None:
+            continue
+        os.close(fd)
+        if lock.acquire():
+            # left behind by a process that has exited, removed while nobody can take it. The sticky lock directory
+            # does not allow removing files of other users, those stay but are not locked.
+            lock.release()
+        else:
+            running = True
+    return running
+
+
+def defaultConfigFile(scriptDir):
+    return os.path.join(scriptDir, 'settings', 'config.cfg')
+
+
+def readSetting(fileNames, name, default=None):
+    """
+    Reads a top level setting from config files without loading ConfigObj. Later files overrule earlier files.
+    Only handles the simple 'name = value' lines, which is all that is needed for paths.
+    """
+    value = default
+    for fileName in fileNames:
+        try:
+            with open(fileName) as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('['):
+                        break  # sections start, there are no top level settings after this
+                    if line.startswith('#') or '=' not in line:
+                        continue
+                    key, setting = [part.strip() for part in line.split('=', 1)]
+                    if key == name:
+                        if setting[:1] in ('"', "'") and setting[-1:] == setting[:1]:
+                            setting = setting[1:-1]
+                        else:
+                            setting = setting.split('#')[0].strip()  # inline comment
+                        value = setting
+        except IOError:
+            continue
+    return value
+
+
+def configFileFromArgs(args, scriptDir):
+    """
+    Returns: the config file given with -c or --config in the command line arguments, or the default config file
+    """
+    for i, arg in enumerate(args):
+        if arg in ('-c', '--config') and i + 1 < len(args):
+            return os.path.abspath(args[i + 1])
+        if arg.startswith('--config='):
+            return os.path.abspath(arg[len('--config='):])
+        if arg.startswith('-c') and len(arg) > 2:
+            return os.path.abspath(arg[2:])
+    return defaultConfigFile(scriptDir)
+
+
+# short command line options of brewpi.py and options that take a value
+shortOptions = {'-h': '--help', '-s': '--status', '-q': '--quit', '-k': '--kill', '-f': '--force', '-l': '--log',
+                '-d': '--dontrunfile'}
+valueOptions = ['--config', '--socketfd']
+
+
+def commandLineOptions(args):
+    """
+    Returns: set of the long names of the options in the command line arguments, without their values
+    """
+    options = set()
+    skipValue = False
+    for arg in args:
+        if skipValue:
+            skipValue = False
+        elif arg.startswith('--'):
+            name = arg.split('=', 1)[0]
+            options.add(name)
+            skipValue = name in valueOptions and '=' not in arg
+        elif arg.startswith('-'):
+            for i, c in enumerate(arg[1:]):
+                if c == 'c':
+                    options.add('--config')
+                    skipValue = i == len(arg) - 2  # the value is the next argument
+                    break  # the rest of the argument is the value
+                options.add(shortOptions.get('-' + c, '-' + c))
+    return options
+
+
+def isCronStart(args):
+    """
+    Returns: True when brewpi.py was started with --dontrunfile, which is used by cron, to only start it when it is not
+    running yet. Starts that quit or replace other instances (--quit, --kill, --force, --handoff) always continue.
+    """
+    options = commandLineOptions(args)
+    return '--dontrunfile' in options and not options & {'--quit', '--kill', '--force', '--handoff'}
+
+
+def cronStartupCheck(args, scriptDir):
+    """
+    Does the checks for brewpi.py --dontrunfile, which is started by cron every minute, before loading anything else:
+    - the dontrunfile exists in the www directory
+    - another instance is already running with the same config file
+    With --supervise, the supervisor lock is taken instead, because a supervisor waits for the dontrunfile
+    to be removed itself and restarts its child when it exits. An instance that runs without supervisor holds the
+    config file lock, the supervisor would replace its socket.
+    Returns: (lock, reason). The lock for the config file is held by this process when the script can start,
+    otherwise lock is None and reason says why the script should exit.
+    """
+    configFile = configFileFromArgs(args, scriptDir)
+    wwwPath = readSetting([os.path.join(scriptDir, 'settings', 'defaults.cfg'), configFile], 'wwwPath')
+    if wwwPath and os.path.exists(os.path.join(wwwPath, 'do_not_run_brewpi')):
+        return None, "dontrunfile exists"
+    if '--supervise' in args:
+        lock = FileLock(supervisorLockName(configFile))
+    else:
+        lock = FileLock(configLockName(configFile))
+    if not lock.acquire():
+        return None, "already running"
+    if '--supervise' in args and FileLock(configLockName(configFile)).isLocked():
+        lock.release()
+        return None, "already running"
+    return lock, None
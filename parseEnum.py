@@ -17,8 +17,14 @@
 import re
 
 def parseEnumInFile(hFilePath, enumName):
-	messageDict = {}
 	hFile = open(hFilePath)
+	messageDict = parseEnumInLines(hFile, enumName)
+	hFile.close()
+	return messageDict
+
+def parseEnumInLines(lines, enumName):
+	messageDict = {}
+	hFile = iter(lines)
 	regex = re.compile("[A-Z]+\(([A-Za-z][A-Z0-9a-z_]*),\s*\"([^\"]*)\"((?:\s*,\s*[A-Za-z][A-Z0-9a-z_\.]*\s*)*)\)\s*,?")
 	for line in hFile:
 		if 'enum ' + enumName in line:
@@ -40,6 +46,5 @@ def parseEnumInFile(hFilePath, enumName):
 		if 'END enum ' + enumName in line:
 			break
 
-	hFile.close()
 	return messageDict
 
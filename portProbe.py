@@ -0,0 +1,195 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Finds the serial port of the controller when more than one port is possible, for example with port = auto on a
+system with several compatible devices. The serial ports are listed once and all candidates are probed at the same
+time: the first port that answers with a valid BrewPi version is used. The device that was found is remembered by
+its USB VID, PID and serial number, and opened directly at the next start.
+"""
+
+import os
+import Queue
+import threading
+import serial
+import simplejson as json
+
+import autoSerial
+import brewpiVersion
+import BrewPiUtil as util
+
+
+def portCacheFileName():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings', 'portCache.json')
+
+
+def loadCachedPort(key, cacheFileName=None):
+    """
+    Returns: identity of the device that was found last time for these port settings, None when not known
+    """
+    try:
+        with open(cacheFileName or portCacheFileName()) as f:
+            return json.load(f)[key]
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def saveCachedPort(key, identity, cacheFileName=None):
+    cacheFileName = cacheFileName or portCacheFileName()
+    try:
+        with open(cacheFileName) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+    cache[key] = identity
+    try:
+        util.writeFileAtomically(cacheFileName, lambda f: json.dump(cache, f))
+    except (IOError, OSError), e:
+        util.logMessage("Cannot write serial port cache: %s" % str(e))
+
+
+def usedPortSettings(portSettings):
+    return [p for p in portSettings if p is not None and p not in ('None', 'none')]
+
+
+def candidatePorts(portSettings, portInfos):
+    """
+    Params:
+    portSettings: the port and altport settings
+    portInfos: list of serial port info, from autoSerial.find_all_serial_ports
+
+    Returns: list of (port, identity) to try, 'auto' is replaced by all compatible ports
+    """
+    candidates = []
+    for setting in usedPortSettings(portSettings):
+        if setting == 'auto':
+            ports = [p for p in portInfos if autoSerial.recognised_device_name(p) is not None and
+                     'Bootloader' not in autoSerial.recognised_device_name(p)]
+            found = [(p.device, autoSerial.port_identity(p)) for p in ports]
+        else:
+            path = os.path.realpath(setting) if os.path.isabs(setting) else setting
+            found = [(setting, autoSerial.port_identity(p)) for p in portInfos if p.device in (setting, path)]
+            found = found[:1] or [(setting, "port:{0}".format(setting))]
+        for candidate in found:
+            if candidate[0] not in [port for port, identity in candidates]:
+                candidates.append(candidate)
+    return candidates
+
+
+class PortProbe(threading.Thread):
+    """
+    Opens a serial port and requests the version, until a valid version is received or the probe is stopped
+    """
+    def __init__(self, port, identity, baud_rate, time_out, timeout, results, stopped):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.identity = identity
+        self.baud_rate = baud_rate
+        self.time_out = time_out
+        self.timeout = timeout
+        self.results = results  # queue to put the finished probe in
+        self.stopped = stopped  # event that is set when the other probes can stop
+        self.ser = None
+        self.version = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.ser = util.openSerialPort(self.port, self.baud_rate, self.time_out)
+            self.version = brewpiVersion.getVersionFromSerial(self.ser, self.timeout, abort=self.stopped)
+        except (IOError, OSError, serial.SerialException) as e:
+            self.error = str(e)
+        finally:
+            self.results.put(self)
+
+
+def probePorts(candidates, baud_rate, time_out, timeout=5.0):
+    """
+    Probes the candidates in parallel
+    Params:
+    candidates: list of (port, identity)
+    timeout: seconds to wait for a valid version
+
+    Returns: the probe of the first port that answered with a valid version. When no port answered, the probe of the
+    first candidate that could be opened, like when the port is opened without probing. None when no port could be
+    opened. The ports of the other probes are closed.
+    """
+    results = Queue.Queue()
+    stopped = threading.Event()
+    probes = [PortProbe(port, identity, baud_rate, time_out, timeout, results, stopped)
+              for port, identity in candidates]
+    for probe in probes:
+        probe.start()
+    winner = None
+    for i in range(len(probes)):
+        probe = results.get()
+        if probe.version is not None:
+            winner = probe
+            break
+    stopped.set()
+    for probe in probes:
+        probe.join()
+    if winner is None:
+        opened = [probe for probe in probes if probe.ser is not None]
+        winner = opened[0] if opened else None
+    for probe in probes:
+        if probe is not winner and probe.ser is not None:
+            probe.ser.close()
+    return winner, [probe.error for probe in probes if probe.error]
+
+
+def openPort(portSettings, baud_rate=57600, time_out=0.1, probeTimeout=5.0, cacheFileName=None,
+             versionCacheFileName=None):
+    """
+    Opens the serial port of the controller
+    Params:
+    portSettings: the port and altport settings, which can be 'auto', a device name or an URL
+    probeTimeout: seconds to wait for the version when several ports are probed
+
+    Returns: (serial object, error message), the serial object is None when no port could be opened
+    """
+    settings = usedPortSettings(portSettings)
+    portInfos = []
+    if 'auto' in settings or len(settings) > 1:
+        portInfos = list(autoSerial.find_all_serial_ports())  # list the ports only once
+    candidates = candidatePorts(settings, portInfos)
+    if not candidates:
+        return None, "Could not find compatible serial devices \n"
+
+    cacheKey = '|'.join(settings)
+    cachedIdentity = loadCachedPort(cacheKey, cacheFileName) if len(candidates) > 1 else None
+    if cachedIdentity is not None:
+        # the same device as last time is opened without probing, its version is checked after opening
+        candidates.sort(key=lambda candidate: candidate[1] != cachedIdentity)
+    if len(candidates) == 1 or candidates[0][1] == cachedIdentity:
+        port = candidates[0][0]
+        try:
+            return util.openSerialPort(port, baud_rate, time_out), ""
+        except (IOError, OSError, serial.SerialException) as e:
+            if len(candidates) == 1:
+                return None, str(e) + '\n'
+
+    util.logMessage("Probing serial ports %s" % ", ".join(port for port, identity in candidates))
+    probe, errors = probePorts(candidates, baud_rate, time_out, probeTimeout)
+    errorMessage = "".join(error + '\n' for error in errors)
+    if probe is None:
+        return None, errorMessage
+    if probe.version is not None:
+        saveCachedPort(cacheKey, probe.identity, cacheFileName)
+        # the version was received already, it is only checked again in the background after startup
+        brewpiVersion.saveCachedVersion(probe.identity, probe.version, versionCacheFileName)
+    return probe.ser, errorMessage
@@ -0,0 +1,137 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import os
+from BrewPiUtil import logMessage
+from temperatureProfile import TemperatureProfile
+
+
+class ProfileLibrary:
+    """
+    The temperature profiles saved by the web interface, one CSV file per profile in the profiles directory.
+    Keeps an index with metadata of all profiles and the most recently used profiles in compiled form.
+    The active profile is kept by name, activating a profile does not copy any files. The last compiled version of
+    the active profile is kept in memory, so temperature control continues when its file is removed or renamed.
+    """
+    def __init__(self, profilesDir, cacheSize=8):
+        self.profilesDir = profilesDir
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()  # name: TemperatureProfile, least recently used first
+        self.index = {}  # name: metadata dict
+        self.activeName = None
+        self.activeProfile = None  # last compiled version of the active profile
+        self.activeMissing = False  # the file of the active profile cannot be read, this was logged
+
+    def fileName(self, name):
+        return os.path.join(self.profilesDir, name + ".csv")
+
+    def get(self, name):
+        """
+        Returns: compiled TemperatureProfile, compiled again when the file has changed since it was last used.
+        Raises IOError or OSError when the profile does not exist.
+        """
+        profile = self.cache.pop(name, None)
+        if profile is None:
+            profile = TemperatureProfile(self.fileName(name))
+        profile.update()
+        self.cache[name] = profile
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return profile
+
+    def scan(self):
+        """
+        Updates the index with the profiles in the profiles directory. Only new and changed files are parsed.
+        """
+        try:
+            fileNames = os.listdir(self.profilesDir)
+        except OSError:
+            fileNames = []
+        names = set(f[:-len(".csv")] for f in fileNames if f.endswith(".csv"))
+        for name in list(self.index):
+            if name not in names:
+                del self.index[name]
+                self.cache.pop(name, None)
+        for name in names:
+            try:
+                mtime = os.stat(self.fileName(name)).st_mtime
+            except OSError:
+                continue  # removed while scanning
+            entry = self.index.get(name)
+            if entry is None or entry['mtime'] != mtime:
+                try:
+                    profile = self.cache.get(name) or TemperatureProfile(self.fileName(name))
+                    profile.update()
+                except (IOError, OSError):
+                    continue
+                self.index[name] = self.metadata(name, profile)
+
+    def metadata(self, name, profile):
+        temperatures = [t for t in profile.temperatures if t is not None]
+        return {'name': name,
+                'length': len(profile.dates),
+                'duration': (max(profile.dates) - min(profile.dates)) if profile.dates else 0,
+                'minTemp': min(temperatures) if temperatures else None,
+                'maxTemp': max(temperatures) if temperatures else None,
+                'mtime': profile.fileStat[0]}
+
+    def getIndex(self):
+        """
+        Returns: list with metadata of all profiles, sorted by name
+        """
+        self.scan()
+        return [self.index[name] for name in sorted(self.index)]
+
+    def setActive(self, name, maxGap=None):
+        """
+        Makes a profile the active profile, after checking it for errors. Warnings are logged.
+        maxGap: seconds between set points after which a gap is reported as a warning, None to not check gaps
+        Returns: list of errors, the active profile is not changed when it is not empty
+        """
+        try:
+            profile = self.get(name)
+            result = profile.validate(maxGap)
+            errors = result['errors']
+            for warning in result['warnings']:
+                logMessage("Warning for profile '%s': %s" % (name, warning))
+        except (IOError, OSError) as e:
+            errors = ["Cannot read profile: %s" % e.strerror]
+        if not errors:
+            self.activeName = name
+            self.activeProfile = profile
+            self.activeMissing = False
+        return errors
+
+    def getActive(self):
+        """
+        Returns: the active TemperatureProfile, or None when no profile is active. When the file of the active profile
+        cannot be read anymore, the last version that was read is returned.
+        Raises IOError or OSError when the active profile was never read.
+        """
+        if self.activeName is None:
+            return None
+        try:
+            self.activeProfile = self.get(self.activeName)
+            self.activeMissing = False
+        except (IOError, OSError) as e:
+            if self.activeProfile is None:
+                raise
+            if not self.activeMissing:
+                logMessage("Cannot read active profile '%s': %s. Using the last version that was read" %
+                           (self.activeName, e.strerror))
+                self.activeMissing = True
+        return self.activeProfile
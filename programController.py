@@ -20,6 +20,7 @@ import time
 import simplejson as json
 import os
 import brewpiVersion
+import autoSerial
 import expandLogMessage
 from MigrateSettings import MigrateSettings
 from sys import stderr
@@ -350,6 +351,9 @@ class SerialProgrammer:
 
     def fetch_version(self, msg):
         version = brewpiVersion.getVersionFromSerial(self.ser)
+        if version is not None:
+            # brewpi.py uses the cached version at startup, keep it up to date with the new firmware
+            brewpiVersion.saveCachedVersion(autoSerial.device_identity(self.ser.port), version)
         if version is None:
             printStdErr("Warning: Cannot receive version number from controller. " +
                         "Your controller is either not programmed yet or running a very old version of BrewPi. " +
@@ -0,0 +1,231 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Records serial traffic to a compact binary trace file and replays it without a controller attached.
+
+A trace file starts with a header, followed by one record for each chunk of data read from or written to serial:
+a little endian double with the seconds since the start of the trace, a direction character ('r' or 'w'),
+an unsigned 32 bit length and the data itself.
+
+To record, set traceSerial = <path to trace file> in config.cfg.
+To replay through brewpi.py, set port = replay://<path to trace file>?speed=<factor>.
+A speed of 1 replays at real speed, a speed of 0 replays as fast as possible.
+"""
+
+from __future__ import print_function
+import struct
+import sys
+import threading
+import time
+import urlparse
+from virtualSerial import VirtualSerial
+
+try:
+    from time import monotonic
+except ImportError:
+    monotonic = time.time  # python 2 has no monotonic clock
+
+TRACE_HEADER = 'BPTRACE1'
+RECORD = struct.Struct('<dcI')
+READ = 'r'
+WRITE = 'w'
+
+
+class SerialTraceWriter:
+    """
+    Writes timestamped serial data to a trace file. Can be used from the background serial thread and main thread.
+    """
+    def __init__(self, fileName):
+        self.file = open(fileName, 'wb')
+        self.file.write(TRACE_HEADER)
+        self.lock = threading.Lock()
+        self.startTime = monotonic()
+
+    def record(self, direction, data):
+        if not data:
+            return
+        with self.lock:
+            self.file.write(RECORD.pack(monotonic() - self.startTime, direction, len(data)))
+            self.file.write(data)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def readTrace(fileName):
+    """
+    Reads a trace file
+    Returns: generator of (timestamp, direction, data) tuples
+    """
+    with open(fileName, 'rb') as traceFile:
+        if traceFile.read(len(TRACE_HEADER)) != TRACE_HEADER:
+            raise ValueError("%s is not a BrewPi serial trace file" % fileName)
+        while True:
+            header = traceFile.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return  # end of file, or a partial record at the end of an interrupted recording
+            timestamp, direction, length = RECORD.unpack(header)
+            data = traceFile.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, direction, data
+
+
+def recordSerial(ser, fileName, writer=None):
+    """
+    Records all data read from and written to serial port ser in a trace file.
+    writer: SerialTraceWriter of an earlier serial port, to continue its trace instead of starting a new file
+    Returns: the serial port, with read and write replaced by recording versions
+    """
+    if writer is None:
+        writer = SerialTraceWriter(fileName)
+    ser.readUnrecorded = ser.read
+    ser.writeUnrecorded = ser.write
+
+    def readAndRecord(size=1):
+        r = ser.readUnrecorded(size)
+        writer.record(READ, r)
+        return r
+
+    def writeAndRecord(data):
+        written = ser.writeUnrecorded(data)
+        writer.record(WRITE, data)
+        return written
+
+    ser.read = readAndRecord
+    ser.write = writeAndRecord
+    ser.traceWriter = writer
+    return ser
+
+
+class SerialReplayer(VirtualSerial):
+    """
+    A serial port that replays the data read in a trace file. Data written to it is stored in self.written.
+    Replaying is independent of what is written, so each replay of a trace produces the same input.
+    """
+    def __init__(self, fileName, speed=1.0, timeout=None):
+        VirtualSerial.__init__(self, 'replay://' + fileName, timeout=timeout)
+        self.speed = float(speed)
+        self.chunks = [(t, data) for (t, direction, data) in readTrace(fileName) if direction == READ]
+        self.position = 0
+        self.startTime = None
+        self.written = []
+
+    @staticmethod
+    def fromUrl(url, timeout=None):
+        """
+        Creates a replayer from a URL like replay:///home/brewpi/trace.bin?speed=0
+        """
+        parsed = urlparse.urlsplit(url)
+        fileName = parsed.netloc + parsed.path
+        options = urlparse.parse_qs(parsed.query)
+        speed = options.get('speed', ['1'])[0]
+        return SerialReplayer(fileName, speed=speed, timeout=timeout)
+
+    def open(self):
+        VirtualSerial.open(self)
+        if self.startTime is None:
+            self.startTime = monotonic()
+
+    def finished(self):
+        return self.position >= len(self.chunks)
+
+    def poll(self):
+        if self.startTime is None or self.finished():
+            return
+        elapsed = monotonic() - self.startTime
+        data = ''
+        while not self.finished():
+            timestamp, chunk = self.chunks[self.position]
+            if self.speed > 0 and timestamp / self.speed > elapsed:
+                break
+            data += chunk
+            self.position += 1
+        if data:
+            self.feed(data)
+
+    def handle_write(self, data):
+        self.written.append(data)
+
+
+def replay(fileName, speed):
+    """
+    Replays a trace file through BackGroundSerial and the parsing done by brewpi.py and reports the throughput
+    """
+    import simplejson as json
+    import expandLogMessage
+    from backgroundserial import BackGroundSerial
+
+    ser = SerialReplayer(fileName, speed=speed, timeout=0)
+    ser.open()
+    bg_ser = BackGroundSerial(ser)
+    startTime = time.time()
+    startCpu = time.clock()
+    bg_ser.start()
+    lines = 0
+    messages = 0
+    errors = 0
+    idleSince = None
+    lastActivity = startTime
+    while True:
+        line = bg_ser.read_line()
+        message = bg_ser.read_message()
+        if line is None and message is None:
+            if not ser.finished():
+                idleSince = None
+            elif idleSince is None:
+                idleSince = time.time()
+            elif time.time() - idleSince > 0.1:
+                break  # trace is done and the background thread had time to process the last data
+            time.sleep(0.001)
+            continue
+        idleSince = None
+        lastActivity = time.time()
+        if line is not None:
+            lines += 1
+            if len(line) > 2 and line[0] in 'TCSdh':
+                try:
+                    json.loads(line[2:])
+                except json.JSONDecodeError:
+                    errors += 1
+        if message is not None:
+            messages += 1
+            try:
+                expandLogMessage.expandLogMessage(message)
+            except Exception:
+                errors += 1
+    bg_ser.stop()
+    duration = lastActivity - startTime
+    cpu = time.clock() - startCpu
+    print("Replayed {0} lines and {1} log messages in {2:.3f} s ({3:.0f} lines/s), "
+          "{4:.3f} s CPU time, {5} errors".format(lines, messages, duration,
+                                                   (lines + messages) / max(duration, 1e-9), cpu, errors))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ['dump', 'replay']:
+        print("Usage: {0} dump <trace file>\n"
+              "       {0} replay <trace file> [speed, 0 is as fast as possible]".format(sys.argv[0]),
+              file=sys.stderr)
+        sys.exit(1)
+    if sys.argv[1] == 'dump':
+        for (t, direction, data) in readTrace(sys.argv[2]):
+            print("{0:10.4f} {1} {2}".format(t, direction, repr(data)))
+    else:
+        replay(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -0,0 +1,90 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import simplejson as json
+from BrewPiUtil import logMessage, writeFileAtomically
+
+
+class StartupProfile:
+    """
+    Measures how long each phase of the startup of the script takes. The time of each phase is the time since the end
+    of the previous phase. Phases that only wait, like the configured startup delay, do not count for the budget.
+    """
+    def __init__(self, startTime=None, budget=None):
+        """
+        Params:
+        startTime: time the script started, the first phase starts here
+        budget: seconds the startup is expected to take at most, None for no budget
+        """
+        self.startTime = startTime if startTime is not None else time.time()
+        self.budget = budget
+        self.lastTime = self.startTime
+        self.phases = []  # list of (name, seconds, counted)
+
+    def phase(self, name, counted=True, now=None):
+        """
+        Ends the current phase
+        Params:
+        name: description of the phase that just ended
+        counted: False when the phase does not count for the budget
+        """
+        if now is None:
+            now = time.time()
+        self.phases.append((name, now - self.lastTime, counted))
+        self.lastTime = now
+
+    def total(self):
+        """
+        Returns: seconds taken by the phases that count for the budget
+        """
+        return sum(seconds for name, seconds, counted in self.phases if counted)
+
+    def overBudget(self):
+        return self.budget is not None and self.total() > self.budget
+
+    def report(self):
+        """
+        Returns: list of lines with the time taken by each phase
+        """
+        lines = []
+        for name, seconds, counted in self.phases:
+            lines.append("%-20s %7.0f ms%s" % (name, seconds * 1000, "" if counted else " (not counted)"))
+        budget = " of %.0f ms budget" % (self.budget * 1000) if self.budget is not None else ""
+        lines.append("%-20s %7.0f ms%s" % ("total", self.total() * 1000, budget))
+        return lines
+
+    def toDict(self):
+        return dict(time=self.startTime, total=self.total(), budget=self.budget, overBudget=self.overBudget(),
+                    phases=[dict(name=name, seconds=seconds, counted=counted) for name, seconds, counted in self.phases])
+
+    def record(self, fileName, maxRecords=100):
+        """
+        Adds the profile of this startup to a JSON file with the profiles of the last maxRecords startups,
+        to track the startup time over time
+        """
+        try:
+            with open(fileName) as f:
+                records = json.load(f)
+            if not isinstance(records, list):
+                records = []
+        except (IOError, ValueError):
+            records = []
+        records = (records + [self.toDict()])[-maxRecords:]
+        try:
+            writeFileAtomically(fileName, lambda f: json.dump(records, f))
+        except (IOError, OSError), e:
+            logMessage("Cannot write startup profile %s: %s" % (fileName, str(e)))
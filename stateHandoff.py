@@ -0,0 +1,168 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hands the listening socket, the serial port and the state of a running BrewPi instance to a new instance, for
+brewpi.py --handoff. The new instance connects to the socket of the running instance and sends 'handoff'.
+The running instance replies with a JSON header holding its state, followed by its file descriptors. The new
+instance confirms it received them with 'ok', then the running instance exits. Without the confirmation the running
+instance keeps running. The file descriptors are passed with SCM_RIGHTS, which only works on Unix sockets.
+
+The header is sent as 8 digits with its length, followed by the JSON. Each file descriptor is sent with a single
+byte, like _multiprocessing.sendfd does.
+"""
+
+import os
+import select
+import socket
+import struct
+import simplejson as json
+
+try:
+    import _multiprocessing
+except ImportError:
+    _multiprocessing = None
+
+HANDOFF_MESSAGE = 'handoff'
+HANDOFF_ACK = 'ok'
+HEADER_LENGTH_DIGITS = 8
+
+
+def supported():
+    """
+    Returns: True when file descriptors can be passed to another process on this system
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    return hasattr(socket.socket, 'sendmsg') or hasattr(_multiprocessing, 'sendfd')
+
+
+def canHandOff(conn):
+    """
+    Returns: True when file descriptors can be passed over the connection
+    """
+    return supported() and conn.family == socket.AF_UNIX
+
+
+def waitUntilReady(sock, write=False):
+    """
+    Waits until the socket can be read or written. _multiprocessing uses the file descriptor of the socket directly,
+    which fails with EAGAIN instead of waiting when the socket has a timeout.
+    Raises socket.timeout when the socket is not ready within its timeout
+    """
+    timeout = sock.gettimeout()
+    if timeout is None:
+        return  # blocking socket
+    fds = [sock.fileno()]
+    readable, writable, errors = select.select([] if write else fds, fds if write else [], [], timeout)
+    if not readable and not writable:
+        raise socket.timeout("Timeout during handoff")
+
+
+def sendFd(sock, fd):
+    if hasattr(sock, 'sendmsg'):
+        sock.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack('i', fd))])
+    else:
+        waitUntilReady(sock, write=True)
+        _multiprocessing.sendfd(sock.fileno(), fd)
+
+
+def recvFd(sock):
+    if hasattr(sock, 'recvmsg'):
+        size = struct.calcsize('i')
+        message, ancillary, flags, address = sock.recvmsg(1, socket.CMSG_LEN(size))
+        for level, ancillaryType, data in ancillary:
+            if level == socket.SOL_SOCKET and ancillaryType == socket.SCM_RIGHTS:
+                return struct.unpack('i', data[:size])[0]
+        raise socket.error("No file descriptor received")
+    waitUntilReady(sock)
+    return _multiprocessing.recvfd(sock.fileno())
+
+
+def recvExactly(sock, length):
+    data = b''
+    while len(data) < length:
+        received = sock.recv(length - len(data))
+        if not received:
+            raise socket.error("Connection closed during handoff")
+        data += received
+    return data
+
+
+def sendHandoff(conn, state, fds):
+    """
+    Sends the state and file descriptors to the instance that takes over, and waits until it confirms it received them.
+    Raises socket.error or OSError when the handoff failed, the instance that takes over does not use the file
+    descriptors then
+
+    Params:
+    conn: connected Unix socket
+    state: dict that can be written as JSON
+    fds: dict with a name for each file descriptor to pass
+    """
+    names = sorted(fds.keys())
+    header = json.dumps(dict(state=state, fds=names))
+    conn.sendall(('%0' + str(HEADER_LENGTH_DIGITS) + 'd') % len(header) + header)
+    for name in names:
+        sendFd(conn, fds[name])
+    if recvExactly(conn, len(HANDOFF_ACK)) != HANDOFF_ACK:
+        raise socket.error("Handoff was not confirmed")
+
+
+def receiveHandoff(conn):
+    """
+    Receives the state and file descriptors sent by sendHandoff, and confirms they were received
+    Returns: (state, fds), fds is a dict with the file descriptors received by name
+    Raises socket.error, OSError, ValueError or KeyError when the handoff failed, the received file descriptors are
+    closed then
+    """
+    length = int(recvExactly(conn, HEADER_LENGTH_DIGITS))
+    header = json.loads(recvExactly(conn, length))
+    fds = {}
+    try:
+        for name in header['fds']:
+            fds[name] = recvFd(conn)
+        conn.sendall(HANDOFF_ACK)
+    except (socket.error, OSError):
+        for fd in fds.values():
+            os.close(fd)
+        raise
+    return header['state'], fds
+
+
+def requestHandoff(brewPiSocket, timeout=10):
+    """
+    Asks the instance listening on brewPiSocket to hand off its state and file descriptors
+
+    Params:
+    brewPiSocket: BrewPiSocket object for the socket of the running instance
+    timeout: seconds to wait for the running instance
+
+    Returns: (state, fds) like receiveHandoff, (None, {}) when the running instance could not hand off
+    """
+    if not supported() or brewPiSocket.type != 'f':
+        return None, {}
+    conn = brewPiSocket.connect()
+    if not conn:
+        return None, {}
+    try:
+        conn.settimeout(timeout)
+        conn.send(HANDOFF_MESSAGE)
+        return receiveHandoff(conn)
+    except (socket.error, OSError, ValueError, KeyError):
+        return None, {}
+    finally:
+        conn.close()
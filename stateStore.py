@@ -0,0 +1,82 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import simplejson as json
+from BrewPiUtil import logMessage, writeFileAtomically
+
+SNAPSHOT_FORMAT = 1
+
+
+class StateStore:
+    """
+    Keeps a snapshot of the last known state of the controller in a file, so the script can show it directly after
+    a restart, until the controller has sent fresh data.
+    The file is written a short time after the first change, so a burst of changes results in a single write.
+    It is written to a temporary file first and then renamed, so a crash never leaves half a snapshot.
+    """
+    def __init__(self, fileName, writeDelay=2.0):
+        self.fileName = fileName
+        self.writeDelay = writeDelay
+        self.changedTime = None  # time of the first change that has not been written yet
+        self.savedTime = None  # time the loaded snapshot was written
+
+    def load(self):
+        """
+        Returns: the saved state as a dict, None when there is no valid snapshot
+        """
+        try:
+            with open(self.fileName) as f:
+                snapshot = json.load(f)
+        except IOError:
+            return None
+        except ValueError, e:
+            logMessage("Cannot read state snapshot %s: %s" % (self.fileName, str(e)))
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+            return None
+        self.savedTime = snapshot.get('time')
+        return snapshot.get('state')
+
+    def changed(self, *args):
+        """
+        Marks the state as changed. Takes any arguments, so it can be used as callback.
+        """
+        if self.changedTime is None:
+            self.changedTime = time.time()
+
+    def isDue(self, now=None):
+        """
+        Returns: True when the state has changed and the write delay has passed
+        """
+        if self.changedTime is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self.changedTime >= self.writeDelay
+
+    def save(self, state, now=None):
+        """
+        Writes the state to the snapshot file
+        """
+        if now is None:
+            now = time.time()
+        self.changedTime = None
+        try:
+            snapshot = dict(format=SNAPSHOT_FORMAT, time=now, state=state)
+            writeFileAtomically(self.fileName, lambda f: json.dump(snapshot, f))
+        except (IOError, OSError), e:
+            logMessage("Cannot write state snapshot %s: %s" % (self.fileName, str(e)))
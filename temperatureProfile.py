@@ -17,64 +17,267 @@
 import time
 import csv
 import sys
+import os
+import bisect
+import math
 import BrewPiUtil as util
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # previews are calculated point by point without numpy
+
+# a preview is requested over the socket, this limits the memory and time one request can take
+MAX_PREVIEW_POINTS = 2000
+
 
 # also defined in brewpi.py. TODO: move to shared import
 def logMessage(message):
     print >> sys.stderr, time.strftime("%b %d %Y %H:%M:%S   ") + message
 
 
-def getNewTemp(scriptPath):
-    temperatureReader = csv.reader(	open(util.addSlash(scriptPath) + 'settings/tempProfile.csv', 'rb'),
-                                    delimiter=',', quoting=csv.QUOTE_ALL)
-    temperatureReader.next()  # discard the first row, which is the table header
-    prevTemp = None
-    nextTemp = None
-    interpolatedTemp = -99
-    prevDate = None
-    nextDate = None
+class TemperatureProfile:
+    """
+    A temperature profile, compiled from a CSV file with a header row and rows of date and temperature.
+    The file is parsed once into lists of dates (seconds since epoch) and temperatures (float, or None for an empty
+    cell) and parsed again only when its modification time or size changes.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.dates = []
+        self.temperatures = []
+        self.ordered = True  # dates are in ascending order, which allows a binary search
+        self.fileStat = None
+        self.skippedRows = []  # (row number, reason) for rows that could not be parsed
 
+    def isStale(self):
+        try:
+            stat = os.stat(self.fileName)
+        except OSError:
+            return True
+        return (stat.st_mtime, stat.st_size) != self.fileStat
 
-    now = time.mktime(time.localtime())  # get current time in seconds since epoch
+    def update(self):
+        """
+        Compiles the profile again if the file has changed
+        """
+        if self.isStale():
+            self.load()
 
-    for row in temperatureReader:
-        dateString = row[0]
-        try:
-            date = time.mktime(time.strptime(dateString, "%Y-%m-%dT%H:%M:%S"))
-        except ValueError:
-            continue  # skip dates that cannot be parsed
+    def load(self):
+        stat = os.stat(self.fileName)
+        dates = []
+        temperatures = []
+        skippedRows = []
+        with open(self.fileName, 'rb') as profileFile:
+            temperatureReader = csv.reader(profileFile, delimiter=',', quoting=csv.QUOTE_ALL)
+            next(temperatureReader, None)  # discard the first row, which is the table header
+            for rowNumber, row in enumerate(temperatureReader, 2):
+                if len(row) < 2:
+                    continue  # skip empty lines
+                try:
+                    date = time.mktime(time.strptime(row[0], "%Y-%m-%dT%H:%M:%S"))
+                except ValueError:
+                    skippedRows.append((rowNumber, "invalid date '%s'" % row[0]))
+                    continue  # skip dates that cannot be parsed
+                try:
+                    temperature = float(row[1])
+                except ValueError:
+                    if row[1].strip() == '':
+                        # cell is left empty, this is allowed to disable temperature control in part of the profile
+                        temperature = None
+                    else:
+                        # invalid number string, skip this row
+                        skippedRows.append((rowNumber, "invalid temperature '%s'" % row[1]))
+                        continue
+                dates.append(date)
+                temperatures.append(temperature)
+        self.dates = dates
+        self.temperatures = temperatures
+        self.skippedRows = skippedRows
+        self.ordered = all(dates[i] <= dates[i + 1] for i in range(len(dates) - 1))
+        self.fileStat = (stat.st_mtime, stat.st_size)
 
-        try:
-            temperature = float(row[1])
-        except ValueError:
-            if row[1].strip() == '':
-                # cell is left empty, this is allowed to disable temperature control in part of the profile
-                temperature = None
-            else:
-                # invalid number string, skip this row
-                continue
-
-        prevTemp = nextTemp
-        nextTemp = temperature
-        prevDate = nextDate
-        nextDate = date
-        timeDiff = now - nextDate
-        if timeDiff < 0:
-            if prevDate is None:
-                interpolatedTemp = nextTemp  # first set point is in the future
-                break
-            else:
-                if prevTemp is None or nextTemp is None:
-                    # When the previous or next temperature is an empty cell, disable temperature control.
-                    # This is useful to stop temperature control after a while or to not start right away.
-                    interpolatedTemp = None
-                else:
-                    interpolatedTemp = ((now - prevDate) / (nextDate - prevDate) * (nextTemp - prevTemp) + prevTemp)
-                    interpolatedTemp = round(interpolatedTemp, 2)
-                break
-
-    if interpolatedTemp == -99:  # all set points in the past
-        interpolatedTemp = nextTemp
-
-    return interpolatedTemp
+    def nextIndex(self, now):
+        """
+        Returns: index of the first set point after now, or the number of set points if they are all in the past
+        """
+        if self.ordered:
+            return bisect.bisect_right(self.dates, now)
+        for i, date in enumerate(self.dates):
+            if date > now:
+                return i
+        return len(self.dates)
+
+    def getTemp(self, now=None):
+        """
+        Returns: the interpolated temperature at time now (seconds since epoch), or None when temperature control
+        is disabled at that time
+        """
+        if now is None:
+            now = time.mktime(time.localtime())  # get current time in seconds since epoch
+        if not self.dates:
+            return None
+        i = self.nextIndex(now)
+        if i == 0:
+            return self.temperatures[0]  # first set point is in the future
+        if i == len(self.dates):
+            return self.temperatures[-1]  # all set points in the past
+        prevTemp = self.temperatures[i - 1]
+        nextTemp = self.temperatures[i]
+        if prevTemp is None or nextTemp is None:
+            # When the previous or next temperature is an empty cell, disable temperature control.
+            # This is useful to stop temperature control after a while or to not start right away.
+            return None
+        prevDate = self.dates[i - 1]
+        nextDate = self.dates[i]
+        interpolatedTemp = ((now - prevDate) / (nextDate - prevDate) * (nextTemp - prevTemp) + prevTemp)
+        return round(interpolatedTemp, 2)
+
+
+    def nextChange(self, now=None, resolution=0.01):
+        """
+        Calculates when the temperature returned by getTemp will have changed by at least resolution degrees.
+        Before that time, the profile does not have to be evaluated again.
+
+        Returns: time in seconds since epoch, or None if the temperature will not change anymore
+        """
+        if now is None:
+            now = time.mktime(time.localtime())
+        if not self.dates:
+            return None
+        if not self.ordered:
+            return now + 60  # the active segment can change at any row, check again in a minute
+        i = self.nextIndex(now)
+        if i == len(self.dates):
+            return None  # all set points in the past, the temperature stays at the last one
+        if i == 0:
+            return self.dates[0]
+        prevTemp = self.temperatures[i - 1]
+        nextTemp = self.temperatures[i]
+        nextDate = self.dates[i]
+        if prevTemp is None or nextTemp is None or prevTemp == nextTemp:
+            return nextDate  # constant until the next set point
+        prevDate = self.dates[i - 1]
+        slope = (nextTemp - prevTemp) / (nextDate - prevDate)
+        current = self.getTemp(now)
+        # the rounded temperature changes half a step (0.005) before the exact temperature reaches the next value
+        if slope > 0:
+            target = current + resolution - 0.005
+        else:
+            target = current - resolution + 0.005
+        changeTime = math.ceil(prevDate + (target - prevTemp) / slope)
+        return min(max(changeTime, now + 1), nextDate)
+
+
+    def evaluate(self, times):
+        """
+        Evaluates the profile at all times (seconds since epoch) in one pass.
+        Returns: list with a temperature or None for each time, equal to calling getTemp for each time
+        """
+        if numpy is None or not self.ordered or not self.dates:
+            return [self.getTemp(t) for t in times]
+        t = numpy.asarray(times, dtype=float)
+        dates = numpy.asarray(self.dates, dtype=float)
+        temperatures = numpy.asarray([numpy.nan if x is None else x for x in self.temperatures], dtype=float)
+        nextIndex = numpy.searchsorted(dates, t, side='right')
+        i = numpy.clip(nextIndex, 1, max(len(dates) - 1, 1))
+        if len(dates) == 1:
+            values = numpy.repeat(temperatures, len(t))
+        else:
+            prevDates = dates[i - 1]
+            prevTemps = temperatures[i - 1]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                # same order of operations as getTemp, to get exactly the same result
+                values = (t - prevDates) / (dates[i] - prevDates) * (temperatures[i] - prevTemps) + prevTemps
+            values[nextIndex == 0] = temperatures[0]  # first set point is in the future
+            values[nextIndex == len(dates)] = temperatures[-1]  # all set points in the past
+        # empty cells are NaN, which propagates to the segments next to them and disables control there
+        interpolated = (nextIndex > 0) & (nextIndex < len(dates))
+        return [None if math.isnan(v) else (round(v, 2) if interp else v)
+                for (v, interp) in zip(values.tolist(), interpolated.tolist())]
+
+    def validate(self, maxGap=None):
+        """
+        Checks the profile for problems.
+        Errors make the profile unusable: no valid set points or dates that are not in ascending order.
+        Warnings are rows that are skipped because they could not be parsed and gaps longer than maxGap seconds.
+        Returns: dict with lists of error and warning strings
+        """
+        errors = []
+        warnings = ["Row %d skipped: %s" % skipped for skipped in self.skippedRows]
+        if not self.dates:
+            errors.append("Profile has no valid set points")
+        for i in range(len(self.dates) - 1):
+            if self.dates[i + 1] < self.dates[i]:
+                errors.append("Set point %d is earlier than the set point before it" % (i + 2))
+            elif maxGap is not None and self.dates[i + 1] - self.dates[i] > maxGap:
+                warnings.append("Gap of %.1f days after set point %d" % ((self.dates[i + 1] - self.dates[i]) / 86400.0,
+                                                                        i + 1))
+        return {'errors': errors, 'warnings': warnings}
+
+    def preview(self, times=None, points=200, maxGap=None):
+        """
+        Evaluates the profile on a grid of times, by default evenly spaced between the first and last set point.
+        times: list of times (seconds since epoch), at most MAX_PREVIEW_POINTS
+        points: number of points of the default grid, limited to MAX_PREVIEW_POINTS
+        maxGap: passed to validate()
+        Returns: dict with lists of times and temperatures and the result of validate()
+        Raises ValueError or TypeError for invalid times or points
+        """
+        if times is not None:
+            if not isinstance(times, list) or not all(isinstance(t, (int, long, float)) for t in times):
+                raise TypeError("times must be a list of numbers")
+            times = times[:MAX_PREVIEW_POINTS]
+        else:
+            points = max(1, min(int(points), MAX_PREVIEW_POINTS))
+            times = []
+            if self.dates:
+                start = min(self.dates)
+                end = max(self.dates)
+                step = (end - start) / max(points - 1, 1)
+                times = [start + step * n for n in range(points)]
+        result = {'times': list(times), 'temperatures': self.evaluate(times)}
+        result.update(self.validate(maxGap))
+        return result
+
+
+# compiled profiles, by file name
+profiles = {}
+
+
+def getProfile(fileName):
+    """
+    Returns: compiled TemperatureProfile for the file, compiled again only when the file has changed
+    """
+    profile = profiles.get(fileName)
+    if profile is None:
+        profile = TemperatureProfile(fileName)
+        profiles[fileName] = profile
+    profile.update()
+    return profile
+
+
+def invalidate(fileName=None):
+    """
+    Forces the profile to be compiled again on next use, for example because it was replaced by another profile
+    """
+    if fileName is None:
+        profiles.clear()
+    else:
+        profiles.pop(fileName, None)
+
+
+def profileFileName(scriptPath):
+    return util.addSlash(scriptPath) + 'settings/tempProfile.csv'
+
+
+def libraryFileName(wwwPath, name):
+    """
+    Returns: file name of a profile saved in the web interface
+    """
+    return util.addSlash(wwwPath) + "data/profiles/" + name + ".csv"
+
+
+def getNewTemp(scriptPath):
+    return getProfile(profileFileName(scriptPath)).getTemp()
@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+import subprocess
+import BrewPiProcess
+import BrewPiSocket
+import instanceLock
+from tempDirectory import TempDirTestCase
+
+# a fake BrewPi instance: holds the config file lock and exits when it receives a message on its socket
+fakeInstance = """
+import os, sys, signal, socket, time
+sys.path.insert(0, sys.argv[1])
+import instanceLock
+lock = instanceLock.FileLock(instanceLock.configLockName(sys.argv[2]))
+lock.acquire()
+if sys.argv[4] == 'ignoreTerm':
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+if sys.argv[4] == 'listen':
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(sys.argv[3])
+    s.listen(1)
+print 'ready'
+sys.stdout.flush()
+if sys.argv[4] == 'listen':
+    conn, address = s.accept()
+    conn.recv(100)
+    sys.exit(0)
+time.sleep(30)
+"""
+
+lockDir = None
+
+
+def setUpModule():
+    # the locks of the tests, and of the fake instances that inherit the environment, are kept out of the real lock dir
+    global lockDir
+    lockDir = tempfile.mkdtemp()
+    os.environ['BREWPI_LOCK_DIR'] = lockDir
+
+
+def tearDownModule():
+    del os.environ['BREWPI_LOCK_DIR']
+    shutil.rmtree(lockDir)
+
+
+class BrewPiProcessTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.processes = []
+
+    def tearDown(self):
+        for p in self.processes:
+            p.unregister()
+            if os.path.exists(BrewPiProcess.recordPath(p.cfg)):
+                os.remove(BrewPiProcess.recordPath(p.cfg))
+
+    def process(self, name, port, socketPort):
+        config = {'port': port, 'useInetSocket': True, 'socketPort': socketPort}
+        p = BrewPiProcess.fromConfig(os.path.join(self.dir, name), config)
+        self.processes.append(p)
+        return p
+
+    def test_registeredProcessIsFound(self):
+        p = self.process('a.cfg', '/dev/test-a-%d' % os.getpid(), 16332)
+        self.assertFalse(BrewPiProcess.BrewPiProcesses().findConflicts(p))
+        me = BrewPiProcess.BrewPiProcesses().me()
+        self.assertEqual(me.record(), p.record())
+        p.unregister()
+        self.assertEqual(BrewPiProcess.BrewPiProcesses().me(), None)
+
+    def test_conflicts(self):
+        port = '/dev/test-b-%d' % os.getpid()
+        allProcesses = BrewPiProcess.BrewPiProcesses()
+        self.assertFalse(allProcesses.findConflicts(self.process('b.cfg', port, 16333)))
+        self.assertTrue(allProcesses.findConflicts(self.process('b.cfg', port + 'x', 16334)))
+        self.assertTrue(allProcesses.findConflicts(self.process('c.cfg', port, 16335)))
+        self.assertTrue(allProcesses.findConflicts(self.process('d.cfg', port + 'y', 16333)))
+        self.assertFalse(allProcesses.findConflicts(self.process('e.cfg', port + 'z', 16336)))
+        # a process that failed to register does not keep any locks
+        self.assertFalse(allProcesses.findConflicts(self.process('c.cfg', port + 'x', 16334)))
+
+    def test_conflictsAreCheckedWithoutLocking(self):
+        port = '/dev/test-g-%d' % os.getpid()
+        self.assertEqual(self.process('g.cfg', port, 16338).conflicts(), [])
+        self.assertTrue(self.process('g.cfg', port, 16338).register())
+        self.assertEqual(self.process('g.cfg', port + 'x', 16338).conflicts(), ["config file", "socket"])
+        self.assertEqual(self.process('h.cfg', port, 16339).conflicts(), ["serial port"])
+
+    def test_firmwareUpdateIsAConflict(self):
+        lock = instanceLock.firmwareLock()
+        lock.acquire()
+        self.assertTrue(BrewPiProcess.BrewPiProcesses().findConflicts(self.process('f.cfg', '/dev/test-f', 16337)))
+        lock.release()
+        self.assertFalse(instanceLock.firmwareUpdateRunning())
+        self.assertFalse(os.path.exists(lock.path))
+
+
+class QuitCoordinatorTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.children = []
+
+    def tearDown(self):
+        for child in self.children:
+            if child.poll() is None:
+                child.kill()
+            child.wait()
+
+    def startInstance(self, name, mode):
+        p = BrewPiProcess.BrewPiProcess()
+        p.cfg = os.path.join(self.dir, name + '.cfg')
+        p.sock = BrewPiSocket.BrewPiSocket({'scriptPath': os.path.join(self.dir, name), 'useInetSocket': False})
+        os.mkdir(os.path.join(self.dir, name))
+        scriptDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        child = subprocess.Popen([sys.executable, '-c', fakeInstance, scriptDir, p.cfg, p.sock.file, mode],
+                                 stdout=subprocess.PIPE)
+        self.assertEqual(child.stdout.readline().strip(), 'ready')
+        self.children.append(child)
+        p.pid = child.pid
+        return p
+
+    def test_instancesQuitWithoutSignals(self):
+        processes = [self.startInstance('a', 'listen'), self.startInstance('b', 'listen')]
+        self.assertTrue(all(p.isRunning() for p in processes))
+        coordinator = BrewPiProcess.QuitCoordinator(processes, quitTimeout=5.0, termTimeout=1.0)
+        start = time.time()
+        self.assertEqual(coordinator.run(), [])
+        self.assertLess(time.time() - start, 2.0)
+        self.assertEqual(coordinator.escalated, [])
+        self.assertFalse(any(p.isRunning() for p in processes))
+
+    def test_instanceWithoutSocketIsTerminated(self):
+        p = self.startInstance('c', 'noSocket')
+        coordinator = BrewPiProcess.QuitCoordinator([p], quitTimeout=5.0, termTimeout=1.0)
+        self.assertEqual(coordinator.run(), [])
+        self.assertEqual(coordinator.escalated, [(p.pid, BrewPiProcess.QuitCoordinator.TERM)])
+
+    def test_instanceIgnoringTermIsKilled(self):
+        p = self.startInstance('d', 'ignoreTerm')
+        coordinator = BrewPiProcess.QuitCoordinator([p], quitTimeout=0.2, termTimeout=0.2)
+        self.assertEqual(coordinator.run(), [])
+        self.assertEqual(coordinator.escalated, [(p.pid, BrewPiProcess.QuitCoordinator.TERM),
+                                                 (p.pid, BrewPiProcess.QuitCoordinator.KILL)])
+
+    def test_supervisorIsTerminated(self):
+        p = self.startInstance('e', 'ignoreTerm')
+        supervisor = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        self.children.append(supervisor)
+        p.supervisor = supervisor.pid
+        coordinator = BrewPiProcess.QuitCoordinator([p], quitTimeout=0.2, termTimeout=0.2)
+        self.assertEqual(coordinator.run(), [])
+        self.assertEqual(supervisor.wait(), -signal.SIGTERM)
+        self.assertEqual(coordinator.escalated, [(p.pid, BrewPiProcess.QuitCoordinator.TERM),
+                                                 (p.pid, BrewPiProcess.QuitCoordinator.KILL)])
+
+
+if __name__ == '__main__':
+    unittest.main()
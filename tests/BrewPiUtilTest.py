@@ -1,6 +1,8 @@
+import os
 import unittest
 import BrewPiUtil as util
 import simplejson
+from tempDirectory import makeTempDir
 
 class BrewPiUtilsTestCase(unittest.TestCase):
     # test that characters from extended ascii are removed (except degree symbol)
@@ -21,3 +23,19 @@ class BrewPiUtilsTestCase(unittest.TestCase):
         # UnicodeDecodeError: 'utf8' codec can't decode byte 0xb0 in position 2: invalid start byte
         s = util.asciiToUnicode(s)
         simplejson.loads(s)
+
+    def test_writeFileAtomically(self):
+        directory = makeTempDir(self)
+        fileName = os.path.join(directory, 'settings.json')
+        util.writeFileAtomically(fileName, lambda f: f.write('{"a": 1}'))
+        util.writeFileAtomically(fileName, lambda f: f.write('{"a": 2}'))
+        with open(fileName) as f:
+            self.assertEqual(simplejson.load(f), {'a': 2})
+
+        def failingWrite(f):
+            f.write('{"a": ')
+            raise IOError("disk full")
+        self.assertRaises(IOError, util.writeFileAtomically, fileName, failingWrite)
+        with open(fileName) as f:
+            self.assertEqual(simplejson.load(f), {'a': 2})  # the old file is kept
+        self.assertEqual(os.listdir(directory), ['settings.json'])
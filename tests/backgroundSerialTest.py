@@ -0,0 +1,92 @@
+import time
+import unittest
+import Queue
+from backgroundserial import LineQueue, BackGroundSerial
+
+
+class LostSerial:
+    """
+    Serial port that is lost and cannot be opened again
+    """
+    port = 'socket://localhost:1'
+    baudrate = 57600
+    timeout = 0
+
+    def __init__(self):
+        self.opened = 0
+
+    @property
+    def in_waiting(self):
+        raise IOError("device disconnected")
+
+    def isOpen(self):
+        return False
+
+    def open(self):
+        self.opened += 1
+        raise IOError("could not open port")
+
+    def close(self):
+        pass
+
+
+class LineQueueTestCase(unittest.TestCase):
+    def getAll(self, q):
+        lines = []
+        while True:
+            try:
+                lines.append(q.get_nowait())
+            except Queue.Empty:
+                return lines
+
+    def test_coalescedLinesKeepOnlyLatest(self):
+        q = LineQueue(maxsize=10, coalesce='TV')
+        q.put('T:1')
+        q.put('S:1')
+        q.put('T:2')
+        self.assertEqual(self.getAll(q), ['S:1', 'T:2'])
+        self.assertEqual(q.get_stats()['coalesced'], 1)
+
+    def test_fullQueueDropsNewLines(self):
+        q = LineQueue(maxsize=2)
+        q.put('d:1')
+        q.put('d:2')
+        q.put('d:3')
+        self.assertEqual(self.getAll(q), ['d:1', 'd:2'])
+        self.assertEqual(q.get_stats()['dropped'], 1)
+        self.assertEqual(q.get_stats()['highWater'], 2)
+
+    def test_keptLinesReplaceOldestDroppableLine(self):
+        q = LineQueue(maxsize=2, keep='S')
+        q.put('d:1')
+        q.put('h:1')
+        q.put('S:1')
+        q.put('S:2')
+        q.put('S:3')
+        self.assertEqual(self.getAll(q), ['S:1', 'S:2', 'S:3'])
+        self.assertEqual(q.get_stats()['dropped'], 2)
+
+    def test_rateLimitAllowsBurst(self):
+        q = LineQueue(maxsize=100, rate=0.001, burst=3)
+        for i in range(5):
+            q.put('{"logID":%d}' % i)
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(q.get_stats()['rateLimited'], 2)
+
+
+class BackGroundSerialTestCase(unittest.TestCase):
+    def test_stopDoesNotWaitForReconnectDelay(self):
+        ser = LostSerial()
+        bg_ser = BackGroundSerial(ser)
+        bg_ser.reconnect_delay_min = 10.0
+        bg_ser.start()
+        while ser.opened == 0:
+            time.sleep(0.01)
+        self.assertTrue(bg_ser.reconnecting)
+        start = time.time()
+        bg_ser.stop()
+        self.assertLess(time.time() - start, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
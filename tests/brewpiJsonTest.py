@@ -0,0 +1,41 @@
+import unittest
+import simplejson as json
+import brewpiJson
+
+
+class RelaxedJsonTestCase(unittest.TestCase):
+    def test_strictJsonIsDecodedTheSame(self):
+        lines = ['{"bt":19.52,"bs":20.00,"ft":null,"s":0}',
+                 '[{"i":0,"t":1,"a":"28FF93D770160371","v":-1.5e2,"x":true}]',
+                 '{"name":"a \\"quoted\\" \\u00b0 string","list":[],"obj":{}}']
+        for line in lines:
+            self.assertEqual(brewpiJson.parseRelaxedJson(line), json.loads(line))
+
+    def test_unquotedKeysAndValues(self):
+        self.assertEqual(brewpiJson.parseRelaxedJson('{mode:b, beerSet:20.5, fridgeSet:null, unit:&deg;C}'),
+                         {'mode': 'b', 'beerSet': 20.5, 'fridgeSet': None, 'unit': '&deg;C'})
+        self.assertEqual(brewpiJson.parseRelaxedJson('{a:28FF93D7,b:-3}'), {'a': '28FF93D7', 'b': -3})
+
+    def test_truncatedInput(self):
+        for line in ['{"bt":19.5', '{"bt":', '{"a":"abc', '[1,2']:
+            with self.assertRaises(json.JSONDecodeError) as context:
+                brewpiJson.parseRelaxedJson(line)
+            self.assertTrue(context.exception.msg.startswith("Truncated input"))
+
+    def test_invalidInput(self):
+        for line in ['{a 1}', '{a:1}}', '{a:1,}', '{:1}']:
+            self.assertRaises(json.JSONDecodeError, brewpiJson.parseRelaxedJson, line)
+
+    def test_keysAreRenamed(self):
+        expected = {'BeerTemp': 19.5, 'State': 1, 'other': {'bt': 1}}
+        self.assertEqual(brewpiJson.loads('{"bt":19.5,"s":1,"other":{"bt":1}}', brewpiJson.TEMP_KEY_NAMES), expected)
+        self.assertEqual(brewpiJson.parseRelaxedJson('{bt:19.5,s:1,other:{bt:1}}', brewpiJson.TEMP_KEY_NAMES),
+                         expected)
+
+    def test_controllerLinesAreStrict(self):
+        for line in ['{"bt":19.5XYZ}', '{"bt":2x0}', '{"t":xx}', '{bt:19.5}']:
+            self.assertRaises(json.JSONDecodeError, brewpiJson.loads, line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+import simplejson as json
+import brewpiSupervisor
+import instanceLock
+from brewpiSupervisor import Supervisor, childArguments
+from tempDirectory import TempDirTestCase
+
+
+class SupervisorTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.dontRunFile = os.path.join(self.dir, 'do_not_run_brewpi')
+        self.statusFile = os.path.join(self.dir, 'supervisor.json')
+        self.countFile = os.path.join(self.dir, 'count')
+
+    def supervisor(self, script):
+        return Supervisor([sys.executable, '-c', script, self.countFile], self.dontRunFile, self.statusFile,
+                          minRestartDelay=0.01, maxRestartDelay=0.04, pollInterval=0.01)
+
+    def test_restartsUntilCleanExit(self):
+        # the child fails twice, then exits with exit code 0
+        script = ("import sys, os\n"
+                  "n = os.path.getsize(sys.argv[1]) if os.path.exists(sys.argv[1]) else 0\n"
+                  "open(sys.argv[1], 'a').write('x')\n"
+                  "sys.exit(3 if n < 2 else 0)\n")
+        supervisor = self.supervisor(script)
+        self.assertEqual(supervisor.run(), 0)
+        self.assertEqual(os.path.getsize(self.countFile), 3)
+        with open(self.statusFile) as f:
+            status = json.load(f)
+        self.assertEqual(status['starts'], 3)
+        self.assertEqual(status['crashes'], 2)
+        self.assertEqual(status['lastExitCode'], 0)
+        self.assertEqual(status['childPid'], None)
+
+    def test_backoff(self):
+        supervisor = self.supervisor('')
+        supervisor.childStartTime = 0
+        self.assertEqual(supervisor.restartDelay(), 0)
+        for expected in [0.01, 0.02, 0.04, 0.04]:
+            self.assertTrue(supervisor.childExited(1, now=1))
+            self.assertEqual(supervisor.restartDelay(), expected)
+        # a crash after running long enough starts over at the shortest delay
+        self.assertTrue(supervisor.childExited(-9, now=1000))
+        self.assertEqual(supervisor.restartDelay(), 0.01)
+        self.assertFalse(supervisor.childExited(0, now=1001))
+        self.assertFalse(supervisor.childExited(-15, now=1002))  # terminated by another process
+
+    def test_childArguments(self):
+        self.assertEqual(childArguments(['--supervise', '--config', 'a.cfg', '--dontrunfile', '--log']),
+                         ['--config', 'a.cfg', '--log'])
+
+    def test_doesNotReplaceSocketOfRunningInstance(self):
+        lockDir = os.environ.get('BREWPI_LOCK_DIR')
+        os.environ['BREWPI_LOCK_DIR'] = self.dir
+        try:
+            configFile = os.path.join(self.dir, 'config.cfg')
+            with open(configFile, 'w') as f:
+                f.write("scriptPath = %s\nwwwPath = %s\nport = /dev/test-%d\n" % (self.dir, self.dir, os.getpid()))
+            socketFile = os.path.join(self.dir, 'BEERSOCKET')
+            open(socketFile, 'w').close()
+            inode = os.stat(socketFile).st_ino
+            instance = instanceLock.FileLock(instanceLock.configLockName(configFile))
+            instance.acquire()
+            self.assertEqual(brewpiSupervisor.main(['--config', configFile]), 0)
+            self.assertEqual(os.stat(socketFile).st_ino, inode)
+            self.assertFalse(instanceLock.FileLock(instanceLock.supervisorLockName(configFile)).isLocked())
+            instance.release()
+        finally:
+            if lockDir is None:
+                del os.environ['BREWPI_LOCK_DIR']
+            else:
+                os.environ['BREWPI_LOCK_DIR'] = lockDir
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import unittest
+import configobj
+import simplejson as json
+from configStore import ConfigStore, WwwSettings
+from tempDirectory import TempDirTestCase
+
+
+class ConfigStoreTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.defaultsFile = os.path.join(self.dir, 'defaults.cfg')
+        self.configFile = os.path.join(self.dir, 'config.cfg')
+        with open(self.defaultsFile, 'w') as f:
+            f.write("beerName = My First BrewPi Run\ninterval = 60.0\ndataLogging = active\n")
+        with open(self.configFile, 'w') as f:
+            f.write("# my settings\ninterval = 120.0\n")
+
+    def newStore(self, **kwargs):
+        return ConfigStore(self.configFile, self.defaultsFile, **kwargs)
+
+    def test_userConfigOverrulesDefaults(self):
+        config = self.newStore()
+        self.assertEqual(config['beerName'], 'My First BrewPi Run')
+        self.assertEqual(config.getFloat('interval'), 120.0)
+        self.assertEqual(config.get('missing', 'default'), 'default')
+        self.assertEqual(config.getInt('missing', 3), 3)
+        self.assertFalse(config.getBool('missing'))
+
+    def test_changesAreWrittenAfterDelay(self):
+        config = self.newStore(writeDelay=1.0)
+        config.set('dataLogging', 'paused')
+        config.set('interval', 30.0)
+        self.assertEqual(config['dataLogging'], 'paused')
+        self.assertEqual(config['interval'], '30.0')
+        self.assertEqual(configobj.ConfigObj(self.configFile)['interval'], '120.0')
+        self.assertFalse(config.isDue(now=config.changedTime + 0.5))
+        self.assertTrue(config.isDue(now=config.changedTime + 1.0))
+        config.save()
+        self.assertFalse(config.isDue())
+        written = configobj.ConfigObj(self.configFile)
+        self.assertEqual(written['interval'], '30.0')
+        self.assertEqual(written['dataLogging'], 'paused')
+        self.assertNotIn('beerName', written)  # defaults are not copied to the user config
+        self.assertEqual(sorted(os.listdir(self.dir)), ['config.cfg', 'defaults.cfg'])
+
+    def test_ownWriteIsNotReloaded(self):
+        config = self.newStore(checkInterval=0)
+        config.set('beerName', 'IPA')
+        config.save()
+        self.assertFalse(config.reloadIfChanged())
+
+    def test_externalChangeIsReloaded(self):
+        config = self.newStore(checkInterval=10)
+        config.set('dataLogging', 'stopped')
+        with open(self.configFile, 'w') as f:
+            f.write("interval = 300.0\nbeerName = Stout\n")
+        self.assertFalse(config.reloadIfChanged(now=config.lastCheck + 5))
+        self.assertTrue(config.reloadIfChanged(now=config.lastCheck + 10))
+        self.assertEqual(config['beerName'], 'Stout')
+        self.assertEqual(config.getFloat('interval'), 300.0)
+        self.assertEqual(config['dataLogging'], 'stopped')  # the unsaved change is kept
+
+    def test_invalidUserConfigIsNotOverwritten(self):
+        with open(self.configFile, 'w') as f:
+            f.write("beerName = IPA\nbeerName = Stout\n")
+        config = self.newStore()
+        self.assertEqual(config['beerName'], 'My First BrewPi Run')
+        config.set('beerName', 'Porter')
+        config.save()
+        with open(self.configFile) as f:
+            self.assertEqual(f.read(), "beerName = IPA\nbeerName = Stout\n")
+        self.assertEqual(sorted(os.listdir(self.dir)), ['config.cfg', 'defaults.cfg'])
+
+
+class WwwSettingsTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.fileName = os.path.join(self.dir, 'userSettings.json')
+
+    def test_settingsAreWrittenAsStrings(self):
+        with open(self.fileName, 'w') as f:
+            f.write('{"tempFormat": "C"}')
+        settings = WwwSettings(self.fileName)
+        settings.set('beerName', None)
+        settings.set('profileName', 'lager')
+        settings.save()
+        with open(self.fileName) as f:
+            self.assertEqual(json.load(f), {'tempFormat': 'C', 'beerName': 'None', 'profileName': 'lager'})
+
+    def test_corruptFileIsReplaced(self):
+        with open(self.fileName, 'w') as f:
+            f.write('{"tempFormat": ')
+        settings = WwwSettings(self.fileName)
+        settings.set('tempFormat', 'F')
+        settings.save()
+        with open(self.fileName) as f:
+            self.assertEqual(json.load(f), {'tempFormat': 'F'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from controllerLog import ControllerLog, LogRateLimiter, rateOverrides
+
+
+class ControllerLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log = ControllerLog(size=3)
+
+    def add(self, logType, logId, values, now=0):
+        return self.log.add(logType, logId, 'KEY', values, 'text', now=now)
+
+    def test_repeatedMessageIsSummarized(self):
+        self.add('W', 2, [1, "28FF"], now=1)
+        record = self.add('W', 2, [1, "28FF"], now=2)
+        self.assertEqual(record['repeated'], 2)
+        self.assertEqual(record['lastTime'], 2)
+        self.assertEqual(len(self.log.records), 1)
+        record = self.add('W', 2, [2, "28FF"], now=3)
+        self.assertEqual(record['repeated'], 1)
+        self.assertEqual(len(self.log.records), 2)
+
+    def test_bufferIsBounded(self):
+        for i in range(5):
+            self.add('I', i, [])
+        self.assertEqual([r['id'] for r in self.log.records], [2, 3, 4])
+        self.assertEqual(self.log.counts['I0'], 1)
+
+    def test_queryReturnsChangedRecords(self):
+        self.log = ControllerLog(size=10)
+        self.add('E', 1, [])
+        self.add('W', 2, [])
+        seq = self.log.query()['seq']
+        self.add('I', 3, [])
+        self.add('W', 2, [])
+        self.add('W', 2, [])
+        result = self.log.query(since=seq)
+        self.assertEqual([r['id'] for r in result['messages']], [3, 2])
+        self.assertEqual(result['counts'], {'E1': 1, 'W2': 3, 'I3': 1})
+        result = self.log.query(types=['E'])
+        self.assertEqual([r['id'] for r in result['messages']], [1])
+
+    def test_invalidQueryIsRejected(self):
+        self.log = ControllerLog(size=10)
+        self.assertRaises(TypeError, self.log.query, since="12")
+        self.assertRaises(TypeError, self.log.query, since=[])
+        self.assertRaises(TypeError, self.log.query, types='E')
+        self.assertRaises(TypeError, self.log.query, types=[1])
+        self.assertEqual(self.log.query(since=0, types=[u'E'])['messages'], [])
+
+
+class LogRateLimiterTestCase(unittest.TestCase):
+    def test_burstThenRate(self):
+        limiter = LogRateLimiter(rate=0.25, burst=2)
+        allowed = [limiter.allow('W', 2, [1], 'text', now=t) for t in range(13)]
+        self.assertEqual([t for t in range(13) if allowed[t]], [0, 1, 4, 8, 12])
+        self.assertEqual(limiter.suppressed, {'W2': 8})
+
+    def test_messagesWithOtherValuesAreLimitedSeparately(self):
+        limiter = LogRateLimiter(rate=0, burst=1)
+        self.assertTrue(limiter.allow('W', 2, [1], 'one', now=0))
+        self.assertFalse(limiter.allow('W', 2, [1], 'one', now=0))
+        self.assertTrue(limiter.allow('W', 2, [2], 'two', now=0))
+
+    def test_overridePerMessageId(self):
+        overrides = rateOverrides({'I5': ['0', '3'], 'E1': 'invalid', 'E2': '12', 'E3': ['1', '2', '3'],
+                                   'E4': ['x', '1']})
+        limiter = LogRateLimiter(rate=0, burst=1, overrides=overrides)
+        self.assertEqual([limiter.allow('I', 5, [], 'text', now=0) for i in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.overrides.keys(), ['I5'])
+
+    def test_summaries(self):
+        limiter = LogRateLimiter(rate=0, burst=1, summaryInterval=60)
+        for t in range(4):
+            limiter.allow('W', 2, [1], 'text', now=t)
+        limiter.allow('I', 1, [], 'once', now=0)
+        self.assertEqual(limiter.summaries(now=0), [])
+        self.assertEqual(limiter.summaries(now=30), [])
+        self.assertEqual(limiter.summaries(now=60), [('text', 3)])
+        self.assertEqual(limiter.summaries(now=120), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
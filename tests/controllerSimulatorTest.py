@@ -0,0 +1,73 @@
+import unittest
+import simplejson as json
+from serial import SerialException
+import controllerSimulator
+from controllerSimulator import SimulatedController, SimulatedSerial
+
+
+class ControllerSimulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.controller = SimulatedController(seed=1)
+
+    def command(self, data):
+        """
+        Returns: the lines the controller sends in response to data, without line endings
+        """
+        self.controller.write(data)
+        return self.controller.read().splitlines()
+
+    def decode(self, line, prefix):
+        self.assertEqual(line[:2], prefix + ':')
+        return json.loads(line[2:])
+
+    def test_version(self):
+        lines = self.command('n\n')
+        self.assertEqual(len(lines), 1)
+        version = self.decode(lines[0], 'N')
+        self.assertEqual(version['v'], "0.5.0")
+        self.assertEqual(version['l'], 3)
+        self.assertEqual(version['y'], 1)
+
+    def test_settings(self):
+        settings = self.decode(self.command('s')[0], 'S')
+        self.assertEqual(settings['mode'], 'b')
+        self.assertEqual(settings['beerSet'], 20.0)
+
+    def test_temperatures(self):
+        temperatures = self.decode(self.command('t')[0], 'T')
+        self.assertEqual(sorted(temperatures), ['bs', 'bt', 'fs', 'ft', 's'])
+        self.assertAlmostEqual(temperatures['bt'], 18.0, delta=0.1)
+
+    def test_deviceLists(self):
+        installed = self.decode(self.command('d{}')[0], 'd')
+        self.assertEqual([device['i'] for device in installed], [0, 1, 2, 3])
+        available = self.decode(self.command('h{}')[0], 'h')
+        self.assertEqual(len(available), 2)
+
+    def test_relaxedSettingsAreApplied(self):
+        lines = self.command('j{mode:f, fridgeSet:4}')
+        self.assertEqual([line[:2] for line in lines], ['D:', 'D:', 'S:'])
+        settings = self.decode(lines[-1], 'S')
+        self.assertEqual(settings['mode'], 'f')
+        self.assertEqual(settings['fridgeSet'], 4.0)
+
+    def test_commandsAreBuffered(self):
+        self.assertEqual(self.command('j{mode:'), [])
+        self.assertEqual(len(self.command('o}n')), 3)
+
+    def test_urlOptionsAreTyped(self):
+        ser = SimulatedSerial.fromUrl('sim://?delay=0.5&baud=9600&seed=3&logVersion=2&version=0.4.4')
+        self.assertEqual(ser.controller.delay, 0.5)
+        self.assertEqual(ser.controller.baud, 9600)
+        self.assertEqual(ser.controller.versionInfo['l'], 2)
+        self.assertEqual(ser.controller.versionInfo['v'], "0.4.4")
+        self.assertEqual(ser.controller.random.random(), SimulatedController(seed=3).random.random())
+
+    def test_invalidOptions(self):
+        self.assertRaises(SerialException, SimulatedSerial.fromUrl, 'sim://?delay=soon')
+        self.assertRaises(SerialException, SimulatedSerial.fromUrl, 'sim://?speed=1')
+        self.assertEqual(controllerSimulator.parseOptions({}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from controllerState import StateLine
+
+
+class StateLineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state = StateLine('test', dict(mode='b'))
+        self.changes = []
+        self.state.subscribe(self.changes.append)
+
+    def test_defaultsBeforeFirstLine(self):
+        self.assertEqual(self.state['mode'], 'b')
+        self.assertEqual(self.state.json(), '{"mode": "b"}')
+
+    def test_onlyChangesAreReported(self):
+        self.assertTrue(self.state.update('{"mode":"f","fridgeSet":18.0}'))
+        self.assertFalse(self.state.update('{"mode":"f","fridgeSet":18.0}'))
+        self.assertTrue(self.state.update('{"mode":"f","fridgeSet":19.0}'))
+        self.assertEqual(len(self.changes), 2)
+        self.assertEqual(self.state['fridgeSet'], 19.0)
+
+    def test_lineIsDecodedOnlyWhenUsed(self):
+        self.state.update('{"mode":"f"}')
+        self.assertFalse(self.state.decoded)
+        self.assertEqual(self.state.json(), '{"mode":"f"}')
+        self.assertEqual(self.state.get('mode'), 'f')
+        self.assertTrue(self.state.decoded)
+
+    def test_localChangesLastUntilNextLine(self):
+        line = '{"mode":"f","fridgeSet":18.0}'
+        self.state.update(line)
+        self.state['mode'] = 'o'
+        self.assertEqual(self.state['mode'], 'o')
+        self.assertNotEqual(self.state.json(), line)
+        # the same line is a change now, because it differs from the local state
+        self.assertTrue(self.state.update(line))
+        self.assertEqual(self.state['mode'], 'f')
+        self.assertEqual(self.state.json(), line)
+
+    def test_invalidLineKeepsLastValues(self):
+        self.state.update('{"mode":"f"}')
+        self.state.update('{"mode":"p"')
+        self.state.update('{"mode":"o"')
+        self.assertEqual(self.state['mode'], 'f')
+        self.assertEqual(self.state.json(), '{"mode": "f"}')
+
+
+if __name__ == '__main__':
+    unittest.main()
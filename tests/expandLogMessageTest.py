@@ -0,0 +1,97 @@
+import os
+import unittest
+import expandLogMessage
+from tempDirectory import makeTempDir
+
+
+class ExpandLogMessageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = makeTempDir(self)
+        self.originalCacheDir = expandLogMessage.cacheDir
+        self.originalVersionsDir = expandLogMessage.otherVersionsDir
+        expandLogMessage.cacheDir = self.cacheDir + '/'
+        expandLogMessage.otherVersionsDir = self.cacheDir + '/'
+        self.resetCatalogs()
+
+    def tearDown(self):
+        expandLogMessage.cacheDir = self.originalCacheDir
+        expandLogMessage.otherVersionsDir = self.originalVersionsDir
+        self.resetCatalogs()
+
+    def resetCatalogs(self):
+        expandLogMessage.catalogs = {}
+        expandLogMessage.localCatalog = None
+        expandLogMessage.selectedCatalog = None
+
+    def writeOtherVersion(self, version):
+        with open(expandLogMessage.logMessagesFile) as f:
+            header = f.read()
+        header = header.replace('BREWPI_LOG_MESSAGES_VERSION 3', 'BREWPI_LOG_MESSAGES_VERSION %d' % version)
+        header = header.replace('"OneWire initialization failed"', '"OneWire bus not found"')
+        header = header.replace('\tMSG(DS2408_CONNECTED', '\tMSG(NEW_MESSAGE, "New message"),\n\tMSG(DS2408_CONNECTED')
+        with open(self.cacheDir + '/LogMessages-%d.h' % version, 'w') as f:
+            f.write(header)
+
+    def expand(self, logType, logId, values):
+        catalog = expandLogMessage.loadCatalog(expandLogMessage.logMessagesFile)
+        return catalog.expand(logType, logId, values)
+
+    def test_messageIsExpanded(self):
+        self.assertEqual(self.expand('I', 0, [3, "28FF93D770160371"]),
+                         "INFO MESSAGE 0: Temp sensor connected on pin 3, address 28FF93D770160371")
+
+    def test_parametersAreFormatted(self):
+        self.assertEqual(self.expand('E', 2, [9]), "ERROR 2: *** OUT OF MEMORY for device f=Beer Temp")
+        self.assertEqual(self.expand('W', 1, [65]), "WARNING 1: Invalid command received by controller: A")
+        self.assertEqual(self.expand('W', 1, [-1]),
+                         "WARNING 1: Invalid command received by controller: END OF INPUT")
+
+    def test_unknownMessages(self):
+        self.assertEqual(self.expand('E', 1000, []), "ERROR with unknown ID 1000")
+        self.assertEqual(self.expand('X', 1, []), "**UNKNOWN MESSAGE TYPE** with unknown ID 1")
+
+    def test_argumentMismatch(self):
+        self.assertEqual(self.expand('E', 1, []),
+                         "ERROR 1: Cannot find address for sensor on pin %s  | Number of arguments mismatch!, "
+                         "expected 1arguments, received []")
+
+    def test_catalogIsCached(self):
+        catalog = expandLogMessage.loadCatalog(expandLogMessage.logMessagesFile)
+        self.assertEqual(os.listdir(self.cacheDir), ['LogMessages.h.cache'])
+        cached = expandLogMessage.loadCatalog(expandLogMessage.logMessagesFile)
+        self.assertEqual(cached.version, catalog.version)
+        self.assertEqual(cached.messages, catalog.messages)
+
+    def test_corruptCacheIsReplaced(self):
+        with open(self.cacheDir + '/LogMessages.h.cache', 'wb') as f:
+            f.write('not a catalog')
+        self.assertEqual(self.expand('E', 2, [9]), "ERROR 2: *** OUT OF MEMORY for device f=Beer Temp")
+
+    def test_expandJsonString(self):
+        self.assertEqual(expandLogMessage.expandLogMessage('{"logType":"W","logID":6,"V":["28FF93D770160371"]}'),
+                         "WARNING 6: OneWire device (DS2408) disconnected, address 28FF93D770160371")
+
+    def test_decodeLogMessage(self):
+        self.assertEqual(expandLogMessage.decodeLogMessage('{"logType":"E","logID":2,"V":[9]}'),
+                         ('E', 2, 'ERROR_OUT_OF_MEMORY_FOR_DEVICE', [9],
+                          "ERROR 2: *** OUT OF MEMORY for device f=Beer Temp"))
+
+    def test_catalogIsSelectedByVersion(self):
+        self.writeOtherVersion(2)
+        self.assertEqual(expandLogMessage.selectCatalog(2).version, 2)
+        self.assertEqual(expandLogMessage.expandLogMessage('{"logType":"E","logID":11,"V":[]}'),
+                         "ERROR 11: OneWire bus not found")
+        self.assertEqual(expandLogMessage.getVersion(), 3)
+        # no header for version 1, the local copy is used
+        self.assertEqual(expandLogMessage.selectCatalog(1).version, 3)
+        self.assertEqual(expandLogMessage.expandLogMessage('{"logType":"E","logID":11,"V":[]}'),
+                         "ERROR 11: OneWire initialization failed")
+
+    def test_diffCatalogs(self):
+        self.writeOtherVersion(4)
+        diff = expandLogMessage.diffCatalogs(expandLogMessage.getLocalCatalog(), expandLogMessage.findCatalog(4))
+        self.assertEqual(diff, {'added': ['I24'], 'removed': [], 'changed': ['E11', 'I23']})
+
+
+if __name__ == '__main__':
+    unittest.main()
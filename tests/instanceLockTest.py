@@ -0,0 +1,107 @@
+import os
+import unittest
+import instanceLock
+from tempDirectory import TempDirTestCase
+
+
+class InstanceLockTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.lockDir = os.environ.get('BREWPI_LOCK_DIR')
+        os.environ['BREWPI_LOCK_DIR'] = os.path.join(self.dir, 'locks')
+
+    def tearDown(self):
+        if self.lockDir is None:
+            del os.environ['BREWPI_LOCK_DIR']
+        else:
+            os.environ['BREWPI_LOCK_DIR'] = self.lockDir
+
+    def writeFile(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_lockIsExclusive(self):
+        name = 'test-%d' % os.getpid()
+        first = instanceLock.FileLock(name)
+        second = instanceLock.FileLock(name)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertTrue(second.isLocked())
+        first.release()
+        self.assertFalse(second.isLocked())
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_lockFileIsWritableForAllUsers(self):
+        lock = instanceLock.FileLock('test')
+        self.assertTrue(lock.acquire())
+        lock.release()
+        self.assertEqual(os.stat(lock.path).st_mode & 0o777, 0o666)
+
+    def test_readOnlyLockFileCanBeLocked(self):
+        # a lock file created by another user without write permission for others
+        lock = instanceLock.FileLock('test')
+        open(lock.path, 'w').close()
+        os.chmod(lock.path, 0o444)
+        self.assertFalse(lock.isLocked())
+        self.assertTrue(lock.acquire())
+        lock.release()
+
+    def test_firmwareLockIsRemovedOnRelease(self):
+        lock = instanceLock.firmwareLock()
+        self.assertTrue(lock.acquire())
+        self.assertTrue(instanceLock.firmwareUpdateRunning())
+        lock.release()
+        self.assertFalse(os.path.exists(lock.path))
+        self.assertFalse(instanceLock.firmwareUpdateRunning())
+
+    def test_unreadableFirmwareLockIsIgnored(self):
+        path = os.path.join(instanceLock.lockDir(), 'firmware-1.lock')
+        open(path, 'w').close()
+        os.chmod(path, 0)
+        self.assertFalse(instanceLock.firmwareUpdateRunning())
+
+    def test_readSetting(self):
+        defaults = self.writeFile('defaults.cfg', "# comment\nwwwPath = /var/www/html\nport = auto\n")
+        config = self.writeFile('config.cfg', "wwwPath = '/var/www/my brewpi' \nport=COM3 # inline\n"
+                                              "[section]\nport = other\n")
+        self.assertEqual(instanceLock.readSetting([defaults, config], 'wwwPath'), '/var/www/my brewpi')
+        self.assertEqual(instanceLock.readSetting([defaults, config], 'port'), 'COM3')
+        self.assertEqual(instanceLock.readSetting([defaults, '/does/not/exist'], 'missing', 'x'), 'x')
+
+    def test_configFileFromArgs(self):
+        self.assertEqual(instanceLock.configFileFromArgs(['--dontrunfile'], '/home/brewpi'),
+                         '/home/brewpi/settings/config.cfg')
+        self.assertEqual(instanceLock.configFileFromArgs(['-d', '--config', '/tmp/a.cfg'], '/home/brewpi'),
+                         '/tmp/a.cfg')
+        self.assertEqual(instanceLock.configFileFromArgs(['--config=/tmp/b.cfg'], '/home/brewpi'), '/tmp/b.cfg')
+
+    def test_isCronStart(self):
+        self.assertTrue(instanceLock.isCronStart(['--dontrunfile', '--config', '/tmp/-f.cfg']))
+        self.assertTrue(instanceLock.isCronStart(['-ld', '-c', '/tmp/a.cfg']))
+        self.assertTrue(instanceLock.isCronStart(['-d', '-c/tmp/-k.cfg', '--supervise']))
+        self.assertFalse(instanceLock.isCronStart(['--config', '/tmp/a.cfg']))
+        for control in [['--force'], ['-f'], ['--handoff'], ['--quit'], ['-q'], ['--kill'], ['-k']]:
+            self.assertFalse(instanceLock.isCronStart(['--dontrunfile'] + control))
+        self.assertFalse(instanceLock.isCronStart(['-dk']))
+
+    def test_cronStartupCheck(self):
+        wwwPath = os.path.join(self.dir, 'www')
+        os.mkdir(wwwPath)
+        config = self.writeFile('config-%d.cfg' % os.getpid(), "wwwPath = %s\n" % wwwPath)
+        lock, reason = instanceLock.cronStartupCheck(['--dontrunfile', '--config', config], self.dir)
+        self.assertTrue(lock.isHeld())
+        self.assertEqual(instanceLock.cronStartupCheck(['--config', config], self.dir), (None, "already running"))
+        # a supervisor does not start next to an instance that runs without supervisor
+        self.assertEqual(instanceLock.cronStartupCheck(['--supervise', '--config', config], self.dir),
+                         (None, "already running"))
+        self.assertFalse(instanceLock.FileLock(instanceLock.supervisorLockName(config)).isLocked())
+        lock.release()
+        self.writeFile('www/do_not_run_brewpi', '1')
+        self.assertEqual(instanceLock.cronStartupCheck(['--config', config], self.dir), (None, "dontrunfile exists"))
+
+
+if __name__ == '__main__':
+    unittest.main()
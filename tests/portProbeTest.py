@@ -0,0 +1,105 @@
+import os
+import time
+import select
+import threading
+import unittest
+import portProbe
+from tempDirectory import TempDirTestCase
+
+
+class FakePortInfo:
+    def __init__(self, device, vid, pid, serial_number):
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+
+
+class FakeController(threading.Thread):
+    """
+    Answers version requests on the master side of a pseudo terminal
+    """
+    def __init__(self, master):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.master = master
+        self.running = True
+
+    def run(self):
+        while self.running:
+            readable, writable, errors = select.select([self.master], [], [], 0.05)
+            if readable and 'n' in os.read(self.master, 100):
+                os.write(self.master, 'N:{"v":"0.5.0","b":"p","l":3}\n')
+
+
+class PortProbeTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.cacheFile = os.path.join(self.dir, 'portCache.json')
+        self.versionCacheFile = os.path.join(self.dir, 'versionCache.json')
+        self.fds = []
+        self.controllers = []
+        self.serials = []
+
+    def tearDown(self):
+        for controller in self.controllers:
+            controller.running = False
+            controller.join()
+        for ser in self.serials:
+            ser.close()
+        for fd in self.fds:
+            os.close(fd)
+
+    def newPort(self, answers):
+        master, slave = os.openpty()
+        self.fds += [master, slave]
+        if answers:
+            controller = FakeController(master)
+            controller.start()
+            self.controllers.append(controller)
+        return os.ttyname(slave)
+
+    def openPort(self, settings):
+        ser, error = portProbe.openPort(settings, time_out=0.1, probeTimeout=2.0, cacheFileName=self.cacheFile,
+                                        versionCacheFileName=self.versionCacheFile)
+        if ser is not None:
+            self.serials.append(ser)
+        return ser, error
+
+    def test_autoIsReplacedByCompatiblePorts(self):
+        portInfos = [FakePortInfo('/dev/ttyACM0', 0x2B04, 0xC006, 'abc'),
+                     FakePortInfo('/dev/ttyS0', None, None, None),
+                     FakePortInfo('/dev/ttyACM1', 0x2341, 0x0036, '123'),  # bootloader
+                     FakePortInfo('/dev/ttyACM2', 0x2B04, 0xC008, None)]
+        self.assertEqual(portProbe.candidatePorts(['auto', '/dev/ttyACM0'], portInfos),
+                         [('/dev/ttyACM0', 'usb:11012:49158:abc'), ('/dev/ttyACM2', 'port:/dev/ttyACM2')])
+        self.assertEqual(portProbe.candidatePorts(['/dev/ttyUSB0', 'None'], portInfos),
+                         [('/dev/ttyUSB0', 'port:/dev/ttyUSB0')])
+
+    def test_portThatAnswersIsUsed(self):
+        silentPort = self.newPort(answers=False)
+        controllerPort = self.newPort(answers=True)
+        start = time.time()
+        ser, error = self.openPort([silentPort, controllerPort])
+        self.assertLess(time.time() - start, 1.5)  # does not wait for the probe timeout of the silent port
+        self.assertEqual(ser.port, controllerPort)
+        self.assertEqual(portProbe.loadCachedPort(silentPort + '|' + controllerPort, self.cacheFile),
+                         'port:' + controllerPort)
+
+    def test_cachedPortIsOpenedWithoutProbing(self):
+        silentPort = self.newPort(answers=False)
+        otherPort = self.newPort(answers=False)
+        portProbe.saveCachedPort(silentPort + '|' + otherPort, 'port:' + otherPort, self.cacheFile)
+        start = time.time()
+        ser, error = self.openPort([silentPort, otherPort])
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(ser.port, otherPort)
+
+    def test_firstPortIsUsedWhenNoPortAnswers(self):
+        ser, error = self.openPort([self.newPort(answers=False), os.path.join(self.dir, 'missing')])
+        self.assertTrue(ser.isOpen())
+        self.assertIn('missing', error)
+
+
+if __name__ == '__main__':
+    unittest.main()
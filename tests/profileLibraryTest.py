@@ -0,0 +1,79 @@
+import os
+import time
+import unittest
+from profileLibrary import ProfileLibrary
+from tempDirectory import makeTempDir
+
+
+def dateString(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(t))
+
+
+class ProfileLibraryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.start = time.mktime(time.localtime()) + 3600
+        self.profilesDir = makeTempDir(self)
+        self.library = ProfileLibrary(self.profilesDir, cacheSize=2)
+
+    def writeProfile(self, name, rows):
+        with open(os.path.join(self.profilesDir, name + '.csv'), 'w') as f:
+            f.write('"date","temperature","days"\n')
+            for (offset, temperature) in rows:
+                f.write('"%s","%s","0"\n' % (dateString(self.start + offset), temperature))
+
+    def test_indexHasMetadata(self):
+        self.writeProfile('lager', [(0, '10'), (86400, '12'), (172800, '')])
+        self.writeProfile('ale', [(0, '19')])
+        index = self.library.getIndex()
+        self.assertEqual([p['name'] for p in index], ['ale', 'lager'])
+        lager = index[1]
+        self.assertEqual(lager['length'], 3)
+        self.assertEqual(lager['duration'], 172800)
+        self.assertEqual(lager['minTemp'], 10.0)
+        self.assertEqual(lager['maxTemp'], 12.0)
+
+    def test_indexFollowsDirectory(self):
+        self.writeProfile('ale', [(0, '19')])
+        self.assertEqual(len(self.library.getIndex()), 1)
+        self.writeProfile('stout', [(0, '18')])
+        self.assertEqual(len(self.library.getIndex()), 2)
+        os.remove(os.path.join(self.profilesDir, 'ale.csv'))
+        self.assertEqual([p['name'] for p in self.library.getIndex()], ['stout'])
+
+    def test_leastRecentlyUsedProfileIsDropped(self):
+        for name in ['a', 'b', 'c']:
+            self.writeProfile(name, [(0, '20')])
+        self.library.get('a')
+        self.library.get('b')
+        self.library.get('a')
+        self.library.get('c')
+        self.assertEqual(list(self.library.cache), ['a', 'c'])
+
+    def test_activeProfileIsUsedByReference(self):
+        self.writeProfile('ale', [(0, '19')])
+        self.assertEqual(self.library.setActive('ale'), [])
+        self.assertEqual(self.library.activeName, 'ale')
+        self.assertEqual(self.library.getActive().getTemp(), 19.0)
+        self.assertEqual(os.listdir(self.profilesDir), ['ale.csv'])
+
+    def test_removedActiveProfileIsKeptInMemory(self):
+        self.writeProfile('ale', [(0, '19')])
+        self.library.setActive('ale')
+        os.rename(os.path.join(self.profilesDir, 'ale.csv'), os.path.join(self.profilesDir, 'renamed.csv'))
+        self.assertEqual(self.library.getActive().getTemp(), 19.0)
+        self.assertTrue(self.library.activeMissing)
+        self.writeProfile('ale', [(0, '17')])
+        self.assertEqual(self.library.getActive().getTemp(), 17.0)
+        self.assertFalse(self.library.activeMissing)
+
+    def test_invalidProfileIsNotActivated(self):
+        self.writeProfile('ale', [(0, '19')])
+        self.writeProfile('broken', [(1000, '19'), (0, '20')])
+        self.library.setActive('ale')
+        self.assertNotEqual(self.library.setActive('broken'), [])
+        self.assertNotEqual(self.library.setActive('missing'), [])
+        self.assertEqual(self.library.activeName, 'ale')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import serialTrace
+import BrewPiUtil as util
+
+
+class FakeSerial:
+    def __init__(self, incoming):
+        self.incoming = incoming
+        self.outgoing = ''
+
+    def read(self, size=1):
+        data = self.incoming[:size]
+        self.incoming = self.incoming[size:]
+        return data
+
+    def write(self, data):
+        self.outgoing += data
+        return len(data)
+
+
+class SerialTraceTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.traceFile = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.traceFile)
+
+    def record(self, incoming, writes):
+        ser = serialTrace.recordSerial(FakeSerial(incoming), self.traceFile)
+        for data in writes:
+            ser.write(data)
+            ser.read(10)
+        ser.traceWriter.close()
+
+    def test_recordedTraceCanBeRead(self):
+        self.record('T:{"bt":20.0}\n', ['t\n'])
+        records = list(serialTrace.readTrace(self.traceFile))
+        self.assertEqual([(r[1], r[2]) for r in records], [('w', 't\n'), ('r', 'T:{"bt":20')])
+        self.assertTrue(records[0][0] <= records[1][0])
+
+    def test_replayerReturnsRecordedReads(self):
+        self.record('T:{"bt":20.0}\nS:{"mode":"b"}\n', ['t\n', 's\n', 'x\n', 'y\n'])
+        ser = serialTrace.SerialReplayer.fromUrl('replay://' + self.traceFile + '?speed=0', timeout=0)
+        ser.open()
+        self.assertEqual(ser.readline(), 'T:{"bt":20.0}\n')
+        self.assertEqual(ser.readline(), 'S:{"mode":"b"}\n')
+        self.assertTrue(ser.finished())
+        ser.write('t\n')
+        self.assertEqual(ser.written, ['t\n'])
+
+    def test_replacedPortContinuesTrace(self):
+        # after a reconnect, the new serial object records to the same trace
+        ser = serialTrace.recordSerial(FakeSerial(''), self.traceFile)
+        ser.write('t\n')
+        newSer = FakeSerial('T:1\n')
+        util.copySerialWrappers(newSer, ser)
+        newSer.write('s\n')
+        newSer.read(10)
+        ser.traceWriter.close()
+        records = list(serialTrace.readTrace(self.traceFile))
+        self.assertEqual([(r[1], r[2]) for r in records], [('w', 't\n'), ('w', 's\n'), ('r', 'T:1\n')])
+
+    def test_invalidTraceFileRaisesValueError(self):
+        with open(self.traceFile, 'wb') as f:
+            f.write('not a trace')
+        self.assertRaises(ValueError, list, serialTrace.readTrace(self.traceFile))
+
+
+if __name__ == '__main__':
+    unittest.main()
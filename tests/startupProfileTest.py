@@ -0,0 +1,46 @@
+import os
+import unittest
+import simplejson as json
+from startupProfile import StartupProfile
+from tempDirectory import makeTempDir
+
+
+class StartupProfileTestCase(unittest.TestCase):
+    def newProfile(self, budget=None):
+        profile = StartupProfile(startTime=100.0, budget=budget)
+        profile.phase('imports', now=100.2)
+        profile.phase('startup delay', counted=False, now=101.2)
+        profile.phase('version handshake', now=101.5)
+        return profile
+
+    def test_phasesAreTimedFromPreviousPhase(self):
+        profile = self.newProfile()
+        self.assertEqual([name for name, seconds, counted in profile.phases],
+                         ['imports', 'startup delay', 'version handshake'])
+        self.assertAlmostEqual(profile.phases[2][1], 0.3)
+        self.assertAlmostEqual(profile.total(), 0.5)  # the startup delay is not counted
+        self.assertFalse(profile.overBudget())
+
+    def test_budget(self):
+        self.assertFalse(self.newProfile(budget=1.0).overBudget())
+        self.assertTrue(self.newProfile(budget=0.4).overBudget())
+        report = self.newProfile(budget=1.0).report()
+        self.assertEqual(len(report), 4)
+        self.assertIn('not counted', report[1])
+        self.assertIn('1000 ms budget', report[3])
+
+    def test_recordKeepsLastStartups(self):
+        directory = makeTempDir(self)
+        fileName = os.path.join(directory, 'startupProfile.json')
+        for i in range(3):
+            self.newProfile(budget=1.0).record(fileName, maxRecords=2)
+        with open(fileName) as f:
+            records = json.load(f)
+        self.assertEqual(len(records), 2)
+        self.assertAlmostEqual(records[-1]['total'], 0.5)
+        self.assertEqual(records[-1]['phases'][1]['name'], 'startup delay')
+        self.assertEqual(os.listdir(directory), ['startupProfile.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
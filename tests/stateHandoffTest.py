@@ -0,0 +1,103 @@
+import os
+import time
+import socket
+import threading
+import tty
+import unittest
+import BrewPiUtil as util
+import stateHandoff
+
+
+@unittest.skipUnless(stateHandoff.supported(), "file descriptors cannot be passed on this system")
+class StateHandoffTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old, self.new = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        self.old.close()
+        self.new.close()
+
+    def sendHandoff(self, state, fds, delay=0):
+        """
+        Sends the handoff in a thread, like the running instance does in its own process
+        Returns: the thread, its error attribute is the exception raised by sendHandoff
+        """
+        def send():
+            time.sleep(delay)
+            try:
+                stateHandoff.sendHandoff(self.old, state, fds)
+            except (socket.error, OSError) as e:
+                sender.error = e
+        sender = threading.Thread(target=send)
+        sender.error = None
+        sender.start()
+        return sender
+
+    def test_stateAndFileDescriptorsArePassed(self):
+        readEnd, writeEnd = os.pipe()
+        state = {'cs': '{"mode":"b"}', 'deviceList': {'listState': 'dh', 'installed': []}}
+        sender = self.sendHandoff(state, {'pipe': writeEnd})
+        receivedState, fds = stateHandoff.receiveHandoff(self.new)
+        sender.join()
+        self.assertEqual(sender.error, None)
+        self.assertEqual(receivedState, state)
+        self.assertNotEqual(fds['pipe'], writeEnd)
+        os.close(writeEnd)  # the received copy stays open
+        os.write(fds['pipe'], 'T:{}\n')
+        os.close(fds['pipe'])
+        self.assertEqual(os.read(readEnd, 100), 'T:{}\n')
+        os.close(readEnd)
+
+    def test_serialPortIsPassed(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)  # configured by pyserial when the previous instance opened the port
+        ser = util.serialFromFileDescriptor(os.dup(slave), os.ttyname(slave), time_out=1)
+        os.close(slave)
+        sender = self.sendHandoff({}, {'serial': util.serialFileDescriptor(ser)})
+        state, fds = stateHandoff.receiveHandoff(self.new)
+        sender.join()
+        ser.close()
+        received = util.serialFromFileDescriptor(fds['serial'], ser.port, time_out=1)
+        os.write(master, 'N:{"v":"0.5.0"}\n')
+        self.assertEqual(received.readline(), 'N:{"v":"0.5.0"}\n')
+        received.write('n')
+        self.assertEqual(os.read(master, 1), 'n')
+        received.close()
+        os.close(master)
+
+    def test_socketsWithTimeout(self):
+        # requestHandoff and the running instance set a timeout on their connection
+        self.old.settimeout(2)
+        self.new.settimeout(2)
+        readEnd, writeEnd = os.pipe()
+        sender = self.sendHandoff({'logSeq': 3}, {'a': readEnd, 'b': writeEnd}, delay=0.2)
+        state, fds = stateHandoff.receiveHandoff(self.new)
+        sender.join()
+        self.assertEqual(sender.error, None)
+        self.assertEqual(state, {'logSeq': 3})
+        for fd in [readEnd, writeEnd] + fds.values():
+            os.close(fd)
+
+    def test_fileDescriptorIsAwaitedWithTimeout(self):
+        self.new.settimeout(2)
+        readEnd, writeEnd = os.pipe()
+        sender = threading.Timer(0.2, stateHandoff.sendFd, [self.old, writeEnd])
+        sender.start()
+        received = stateHandoff.recvFd(self.new)  # the file descriptor is sent after the receiver started waiting
+        sender.join()
+        for fd in [readEnd, writeEnd, received]:
+            os.close(fd)
+
+    def test_unconfirmedHandoffFails(self):
+        self.old.settimeout(0.2)
+        readEnd, writeEnd = os.pipe()
+        self.new.close()  # the new instance is gone
+        sender = self.sendHandoff({}, {'pipe': writeEnd})
+        sender.join()
+        self.assertIsInstance(sender.error, (socket.error, OSError))
+        os.close(readEnd)
+        os.close(writeEnd)
+
+
+if __name__ == '__main__':
+    unittest.main()
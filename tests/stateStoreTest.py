@@ -0,0 +1,40 @@
+import os
+import unittest
+from stateStore import StateStore
+from tempDirectory import TempDirTestCase
+
+
+class StateStoreTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.fileName = os.path.join(self.dir, 'controllerState.json')
+
+    def test_savedStateIsLoaded(self):
+        state = {'cs': '{"mode":"f"}', 'deviceList': {'listState': 'dh', 'installed': [{'i': 0}]}, 'logSeq': 12}
+        StateStore(self.fileName).save(state, now=100.0)
+        store = StateStore(self.fileName)
+        self.assertEqual(store.load(), state)
+        self.assertEqual(store.savedTime, 100.0)
+        self.assertEqual(os.listdir(self.dir), ['controllerState.json'])
+
+    def test_missingOrInvalidSnapshot(self):
+        self.assertEqual(StateStore(self.fileName).load(), None)
+        with open(self.fileName, 'w') as f:
+            f.write('{"format": 1, "state": {"cs":')  # truncated
+        self.assertEqual(StateStore(self.fileName).load(), None)
+
+    def test_writeIsDelayedAfterFirstChange(self):
+        store = StateStore(self.fileName, writeDelay=2.0)
+        self.assertFalse(store.isDue())
+        store.changed()
+        firstChange = store.changedTime
+        store.changed('another change')
+        self.assertEqual(store.changedTime, firstChange)
+        self.assertFalse(store.isDue(now=firstChange + 1.0))
+        self.assertTrue(store.isDue(now=firstChange + 2.0))
+        store.save({})
+        self.assertFalse(store.isDue(now=firstChange + 3.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import shutil
+import tempfile
+import unittest
+
+
+def makeTempDir(testCase):
+    """
+    Returns: a new temporary directory, which is removed with its content when the test has finished
+    """
+    directory = tempfile.mkdtemp()
+    testCase.addCleanup(shutil.rmtree, directory, True)
+    return directory
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    Test case with a temporary directory self.dir for each test
+    """
+    def setUp(self):
+        self.dir = makeTempDir(self)
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import time
+import unittest
+import temperatureProfile
+
+
+def dateString(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(t))
+
+
+class TemperatureProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.start = time.mktime(time.localtime()) + 3600
+        handle, self.fileName = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+
+    def tearDown(self):
+        temperatureProfile.invalidate()
+        os.remove(self.fileName)
+
+    def writeProfile(self, rows):
+        with open(self.fileName, 'w') as f:
+            f.write('"date","temperature","days",profile name\n')
+            for (offset, temperature) in rows:
+                f.write('"%s","%s","0"\n' % (dateString(self.start + offset), temperature))
+
+    def test_temperatureIsInterpolated(self):
+        self.writeProfile([(0, '20'), (1000, '22')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(profile.getTemp(self.start - 10), 20.0)
+        self.assertEqual(profile.getTemp(self.start + 250), 20.5)
+        self.assertEqual(profile.getTemp(self.start + 333), 20.67)
+        self.assertEqual(profile.getTemp(self.start + 5000), 22.0)
+
+    def test_emptyCellDisablesControl(self):
+        self.writeProfile([(0, '20'), (1000, ''), (2000, '18')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(profile.getTemp(self.start + 500), None)
+        self.assertEqual(profile.getTemp(self.start + 1500), None)
+        self.assertEqual(profile.getTemp(self.start + 2500), 18.0)
+
+    def test_invalidRowsAreSkipped(self):
+        self.writeProfile([(0, '20'), (500, 'abc'), (1000, '22')])
+        with open(self.fileName, 'a') as f:
+            f.write('"not a date","19","0"\n\n')
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(profile.getTemp(self.start + 500), 21.0)
+
+    def test_unorderedProfileUsesFirstFutureSetPoint(self):
+        self.writeProfile([(0, '20'), (2000, '24'), (1000, '22')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertFalse(profile.ordered)
+        self.assertEqual(profile.getTemp(self.start + 1000), 22.0)
+        self.assertEqual(profile.getTemp(self.start + 3000), 22.0)
+
+    def test_changedFileIsCompiledAgain(self):
+        self.writeProfile([(0, '20')])
+        self.assertEqual(temperatureProfile.getProfile(self.fileName).getTemp(), 20.0)
+        self.writeProfile([(0, '18.5'), (10, '18.5')])
+        self.assertEqual(temperatureProfile.getProfile(self.fileName).getTemp(), 18.5)
+
+    def test_nextChangeOnRamp(self):
+        self.writeProfile([(0, '20'), (1000, '21')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        now = self.start + 100
+        changeTime = profile.nextChange(now)
+        self.assertEqual(profile.getTemp(changeTime - 1), profile.getTemp(now))
+        self.assertAlmostEqual(profile.getTemp(changeTime), profile.getTemp(now) + 0.01)
+        changeTime = profile.nextChange(now, resolution=0.1)
+        self.assertAlmostEqual(profile.getTemp(changeTime), profile.getTemp(now) + 0.1)
+
+    def test_nextChangeOnConstantSegment(self):
+        self.writeProfile([(0, '20'), (1000, '20'), (2000, '18')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(profile.nextChange(self.start - 100), self.start)
+        self.assertEqual(profile.nextChange(self.start + 100), self.start + 1000)
+        self.assertEqual(profile.nextChange(self.start + 3000), None)
+
+    def test_evaluateEqualsGetTemp(self):
+        self.writeProfile([(0, ''), (1000, '20'), (2000, '21.5'), (3000, ''), (4000, '18'), (4000, '19'),
+                           (5000, '17')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        times = [self.start + t for t in range(-500, 6000, 125)]
+        self.assertEqual(profile.evaluate(times), [profile.getTemp(t) for t in times])
+
+    def test_validateReportsErrorsAndWarnings(self):
+        self.writeProfile([(0, '20'), (1000, 'abc'), (864000, '21'), (500, '22')])
+        result = temperatureProfile.getProfile(self.fileName).validate(maxGap=86400)
+        self.assertEqual(result['errors'], ["Set point 3 is earlier than the set point before it"])
+        self.assertEqual(result['warnings'], ["Row 3 skipped: invalid temperature 'abc'",
+                                              "Gap of 10.0 days after set point 1"])
+
+    def test_previewChecksGaps(self):
+        self.writeProfile([(0, '20'), (864000, '21')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(profile.preview(points=3)['warnings'], [])
+        self.assertEqual(profile.preview(points=3, maxGap=86400)['warnings'], ["Gap of 10.0 days after set point 1"])
+
+    def test_previewChecksRequest(self):
+        self.writeProfile([(0, '20'), (864000, '21')])
+        profile = temperatureProfile.getProfile(self.fileName)
+        self.assertEqual(len(profile.preview(points=10 ** 9)['times']), temperatureProfile.MAX_PREVIEW_POINTS)
+        self.assertEqual(len(profile.preview(points=-5)['times']), 1)
+        self.assertRaises(ValueError, profile.preview, points='many')
+        self.assertRaises(TypeError, profile.preview, points=[3])
+        self.assertRaises(TypeError, profile.preview, times='abc')
+        self.assertRaises(TypeError, profile.preview, times=[0, 'noon'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import os
 import unittest
-from brewpiVersion import AvrInfo
+import brewpiVersion
+from brewpiVersion import AvrInfo, VersionHandshake
+from tempDirectory import makeTempDir
 from distutils.version import LooseVersion
 
 
@@ -78,6 +81,14 @@ class VersionTestCase(unittest.TestCase):
         self.assertEqual(v.simulator, False)
         self.assertEqual(v.shield, AvrInfo.shield_revC)
 
+    def test_dictRoundTrip(self):
+        v = AvrInfo('{"v":"1.2.3","n":"99","c":"12345678", "b":"p", "y":1, "s":5, "l":2}')
+        restored = AvrInfo.fromDict(v.toDict())
+        self.assertVersionEqual(restored, "1.2.3")
+        self.assertEqual(restored.toExtendedString(), v.toExtendedString())
+        self.assertEqual(restored.family, AvrInfo.family_spark)
+        self.assertEqual(restored.log, 2)
+
     def test_canPrintExtendedVersionEmpty(self):
         v = AvrInfo("")
         self.assertEqual("BrewPi v0.0.0", v.toExtendedString());
@@ -109,5 +120,40 @@ class VersionTestCase(unittest.TestCase):
         v = AvrInfo('{"v":"1.2.3","c":"12345678", "b":"x", "y":1, "s":2 }')
         self.assertEqual("a Spark Core",v.articleFullName())
 
+class VersionHandshakeTestCase(unittest.TestCase):
+    def test_finishesOnFirstValidVersion(self):
+        handshake = VersionHandshake(timeout=10, retryInterval=1, now=0)
+        self.assertTrue(handshake.poll(now=0))
+        self.assertFalse(handshake.poll(now=0.5))
+        self.assertFalse(handshake.feed('T:{"bt":20.0}\n'))
+        self.assertFalse(handshake.feed('N:{"v":"0.0.0"}\n'))
+        self.assertTrue(handshake.feed('N:{"v":"0.5.0","l":2}\n'))
+        self.assertEqual(handshake.version.toString(), "0.5.0")
+        self.assertFalse(handshake.poll(now=1.0))
+
+    def test_retriesUntilTimeout(self):
+        handshake = VersionHandshake(timeout=3, retryInterval=1, now=0)
+        requests = [t / 10.0 for t in range(0, 40) if handshake.poll(now=t / 10.0)]
+        self.assertEqual(requests, [0.0, 1.0, 2.0])
+        self.assertTrue(handshake.isFinished())
+        self.assertEqual(handshake.version, None)
+
+    def test_versionCache(self):
+        directory = makeTempDir(self)
+        cacheFile = os.path.join(directory, 'versionCache.json')
+        self.assertEqual(brewpiVersion.loadCachedVersion('usb:1:2:abc', cacheFile), None)
+        brewpiVersion.saveCachedVersion('usb:1:2:abc', AvrInfo('{"v":"0.5.0","b":"p","l":2}'), cacheFile)
+        brewpiVersion.saveCachedVersion('usb:1:3:def', AvrInfo('{"v":"0.4.4","b":"y"}'), cacheFile)
+        cached = brewpiVersion.loadCachedVersion('usb:1:2:abc', cacheFile)
+        self.assertEqual(cached.toString(), "0.5.0")
+        self.assertEqual(cached.board, AvrInfo.board_p1)
+        brewpiVersion.forgetCachedVersion('usb:1:2:abc', cacheFile)
+        self.assertEqual(brewpiVersion.loadCachedVersion('usb:1:2:abc', cacheFile), None)
+        self.assertEqual(brewpiVersion.loadCachedVersion('usb:1:3:def', cacheFile).toString(), "0.4.4")
+        # a port name does not identify the controller
+        brewpiVersion.saveCachedVersion('port:/dev/ttyACM1', AvrInfo('{"v":"0.4.4","b":"y"}'), cacheFile)
+        self.assertEqual(brewpiVersion.loadCachedVersion('port:/dev/ttyACM1', cacheFile), None)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks the serial processing of the script without a controller attached.
+
+For each message mix and baud rate, generated controller output is fed through BackGroundSerial and processed
+like brewpi.py does (JSON decoding, renaming temperature keys, expanding log messages). Measured are lines per
+second, CPU time per line and the latency between a line arriving and it being read from the queue.
+The command round trip time is measured against the simulated controller. The socket round trip time is measured
+for the requests of the web interface to brewpi.py, running with the simulated controller.
+
+Usage: python benchmarkSerial.py [--lines <n>] [--bauds <b1,b2>] [--duration <s>] [--output <file>]
+                                 [--compare <file>]
+"""
+
+from __future__ import print_function
+import getopt
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+import simplejson as json
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")  # append parent directory to be able to import files
+import brewpiJson
+import expandLogMessage
+import BrewPiSocket
+from backgroundserial import BackGroundSerial
+from virtualSerial import VirtualSerial
+from controllerSimulator import SimulatedController, SimulatedSerial
+
+def temperatureLine(r):
+    return 'T:{"bt":%.2f,"bs":20.00,"ft":%.2f,"fs":18.50,"s":%d}' % (r.uniform(15, 25), r.uniform(10, 25),
+                                                                       r.randint(0, 8))
+
+
+def deviceListLine(r):
+    devices = [{"i": i, "t": 5, "c": 1, "b": 0, "f": r.randint(0, 15), "h": 2, "d": 0, "p": 0, "v": r.uniform(10, 25),
+                "j": 0.0, "a": "28FF%012X" % r.getrandbits(48)} for i in range(r.randint(4, 10))]
+    return r.choice(['d:', 'h:']) + json.dumps(devices)
+
+
+def logMessageLine(r):
+    return 'D:{"logType":"W","logID":2,"V":[%d,"28FF93D770160371"]}' % r.randint(0, 20)
+
+
+def settingsLine(r):
+    return 'S:{"mode":"b","beerSet":20.00,"fridgeSet":%.2f,"heatEst":0.199,"coolEst":5.000}' % r.uniform(10, 25)
+
+
+# each mix is a list of (weight, line generator)
+mixes = {
+    'temperature': [(90, temperatureLine), (8, settingsLine), (2, logMessageLine)],
+    'deviceList': [(50, deviceListLine), (40, temperatureLine), (10, logMessageLine)],
+    'logFlood': [(70, logMessageLine), (30, temperatureLine)],
+}
+
+
+def generateLines(mix, count, seed=1):
+    r = random.Random(seed)
+    weighted = []
+    for weight, generator in mixes[mix]:
+        weighted += [generator] * weight
+    return [r.choice(weighted)(r) + "\r\n" for i in range(count)]
+
+
+class FloodSerial(VirtualSerial):
+    """
+    Serial port that makes the pre-generated lines available at the given baud rate and records when each line
+    arrived, separately for log messages and other lines. The arrivals are (text, time) in the order the lines were
+    sent, so a line read from the queue can be matched to its arrival even when lines before it were dropped.
+    """
+    def __init__(self, lines, baud):
+        VirtualSerial.__init__(self, 'flood://', timeout=0)
+        self.data = ''.join(lines)
+        self.baud = baud
+        self.lineEnds = []
+        end = 0
+        for line in lines:
+            end += len(line)
+            self.lineEnds.append((end, line))
+        self.position = 0
+        self.nextLine = 0
+        self.lineArrivals = deque()
+        self.messageArrivals = deque()
+        self.startTime = None
+
+    def open(self):
+        VirtualSerial.open(self)
+        self.startTime = time.time()
+
+    def finished(self):
+        return self.position >= len(self.data)
+
+    def poll(self):
+        if self.finished():
+            return
+        now = time.time()
+        if self.baud > 0:
+            allowed = min(len(self.data), int((now - self.startTime) * self.baud / 10))
+        else:
+            allowed = len(self.data)
+        if allowed <= self.position:
+            return
+        self.feed(self.data[self.position:allowed])
+        self.position = allowed
+        while self.nextLine < len(self.lineEnds) and self.lineEnds[self.nextLine][0] <= allowed:
+            line = self.lineEnds[self.nextLine][1]
+            if line.startswith('D:'):
+                self.messageArrivals.append((line[2:].strip(), now))
+            else:
+                self.lineArrivals.append((line.strip(), now))
+            self.nextLine += 1
+
+
+def matchArrival(arrivals, text):
+    """
+    Finds the arrival of a line that was read from the queue. Arrivals of earlier lines that were never read are
+    removed from arrivals.
+    Returns: (arrival time or None when the line was not sent, number of earlier lines that were never read)
+    """
+    text = text.strip()
+    missed = 0
+    while arrivals:
+        sent, arrival = arrivals.popleft()
+        if sent == text:
+            return arrival, missed
+        missed += 1
+    return None, missed
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def processLine(line):
+    """
+    Does the same work as brewpi.py for a line received from the controller
+    """
+    if line[0] == 'T':
+        newData = brewpiJson.loads(line[2:])
+        brewpiJson.renameKeys(newData, brewpiJson.TEMP_KEY_NAMES)
+    elif line[0] in 'SCdh':
+        brewpiJson.loads(line[2:])
+
+
+def benchmarkThroughput(mix, baud, count):
+    ser = FloodSerial(generateLines(mix, count), baud)
+    ser.open()
+    # every line has to be processed to measure throughput: no queue limits, no rate limit and no coalescing
+    bg_ser = BackGroundSerial(ser, max_lines=0, max_messages=0, message_rate=None)
+    bg_ser.queue.coalesce = ''
+    lineLatencies = []
+    missed = 0
+    messageLatencies = []
+    startTime = time.time()
+    startCpu = time.clock()
+    bg_ser.start()
+    lines = 0
+    messages = 0
+    lastActivity = startTime
+    while True:
+        line = bg_ser.read_line()
+        message = bg_ser.read_message()
+        now = time.time()
+        if line is None and message is None:
+            if ser.finished() and now - lastActivity > 0.1:
+                break
+            time.sleep(0.0005)
+            continue
+        lastActivity = now
+        if line is not None:
+            arrival, skipped = matchArrival(ser.lineArrivals, line)
+            missed += skipped
+            if arrival is not None:
+                lineLatencies.append(now - arrival)
+            lines += 1
+            processLine(line)
+        if message is not None:
+            arrival, skipped = matchArrival(ser.messageArrivals, message)
+            missed += skipped
+            if arrival is not None:
+                messageLatencies.append(now - arrival)
+            messages += 1
+            expandLogMessage.expandLogMessage(message)
+    cpu = time.clock() - startCpu
+    bg_ser.stop()
+    stats = bg_ser.get_stats()
+    missed += len(ser.lineArrivals) + len(ser.messageArrivals)  # sent, but never read
+    duration = lastActivity - startTime
+    total = lines + messages
+    latencies = lineLatencies + messageLatencies
+    return {'mix': mix, 'baud': baud, 'lines': lines, 'messages': messages,
+            'linesPerSecond': total / max(duration, 1e-9),
+            'cpuPerLine': cpu / max(total, 1),
+            'latencyP50': percentile(latencies, 50),
+            'latencyP99': percentile(latencies, 99),
+            'dropped': stats['lines']['dropped'] + stats['messages']['dropped'] + stats['messages']['rateLimited'],
+            'coalesced': stats['lines']['coalesced'],
+            'missed': missed}
+
+
+def benchmarkRoundTrip(delay, count):
+    """
+    Measures the time between writing a command and reading the parsed response
+    """
+    ser = SimulatedSerial(SimulatedController(delay=delay, baud=57600), timeout=0)
+    ser.open()
+    bg_ser = BackGroundSerial(ser)
+    bg_ser.start()
+    roundTrips = []
+    for i in range(count):
+        start = time.time()
+        bg_ser.writeln('s')
+        while True:
+            line = bg_ser.read_line()
+            if line is not None and line[0] == 'S':
+                json.loads(line[2:])
+                break
+            if time.time() - start > 5:
+                break  # no response, do not wait forever
+            time.sleep(0.0005)
+        roundTrips.append(time.time() - start)
+    bg_ser.stop()
+    return {'delay': delay, 'commands': count,
+            'rttP50': percentile(roundTrips, 50), 'rttP99': percentile(roundTrips, 99)}
+
+
+def socketRequest(sock, message):
+    """
+    Sends a request to brewpi.py on the socket described by BrewPiSocket sock, like the web interface does
+    Returns: the response, None when brewpi.py is not listening
+    """
+    try:
+        conn = socket.create_connection((sock.host, sock.port))
+    except socket.error:
+        return None
+    try:
+        conn.send(message)
+        return conn.recv(65536)
+    finally:
+        conn.close()
+
+
+def freePort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def benchmarkSocketRoundTrip(count, requests=('getTemperatures', 'getControlSettings'), startTimeout=30):
+    """
+    Starts brewpi.py with the simulated controller in a temporary directory and measures the time between sending a
+    request on its socket, like the web interface does, and receiving the decoded response
+    Returns: dict with the round trip times per request, None when brewpi.py did not start
+    """
+    directory = tempfile.mkdtemp()
+    scriptDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    configFile = os.path.join(directory, 'config.cfg')
+    os.mkdir(os.path.join(directory, 'www'))
+    # a TCP socket, because the file socket is always created in the script directory
+    config = {'scriptPath': directory, 'useInetSocket': True, 'socketPort': freePort()}
+    with open(configFile, 'w') as f:
+        f.write("scriptPath = {0}\nwwwPath = {0}/www\nport = sim://\naltport = None\ndataLogging = stopped\n"
+                "stateFile = {0}/state.json\nuseInetSocket = True\nsocketPort = {1}\n".format(
+                    directory, config['socketPort']))
+    env = dict(os.environ, BREWPI_LOCK_DIR=os.path.join(directory, 'locks'))
+    with open(os.path.join(directory, 'brewpi.log'), 'w') as log:
+        process = subprocess.Popen([sys.executable, os.path.join(scriptDir, 'brewpi.py'), '--config', configFile],
+                                   stdout=log, stderr=log, env=env)
+    sock = BrewPiSocket.BrewPiSocket(config)
+    try:
+        start = time.time()
+        while True:
+            if process.poll() is not None or time.time() - start > startTimeout:
+                return None
+            response = socketRequest(sock, 'getTemperatures')
+            if response and response != 'null':
+                break  # running, and the temperatures were received from the controller
+            time.sleep(0.1)
+        result = {'requests': count}
+        for request in requests:
+            roundTrips = []
+            for i in range(count):
+                start = time.time()
+                json.loads(socketRequest(sock, request))
+                roundTrips.append(time.time() - start)
+            result[request] = {'rttP50': percentile(roundTrips, 50), 'rttP99': percentile(roundTrips, 99)}
+        return result
+    finally:
+        if process.poll() is None:
+            socketRequest(sock, 'quit')
+            for i in range(50):
+                if process.poll() is not None:
+                    break
+                time.sleep(0.1)
+            else:
+                process.kill()
+        process.wait()
+        shutil.rmtree(directory)
+
+
+def scriptVersion():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    oldResults = dict(((r['mix'], r['baud']), r) for r in old['throughput'])
+    for r in new['throughput']:
+        o = oldResults.get((r['mix'], r['baud']))
+        if o:
+            print("{0:>12} {1:>7} baud: {2:9.0f} -> {3:9.0f} lines/s ({4:+.0%})".format(
+                r['mix'], r['baud'], o['linesPerSecond'], r['linesPerSecond'],
+                r['linesPerSecond'] / o['linesPerSecond'] - 1))
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ['help', 'lines=', 'bauds=', 'duration=', 'output=',
+                                                       'compare='])
+    except getopt.GetoptError:
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    count = 2000
+    bauds = [0, 57600]
+    duration = 5.0
+    outputFile = None
+    compareFile = None
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        if o == '--lines':
+            count = int(a)
+        if o == '--bauds':
+            bauds = [int(b) for b in a.split(',')]
+        if o == '--duration':
+            duration = float(a)
+        if o == '--output':
+            outputFile = a
+        if o == '--compare':
+            compareFile = a
+
+    results = {'version': scriptVersion(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'throughput': [], 'roundTrip': [], 'socketRoundTrip': None}
+    invalid = False
+    for mix in sorted(mixes):
+        averageLength = sum(len(l) for l in generateLines(mix, 100)) / 100.0
+        for baud in bauds:
+            lines = count
+            if baud > 0:
+                # limit the number of lines so a slow baud rate does not take forever
+                lines = max(10, min(count, int(duration * baud / 10 / averageLength)))
+            r = benchmarkThroughput(mix, baud, lines)
+            results['throughput'].append(r)
+            print("{mix:>12} {baud:>7} baud: {linesPerSecond:9.0f} lines/s, {0:7.1f} us CPU/line, "
+                  "latency p50 {1:.1f} ms, p99 {2:.1f} ms".format(r['cpuPerLine'] * 1e6, r['latencyP50'] * 1e3,
+                                                                  r['latencyP99'] * 1e3, **r))
+            if r['missed']:
+                print("{mix:>12} {baud:>7} baud: {missed} lines were not processed ({dropped} dropped, "
+                      "{coalesced} coalesced), the results are not valid".format(**r), file=sys.stderr)
+                invalid = True
+    for delay in [0.0, 0.01]:
+        r = benchmarkRoundTrip(delay, 50)
+        results['roundTrip'].append(r)
+        print("command round trip with {0:.0f} ms controller delay: p50 {1:.1f} ms, p99 {2:.1f} ms".format(
+            delay * 1e3, r['rttP50'] * 1e3, r['rttP99'] * 1e3))
+    r = benchmarkSocketRoundTrip(50)
+    results['socketRoundTrip'] = r
+    if r is None:
+        print("brewpi.py did not start with the simulated controller, socket round trip not measured", file=sys.stderr)
+        invalid = True
+    else:
+        for request in sorted(k for k in r if k != 'requests'):
+            print("socket round trip of {0}: p50 {1:.1f} ms, p99 {2:.1f} ms".format(
+                request, r[request]['rttP50'] * 1e3, r[request]['rttP99'] * 1e3))
+
+    if outputFile:
+        with open(outputFile, 'w') as f:
+            json.dump(results, f, indent=2)
+    if compareFile:
+        with open(compareFile) as f:
+            compare(json.load(f), results)
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,7 @@ from gitHubReleases import gitHubReleases
 import BrewPiUtil as util
 import autoSerial
 import serial
+import instanceLock
 from programController import SerialProgrammer
 
 serialPorts = []
@@ -170,6 +171,10 @@ for o, a in opts:
     if o in ('--noreset',):
         noReset = True
 
+# BrewPi will not start while the firmware is updated, the lock is released when this script exits
+firmwareLock = instanceLock.firmwareLock()
+firmwareLock.acquire()
+
 dfuPath = "dfu-util"
 # check whether dfu-util can be found
 if distutils.spawn.find_executable('dfu-util') is None:
@@ -50,6 +50,6 @@ sudo apt-get install -y apache2 libapache2-mod-php5 php5-cli php5-common php5-cg
 
 echo -e "\n***** Installing/updating required python packages via pip... *****\n"
 
-sudo pip install pyserial psutil simplejson configobj gitpython --upgrade
+sudo pip install pyserial simplejson configobj gitpython --upgrade
 
 echo -e "\n***** Done processing BrewPi dependencies *****\n"
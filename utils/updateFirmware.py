@@ -23,6 +23,7 @@ import subprocess
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..") # append parent directory to be able to import files
 import autoSerial
+import instanceLock
 
 # print everything in this file to stderr so it ends up in the correct log file for the web UI
 def printStdErr(*objs):
@@ -36,6 +37,16 @@ def quitBrewPi(webPath):
 
 
 def updateFromGitHub(userInput, beta, useDfu, restoreSettings = True, restoreDevices = True):
+    # BrewPi will not start while the firmware is updated
+    firmwareLock = instanceLock.firmwareLock()
+    firmwareLock.acquire()
+    try:
+        return doUpdateFromGitHub(userInput, beta, useDfu, restoreSettings, restoreDevices)
+    finally:
+        firmwareLock.release()
+
+
+def doUpdateFromGitHub(userInput, beta, useDfu, restoreSettings, restoreDevices):
     import BrewPiUtil as util
     from gitHubReleases import gitHubReleases
     import brewpiVersion
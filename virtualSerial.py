@@ -0,0 +1,143 @@
+# Copyright 2016 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from serial import SerialException
+
+
+class VirtualSerial(object):
+    """
+    Base class for serial ports that do not have hardware behind them, like trace replayers and simulators.
+    It implements the part of the pyserial interface that is used by BrewPi.
+    Subclasses call feed() to make data available for reading and override handle_write() and poll().
+    """
+    def __init__(self, port, baudrate=57600, timeout=None):
+        self.port = port
+        self.name = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = None
+        self.inter_byte_timeout = None
+        self.is_open = False
+        self.disconnected = False
+        self._rx = ''
+        self._lock = threading.Lock()
+        self._data_available = threading.Condition(self._lock)
+
+    # methods to override in subclasses
+
+    def poll(self):
+        """
+        Called before reading, gives subclasses the opportunity to feed data that has become available
+        """
+        pass
+
+    def handle_write(self, data):
+        """
+        Called for all data written to the port
+        """
+        pass
+
+    # methods for subclasses
+
+    def feed(self, data):
+        with self._data_available:
+            self._rx += data
+            self._data_available.notify_all()
+
+    # pyserial interface
+
+    def open(self):
+        self.disconnected = False
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    def _check_port(self):
+        if not self.is_open:
+            raise SerialException("Port {0} is not open".format(self.port))
+        if self.disconnected:
+            raise SerialException("Device {0} disconnected".format(self.port))
+
+    @property
+    def in_waiting(self):
+        self._check_port()
+        self.poll()
+        return len(self._rx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        self._check_port()
+        deadline = None
+        if self.timeout:
+            deadline = time.time() + self.timeout
+        while True:
+            self.poll()
+            with self._data_available:
+                if self._rx or self.timeout == 0 or self.disconnected:
+                    data = self._rx[:size]
+                    self._rx = self._rx[size:]
+                    return data
+                remaining = 0.01
+                if deadline is not None:
+                    remaining = min(remaining, deadline - time.time())
+                    if remaining <= 0:
+                        return ''
+                self._data_available.wait(remaining)
+
+    def readline(self):
+        self._check_port()
+        deadline = None
+        if self.timeout:
+            deadline = time.time() + self.timeout
+        while True:
+            self.poll()
+            with self._data_available:
+                if '\n' in self._rx:
+                    line, sep, self._rx = self._rx.partition('\n')
+                    return line + sep
+                if self.timeout == 0 or (deadline is not None and time.time() >= deadline):
+                    data = self._rx
+                    self._rx = ''
+                    return data
+                self._data_available.wait(0.01)
+
+    def write(self, data):
+        self._check_port()
+        self.handle_write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def reset_output_buffer(self):
+        self.flushOutput()